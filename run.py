@@ -1,10 +1,13 @@
 import sys
+import multiprocessing
 
 def main():
     from src.pys4_avatar_maker.ui_main import main as gui_main
     gui_main()
 
 if __name__ == "__main__":
+    # Batch mode spawns worker processes; required for frozen (PyInstaller) builds
+    multiprocessing.freeze_support()
     if '--compile' in sys.argv:
         from src.pys4_avatar_maker.compile_dist import build_exe
         build_exe()
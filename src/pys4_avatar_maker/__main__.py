@@ -1,4 +1,7 @@
-from .ui_main import main
+import sys
+import multiprocessing
+from .cli import main
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    multiprocessing.freeze_support()
+    sys.exit(main())
\ No newline at end of file
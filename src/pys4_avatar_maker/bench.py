@@ -0,0 +1,235 @@
+import sys
+import json
+import time
+import shutil
+import logging
+import platform
+import statistics
+import tempfile
+import threading
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence
+import numpy as np
+from PIL import Image
+from .models import AvatarPackage, UserType, DDSFormat, FTPConfig, AVATAR_SIZES
+from .dds import ENCODER_VERSION
+from .resample import resample_chain, resample_stack
+from .utils import load_rgba, build_mip_chain, encode_dds, zip_entries, zip_files, convert_to_dds
+from .services import process_avatar, package_avatar, upload_via_ftp, process_batch_avatars
+
+logger = logging.getLogger("pys4_avatar_maker.bench")
+
+BENCH_FORMAT_VERSION = 1
+DEFAULT_SIZES = (512, 2048, 8192)
+DEFAULT_BATCH_COUNTS = (1, 100, 1000)
+DEFAULT_THRESHOLD = 0.10
+# The linear-light engine, single images and stacks of RESIZE_STACK alike, measured at
+# 0.6-1.05x the time of Pillow's sRGB Lanczos on the (opaque) synthetic inputs. The margin
+# above 1 only absorbs run-to-run noise: beyond this factor ``bench run`` fails.
+RESIZE_MAX_SLOWDOWN = 1.25
+RESIZE_STACK = 4
+
+def make_synthetic_image(size: int, seed: int = 0) -> Image.Image:
+    """Deterministic photo-like RGB test image: smooth gradients, edges and some noise."""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:size, 0:size].astype(np.float32) / size
+    r = 255 * (0.5 + 0.5 * np.sin(6.0 * x + 3.0 * y + seed))
+    g = 255 * y
+    b = 255 * ((x * 8).astype(np.int32) % 2) * 0.6 + 60 * x
+    rgb = np.stack([r, g, b], axis=-1) + rng.normal(0, 8, (size, size, 3))
+    return Image.fromarray(np.clip(rgb, 0, 255).astype(np.uint8), 'RGB')
+
+def write_synthetic_inputs(directory: Path, sizes: Sequence[int] = DEFAULT_SIZES) -> Dict[str, Path]:
+    """Write one PNG and one JPEG per size; returns ``{'png-512': path, ...}``."""
+    directory.mkdir(parents=True, exist_ok=True)
+    inputs = {}
+    for size in sizes:
+        img = make_synthetic_image(size, seed=size)
+        for fmt, suffix in (('png', '.png'), ('jpeg', '.jpg')):
+            path = directory / f"synthetic_{size}{suffix}"
+            img.save(path, format=fmt.upper(), **({'quality': 90} if fmt == 'jpeg' else {}))
+            inputs[f"{fmt}-{size}"] = path
+    return inputs
+
+def time_call(fn: Callable[[], object], repeat: int = 5, warmup: int = 1) -> Dict[str, float]:
+    for _ in range(warmup):
+        fn()
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        runs.append(time.perf_counter() - start)
+    return {'median': statistics.median(runs), 'min': min(runs), 'mean': statistics.fmean(runs), 'runs': repeat}
+
+def _start_ftp_server(root: Path):
+    """
+    In-process pyftpdlib server on an ephemeral port, or None when pyftpdlib is missing.
+    Returns ``(server, stop, thread)``; setting ``stop`` closes it from its own thread.
+    """
+    try:
+        from pyftpdlib.authorizers import DummyAuthorizer
+        from pyftpdlib.handlers import FTPHandler
+        from pyftpdlib.servers import ThreadedFTPServer
+    except ImportError:
+        return None
+    logging.getLogger('pyftpdlib').setLevel(logging.WARNING)
+    authorizer = DummyAuthorizer()
+    authorizer.add_user('bench', 'bench', str(root), perm='elradfmwMT')
+    handler = type('BenchFTPHandler', (FTPHandler,), {'authorizer': authorizer})
+    server = ThreadedFTPServer(('127.0.0.1', 0), handler)
+    stop = threading.Event()
+
+    def serve():
+        while not stop.is_set():
+            server.serve_forever(timeout=0.1, blocking=False)
+        server.close_all()
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    return server, stop, thread
+
+def bench_stages(inputs: Dict[str, Path], work: Path, repeat: int) -> Dict[str, Dict[str, float]]:
+    results = {}
+    for label, path in inputs.items():
+        pkg = AvatarPackage(image_path=path, user_type=UserType.LOCAL, output_path=work / f"{label}.xavatar")
+        # Decode the way the pipeline does: reduced to what the largest surface needs
+        img = load_rgba(path, max(AVATAR_SIZES))
+        chain = build_mip_chain(img)
+        results[f"decode/{label}"] = time_call(lambda path=path: load_rgba(path, max(AVATAR_SIZES)), repeat)
+        for name, fn, count in ((f"resize/{label}", lambda img=img: resample_chain(img), 1),
+                                (f"resize_stack/{label}", lambda img=img: resample_stack([img] * RESIZE_STACK),
+                                 RESIZE_STACK),
+                                (f"resize_pillow/{label}", lambda img=img: build_mip_chain(img), 1)):
+            # Per image, so a stack compares directly with single-image resizing
+            timing = time_call(fn, repeat)
+            results[name] = {key: value / count if key != 'runs' else value for key, value in timing.items()}
+            results[name]['mpix_per_s'] = img.width * img.height / results[name]['median'] / 1e6
+        results[f"convert_to_dds/{label}"] = time_call(lambda path=path, label=label: convert_to_dds(path, work / f"{label}.dds", 440),
+                                                        repeat)
+        results[f"process_avatar/{label}"] = time_call(lambda pkg=pkg: process_avatar(pkg), repeat)
+        results[f"package_avatar/{label}"] = time_call(lambda pkg=pkg: package_avatar(pkg), repeat)
+        logger.info(f"Benchmarked stages for {label}")
+    img440 = chain[440]
+    for fmt in DDSFormat:
+        results[f"dds_encode/{fmt.value}-440"] = time_call(lambda fmt=fmt: encode_dds(img440, fmt), repeat)
+    entries = process_avatar(AvatarPackage(image_path=next(iter(inputs.values())), user_type=UserType.OFFLINE_ACTIVATED,
+                                           output_path=work / 'entries.xavatar'))
+    results["zip_entries/memory"] = time_call(lambda: zip_entries(entries), repeat)
+    files = []
+    for arcname, data in entries.items():
+        (work / arcname).write_bytes(data)
+        files.append(work / arcname)
+    results["zip_files/disk"] = time_call(lambda: zip_files(files, work / 'files.xavatar'), repeat)
+    return results
+
+def bench_batches(source: Path, work: Path, counts: Sequence[int], workers: Optional[int]) -> Dict[str, Dict[str, float]]:
+    results = {}
+    for count in counts:
+        in_dir, out_dir = work / f"batch_in_{count}", work / f"batch_out_{count}"
+        in_dir.mkdir()
+        out_dir.mkdir()
+        images = []
+        for i in range(count):
+            images.append(in_dir / f"{i:05d}{source.suffix}")
+            shutil.copyfile(source, images[-1])
+        result = process_batch_avatars(images, UserType.LOCAL, out_dir, workers=workers)
+        results[f"process_batch_avatars/{count}"] = {
+            'median': result.elapsed, 'min': result.elapsed, 'mean': result.elapsed, 'runs': 1,
+            'per_item': result.elapsed / max(count, 1), 'failed': result.failed,
+        }
+        logger.info(f"Benchmarked batch of {count}: {result.elapsed:.2f}s")
+    return results
+
+def bench_ftp(package: Path, work: Path, repeat: int) -> Dict[str, Dict[str, float]]:
+    root = work / 'ftp_root'
+    root.mkdir()
+    started = _start_ftp_server(root)
+    if started is None:
+        logger.warning("pyftpdlib is not installed, skipping FTP benchmarks")
+        return {}
+    server, stop, thread = started
+    try:
+        cfg = FTPConfig(host='127.0.0.1', port=server.address[1], username='bench', password='bench', upload_dir='/')
+        return {"upload_via_ftp/one-shot": time_call(lambda: upload_via_ftp(cfg, package), repeat)}
+    finally:
+        stop.set()
+        thread.join()
+
+def run_benchmarks(sizes: Sequence[int] = DEFAULT_SIZES, counts: Sequence[int] = DEFAULT_BATCH_COUNTS,
+                   repeat: int = 5, workers: Optional[int] = None, ftp: bool = True) -> dict:
+    """Run every benchmark group in a scratch directory and return the JSON-ready report."""
+    work = Path(tempfile.mkdtemp(prefix='pys4_bench_'))
+    previous_level = logging.getLogger("pys4_avatar_maker").level
+    # The pipeline logs every file at INFO; that would dominate the timings
+    for name in ("services", "utils", "ftp", "cache", "manifest"):
+        logging.getLogger(f"pys4_avatar_maker.{name}").setLevel(logging.WARNING)
+    try:
+        inputs = write_synthetic_inputs(work / 'inputs', sizes)
+        results = bench_stages(inputs, work, repeat)
+        smallest = inputs[f"png-{min(sizes)}"]
+        results.update(bench_batches(smallest, work, counts, workers))
+        if ftp:
+            package = work / 'upload.xavatar'
+            package_avatar(AvatarPackage(image_path=smallest, user_type=UserType.LOCAL, output_path=package))
+            results.update(bench_ftp(package, work, repeat))
+    finally:
+        for name in ("services", "utils", "ftp", "cache", "manifest"):
+            logging.getLogger(f"pys4_avatar_maker.{name}").setLevel(previous_level)
+        shutil.rmtree(work, ignore_errors=True)
+    return {
+        'version': BENCH_FORMAT_VERSION,
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'machine': platform.machine(),
+            'encoder_version': ENCODER_VERSION,
+            'sizes': list(sizes),
+            'counts': list(counts),
+            'repeat': repeat,
+        },
+        'results': results,
+    }
+
+def save_report(report: dict, path: Path):
+    path.write_text(json.dumps(report, indent=2), encoding='utf-8')
+
+def load_report(path: Path) -> dict:
+    return json.loads(path.read_text(encoding='utf-8'))
+
+def check_resize_throughput(report: dict, max_slowdown: float = RESIZE_MAX_SLOWDOWN) -> List[str]:
+    """
+    Names of the ``resize/`` and ``resize_stack/`` benchmarks whose per-image throughput
+    is below 1/``max_slowdown`` of Pillow's (``resize_pillow/``) on the same input.
+    """
+    results = report.get('results', {})
+    slow = []
+    for name, engine in results.items():
+        kind, _, label = name.partition('/')
+        pillow = results.get(f"resize_pillow/{label}") if kind in ('resize', 'resize_stack') else None
+        if pillow is not None and engine['median'] > max_slowdown * pillow['median']:
+            slow.append(name)
+    return slow
+
+def compare_reports(baseline: dict, candidate: dict, threshold: float = DEFAULT_THRESHOLD) -> List[dict]:
+    """
+    Compare the median of every benchmark present in both reports. Each row carries
+    the relative ``change`` and is flagged as a ``regression`` when the candidate is
+    slower than the baseline by more than ``threshold`` (0.10 = 10%).
+    """
+    rows = []
+    base, cand = baseline.get('results', {}), candidate.get('results', {})
+    for name in sorted(set(base) & set(cand)):
+        before, after = base[name]['median'], cand[name]['median']
+        change = (after - before) / before if before > 0 else 0.0
+        rows.append({'name': name, 'baseline': before, 'candidate': after, 'change': change,
+                     'regression': change > threshold, 'improvement': change < -threshold})
+    return rows
+
+def format_comparison(rows: List[dict]) -> str:
+    width = max((len(row['name']) for row in rows), default=10)
+    lines = [f"{'benchmark':<{width}}  {'baseline':>10}  {'candidate':>10}  {'change':>8}"]
+    for row in rows:
+        flag = '  REGRESSION' if row['regression'] else '  faster' if row['improvement'] else ''
+        lines.append(f"{row['name']:<{width}}  {row['baseline'] * 1000:>8.2f}ms  {row['candidate'] * 1000:>8.2f}ms  "
+                     f"{row['change']:>+7.1%}{flag}")
+    return '\n'.join(lines)
@@ -0,0 +1,154 @@
+import os
+import sys
+import shutil
+import hashlib
+import logging
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+from .models import AvatarPackage, CacheStats
+from .dds import ENCODER_VERSION
+from .resample import RESAMPLER_VERSION
+from .utils import write_atomic, link_or_copy
+from .zipwriter import format_codec_rules
+
+logger = logging.getLogger("pys4_avatar_maker.cache")
+
+DEFAULT_CACHE_BYTES = 512 * 1024 * 1024
+
+def default_cache_dir() -> Path:
+    if os.getenv("PYS4_CACHE_DIR"):
+        return Path(os.environ["PYS4_CACHE_DIR"])
+    if sys.platform == "win32" and os.getenv("LOCALAPPDATA"):
+        return Path(os.environ["LOCALAPPDATA"]) / "pyS4AvatarMaker" / "cache"
+    return Path(os.getenv("XDG_CACHE_HOME", Path.home() / ".cache")) / "pys4_avatar_maker"
+
+class PackageCache:
+    """
+    On-disk, content-addressed store of finished .xavatar payloads.
+    Entries are keyed on the source bytes plus everything that affects the output
+    (user type, sizes, DDS format, encoder and resampler versions, ZIP codecs) and evicted
+    least-recently-used once the store grows past ``max_bytes``. With ``link`` a hit
+    hardlinks the entry to the output path instead of copying it.
+
+    A copy sent to a worker process looks entries up by path and never scans the
+    store; it hands what it did back via ``changes()`` for ``merge()`` in the parent,
+    which keeps the LRU index and does the evicting.
+    """
+    def __init__(self, root: Optional[Path] = None, max_bytes: int = DEFAULT_CACHE_BYTES, link: bool = False):
+        self.root = Path(root) if root else default_cache_dir()
+        self.max_bytes = max_bytes
+        self.link = link
+        self.stats = CacheStats()
+        self._index: Optional['OrderedDict[str, int]'] = None
+        self._size = 0
+        self._detached = False
+        self._stored: Dict[str, int] = {}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.update(_index=None, _size=0, stats=CacheStats(), _detached=True, _stored={})
+        return state
+
+    def changes(self) -> Optional[Tuple[CacheStats, Dict[str, int]]]:
+        """
+        A worker copy's counters and the entries it stored (key -> size), for ``merge()``;
+        None on the cache itself, which keeps its own books.
+        """
+        return (self.stats, dict(self._stored)) if self._detached else None
+
+    def merge(self, stats: CacheStats, stored: Dict[str, int]):
+        """Fold a worker copy's ``changes()`` into this cache and evict past ``max_bytes``."""
+        self.stats.hits += stats.hits
+        self.stats.misses += stats.misses
+        self.stats.stores += stats.stores
+        if not stored:
+            return
+        index = self._load_index()
+        for key, size in stored.items():
+            self._size += size - index.pop(key, 0)
+            index[key] = size
+        self._evict()
+
+    @staticmethod
+    def key(source: bytes, pkg: AvatarPackage) -> str:
+        h = hashlib.sha256(source)
+        h.update(f"|{pkg.user_type.value}|{','.join(map(str, pkg.sizes))}|{pkg.dds_format.value}|v{ENCODER_VERSION}|r{RESAMPLER_VERSION}".encode())
+        h.update(format_codec_rules(pkg.codecs).encode())
+        return h.hexdigest()
+
+    def _entry(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}.xavatar"
+
+    def _load_index(self) -> 'OrderedDict[str, int]':
+        if self._index is None:
+            entries = []
+            if self.root.exists():
+                for path in self.root.glob("*/*.xavatar"):
+                    st = path.stat()
+                    entries.append((st.st_mtime, path.stem, st.st_size))
+            entries.sort()
+            self._index = OrderedDict((key, size) for _, key, size in entries)
+            self._size = sum(self._index.values())
+        return self._index
+
+    def _touch(self, key: str):
+        if not self._detached:
+            index = self._load_index()
+            if key in index:
+                index.move_to_end(key)
+        try:
+            os.utime(self._entry(key))
+        except OSError:
+            pass
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            data = self._entry(key).read_bytes()
+        except OSError:
+            self.stats.misses += 1
+            return None
+        self.stats.hits += 1
+        self._touch(key)
+        return data
+
+    def restore(self, key: str, dest: Path) -> bool:
+        """Materialise a cached package at ``dest`` (hardlink or copy); False on a miss."""
+        try:
+            link_or_copy(self._entry(key), dest, self.link)
+        except OSError:
+            self.stats.misses += 1
+            return False
+        self.stats.hits += 1
+        self._touch(key)
+        return True
+
+    def put(self, key: str, data: bytes):
+        try:
+            entry = self._entry(key)
+            entry.parent.mkdir(parents=True, exist_ok=True)
+            write_atomic(entry, data)
+        except OSError as e:
+            logger.warning(f"Could not store {key} in package cache {self.root}: {e}")
+            return
+        self.stats.stores += 1
+        if self._detached:
+            self._stored[key] = len(data)
+            return
+        index = self._load_index()
+        self._size += len(data) - index.pop(key, 0)
+        index[key] = len(data)
+        self._evict()
+
+    def _evict(self):
+        index = self._load_index()
+        while self._size > self.max_bytes and len(index) > 1:
+            key, size = index.popitem(last=False)
+            self._size -= size
+            self._entry(key).unlink(missing_ok=True)
+            self.stats.evictions += 1
+            logger.info(f"Evicted {key} from package cache")
+
+    def clear(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+        self._index, self._size = None, 0
@@ -0,0 +1,338 @@
+import os
+import sys
+import json
+import signal
+import logging
+import argparse
+from pathlib import Path
+from typing import List, Optional, Tuple
+from .models import UserType, DDSFormat, FTPConfig, UploadCompare, ZipCodec, ZipCodecRules, DEFAULT_ZIP_CODECS
+
+logger = logging.getLogger("pys4_avatar_maker.cli")
+
+# Keep this module free of PyQt6 and heavy imports: the GUI and the imaging
+# pipeline are only imported once the chosen subcommand needs them.
+
+def _parse_codec(spec: str) -> Tuple[str, ZipCodec, int]:
+    pattern, sep, codec = spec.partition('=')
+    name, _, level = codec.partition(':')
+    try:
+        codec, level = ZipCodec(name), int(level) if level else 6
+        if not sep or not 0 <= level <= 9:
+            raise ValueError(spec)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected GLOB=stored|deflate[:0-9], got {spec!r}") from None
+    return pattern, codec, level
+
+def _zip_codecs(args) -> ZipCodecRules:
+    return tuple(args.zip_codec) + DEFAULT_ZIP_CODECS
+
+def _add_common_args(parser: argparse.ArgumentParser):
+    parser.add_argument('--user-type', choices=[t.value for t in UserType], default=UserType.LOCAL.value,
+                        help="PS4 user type the package is built for (default: local)")
+    parser.add_argument('--dds-format', choices=[f.value for f in DDSFormat], default=DDSFormat.DXT5.value,
+                        help="DDS encoding of the avatar surfaces (default: dxt5)")
+    parser.add_argument('--no-cache', action='store_true', help="do not read or populate the package cache")
+    parser.add_argument('--cache-dir', type=Path, help="package cache directory (default: per-user cache dir)")
+    parser.add_argument('--zip-codec', action='append', default=[], metavar='GLOB=CODEC[:LEVEL]', type=_parse_codec,
+                        help="compression for package members matching GLOB, e.g. '*.dds=deflate:9' or "
+                             "'*=stored' (repeatable, checked before the default: DDS/JSON deflate:6, rest stored)")
+    parser.add_argument('-q', '--quiet', action='store_true', help="only log warnings and errors")
+
+def _add_ftp_args(parser: argparse.ArgumentParser):
+    group = parser.add_argument_group("FTP upload")
+    group.add_argument('--ftp-host', action='append', default=[], metavar='HOST[:PORT]',
+                       help="upload every package to this FTP host (repeatable to fan out to several consoles)")
+    group.add_argument('--ftp-hosts-file', type=Path, metavar='FILE',
+                       help="read more HOST[:PORT] targets from FILE, one per line (# starts a comment)")
+    group.add_argument('--ftp-port', type=int, default=2121, help="port for hosts given without one (default: 2121)")
+    group.add_argument('--ftp-user')
+    group.add_argument('--ftp-pass', default=os.getenv("PYS4_FTP_PASSWORD"),
+                       help="FTP password (default: $PYS4_FTP_PASSWORD)")
+    group.add_argument('--ftp-dir', default="/", help="remote upload directory (default: /)")
+    group.add_argument('--ftp-sessions', type=int, default=1, help="concurrent FTP connections per host (default: 1)")
+    group.add_argument('--ftp-concurrency', type=int, metavar='N',
+                       help="concurrent uploads across all hosts (default: hosts x sessions, at most 32)")
+    group.add_argument('--ftp-compare', choices=[c.value for c in UploadCompare], default=UploadCompare.NONE.value,
+                       help="skip packages already on the console: by size, or by size plus a SHA-256 sidecar "
+                            "(default: none)")
+    group.add_argument('--ftp-timeout', type=float, default=10.0, metavar='SECONDS',
+                       help="connect/transfer timeout; unreachable hosts are skipped after it (default: 10)")
+
+def _add_memory_args(parser: argparse.ArgumentParser):
+    parser.add_argument('--memory-budget', type=int, metavar='MB',
+                        help="memory the workers may spend decoding images at once; very large images "
+                             "wait for room (default: half of physical memory)")
+
+def _memory_budget(args):
+    if args.memory_budget is None:
+        return None
+    from .memory import MemoryBudget
+    return MemoryBudget(args.memory_budget * 1024 * 1024)
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="pys4_avatar_maker", description="Build PS4-Xplorer .xavatar packages.")
+    sub = parser.add_subparsers(dest='command')
+    sub.add_parser('gui', help="start the PyQt6 GUI (default when no command is given)")
+
+    make = sub.add_parser('make', help="package a single image")
+    make.add_argument('image', type=Path)
+    make.add_argument('-o', '--output', type=Path, help="output .xavatar (default: next to the image)")
+    _add_common_args(make)
+
+    batch = sub.add_parser('batch', help="package every PNG/JPG image in a folder")
+    batch.add_argument('input_dir', type=Path)
+    batch.add_argument('-o', '--output-dir', type=Path, help="output folder (default: the input folder)")
+    batch.add_argument('-j', '--workers', type=int, help="worker processes (default: one per CPU)")
+    batch.add_argument('-r', '--recursive', action='store_true', help="also scan subfolders")
+    batch.add_argument('--include', action='append', default=[], metavar='GLOB',
+                       help="only process files matching GLOB (repeatable; default: *.png/*.jpg/*.jpeg)")
+    batch.add_argument('--exclude', action='append', default=[], metavar='GLOB',
+                       help="skip files and folders matching GLOB (repeatable)")
+    batch.add_argument('--incremental', action='store_true', help="skip inputs whose output is still current")
+    batch.add_argument('--dedup', action='store_true',
+                       help="build byte-identical inputs once and hardlink the package to the other names")
+    batch.add_argument('--dedup-threshold', type=int, metavar='BITS',
+                       help="also treat images within BITS differing dHash bits (0-16) as duplicates; implies --dedup")
+    batch.add_argument('--dedup-copy', action='store_true',
+                       help="copy duplicate packages instead of hardlinking them")
+    batch.add_argument('--ftp-only', action='store_true',
+                       help="build packages in memory and only upload them, writing nothing locally")
+    batch.add_argument('--json', action='store_true', help="print the BatchResult as JSON on stdout")
+    batch.add_argument('--jsonl', action='store_true',
+                       help="print one JSON line per item on stdout as soon as it completes")
+    batch.add_argument('--trace', type=Path, metavar='FILE',
+                       help="record per-stage timing spans and write them to FILE as JSON lines")
+    batch.add_argument('--metrics-textfile', type=Path, metavar='FILE',
+                       help="write per-stage histograms to FILE in Prometheus textfile format")
+    _add_memory_args(batch)
+    _add_common_args(batch)
+    _add_ftp_args(batch)
+
+    watch = sub.add_parser('watch', help="keep packaging images as they appear in a folder")
+    watch.add_argument('input_dir', type=Path)
+    watch.add_argument('-o', '--output-dir', type=Path, help="output folder (default: the input folder)")
+    watch.add_argument('-j', '--workers', type=int, help="worker processes (default: one per CPU)")
+    watch.add_argument('-r', '--recursive', action='store_true', help="also watch subfolders")
+    watch.add_argument('--include', action='append', default=[], metavar='GLOB',
+                       help="only process files matching GLOB (repeatable; default: *.png/*.jpg/*.jpeg)")
+    watch.add_argument('--exclude', action='append', default=[], metavar='GLOB',
+                       help="skip files and folders matching GLOB (repeatable)")
+    watch.add_argument('--settle', type=float, default=1.0, metavar='SECONDS',
+                       help="wait until a file is unchanged for this long before packaging it (default: 1.0)")
+    watch.add_argument('--poll', type=float, metavar='SECONDS',
+                       help="poll the folder at this interval instead of using inotify (e.g. for network shares)")
+    watch.add_argument('--queue-size', type=int, default=256, help="maximum queued images (default: 256)")
+    watch.add_argument('--no-initial-scan', action='store_true', help="ignore images already in the folder")
+    _add_memory_args(watch)
+    _add_common_args(watch)
+    _add_ftp_args(watch)
+
+    serve = sub.add_parser('serve', help="build packages on demand over a local HTTP API")
+    serve.add_argument('--host', default='127.0.0.1', help="address to listen on (default: 127.0.0.1)")
+    serve.add_argument('--port', type=int, default=8765, help="port to listen on (default: 8765)")
+    serve.add_argument('-j', '--workers', type=int, help="worker processes kept warm (default: one per CPU)")
+    serve.add_argument('--max-concurrent', type=int, metavar='N',
+                       help="requests handled at once, the rest get 503 (default: twice the workers)")
+    serve.add_argument('--max-body', type=int, default=64, metavar='MB', help="largest accepted image (default: 64)")
+    serve.add_argument('--response-cache', type=int, default=64, metavar='MB',
+                       help="memory for recently built packages, by content hash (default: 64)")
+    _add_memory_args(serve)
+    _add_common_args(serve)
+
+    bench = sub.add_parser('bench', help="benchmark the packaging and upload pipeline")
+    bench_sub = bench.add_subparsers(dest='bench_command', required=True)
+    run = bench_sub.add_parser('run', help="run the benchmarks and save the results as JSON")
+    run.add_argument('-o', '--output', type=Path, help="write the JSON report here (default: stdout)")
+    run.add_argument('--sizes', type=int, nargs='+', default=[512, 2048, 8192], metavar='PX',
+                     help="synthetic image sizes (default: 512 2048 8192)")
+    run.add_argument('--counts', type=int, nargs='+', default=[1, 100, 1000], metavar='N',
+                     help="end-to-end batch sizes (default: 1 100 1000)")
+    run.add_argument('--repeat', type=int, default=5, help="timed runs per micro-benchmark (default: 5)")
+    run.add_argument('-j', '--workers', type=int, help="batch worker processes (default: one per CPU)")
+    run.add_argument('--no-ftp', action='store_true', help="skip the local FTP upload benchmark")
+    run.add_argument('-q', '--quiet', action='store_true', help="only log warnings and errors")
+    compare = bench_sub.add_parser('compare', help="compare two reports and flag regressions")
+    compare.add_argument('baseline', type=Path)
+    compare.add_argument('candidate', type=Path)
+    compare.add_argument('--threshold', type=float, default=0.10,
+                         help="relative slowdown that counts as a regression (default: 0.10)")
+    compare.add_argument('-q', '--quiet', action='store_true', help="only log warnings and errors")
+    return parser
+
+def _make_cache(args):
+    if args.no_cache:
+        return None
+    from .cache import PackageCache
+    return PackageCache(args.cache_dir)
+
+def _ftp_targets(args) -> List[FTPConfig]:
+    hosts = list(args.ftp_host)
+    if args.ftp_hosts_file:
+        for line in args.ftp_hosts_file.read_text(encoding='utf-8').splitlines():
+            line = line.split('#', 1)[0].strip()
+            if line:
+                hosts.append(line)
+    targets = []
+    for host in hosts:
+        name, _, port = host.partition(':')
+        targets.append(FTPConfig(host=name, port=int(port) if port else args.ftp_port, username=args.ftp_user or None,
+                                 password=args.ftp_pass or None, upload_dir=args.ftp_dir, timeout=args.ftp_timeout))
+    return targets
+
+def cmd_make(args) -> int:
+    from .controllers import create_avatar_package
+    output = args.output or args.image.with_suffix('.xavatar')
+    try:
+        create_avatar_package(args.image, UserType(args.user_type), output, cache=_make_cache(args),
+                              codecs=_zip_codecs(args), dds_format=DDSFormat(args.dds_format))
+    except Exception as e:
+        logger.error(f"Failed to package {args.image}: {e}")
+        return 1
+    print(output)
+    return 0
+
+def _print_item(item, done: int, total: int):
+    sys.stdout.write(json.dumps(item.to_dict()) + '\n')
+    sys.stdout.flush()
+
+def cmd_batch(args) -> int:
+    from .services import process_batch_avatars
+    from .scanner import iter_images
+    from .dedup import MAX_THRESHOLD
+    if not args.input_dir.is_dir():
+        logger.error(f"Input folder {args.input_dir} does not exist")
+        return 2
+    if args.dedup_threshold is not None and not 0 <= args.dedup_threshold <= MAX_THRESHOLD:
+        logger.error(f"--dedup-threshold must be between 0 and {MAX_THRESHOLD}")
+        return 2
+    images = iter_images(args.input_dir, recursive=args.recursive, include=args.include,
+                         exclude=args.exclude, sort=True)
+    targets = _ftp_targets(args)
+    if args.ftp_only and (not targets or args.incremental or args.output_dir):
+        logger.error("--ftp-only needs --ftp-host and cannot be combined with --incremental or -o")
+        return 2
+    output_dir = None if args.ftp_only else args.output_dir or args.input_dir
+    if output_dir is not None:
+        output_dir.mkdir(parents=True, exist_ok=True)
+    result = process_batch_avatars(images, UserType(args.user_type), output_dir, ftp_targets=targets,
+                                   ftp_concurrency=args.ftp_concurrency, ftp_compare=UploadCompare(args.ftp_compare),
+                                   workers=args.workers, ftp_sessions=args.ftp_sessions,
+                                   cache=_make_cache(args), incremental=args.incremental, zip_codecs=_zip_codecs(args),
+                                   dds_format=DDSFormat(args.dds_format),
+                                   metrics=bool(args.trace or args.metrics_textfile), memory_budget=_memory_budget(args),
+                                   dedup=args.dedup, dedup_threshold=args.dedup_threshold,
+                                   dedup_link=not args.dedup_copy, progress=_print_item if args.jsonl else None)
+    if args.trace or args.metrics_textfile:
+        from .metrics import write_trace_jsonl, write_prometheus_textfile
+        if args.trace:
+            write_trace_jsonl(result, args.trace)
+        if args.metrics_textfile:
+            write_prometheus_textfile(result, args.metrics_textfile)
+    if args.json:
+        json.dump(result.to_dict(), sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    elif not args.jsonl:
+        print(f"{result.succeeded}/{result.total} packaged ({result.skipped} unchanged, {result.cache_hits} from cache), "
+              f"{result.failed} failed, {result.ftp_transferred} uploaded in {result.elapsed:.2f}s")
+        if result.duplicates:
+            print(f"{result.duplicates} duplicate input(s) reused an earlier package")
+        if result.ftp_skipped or result.ftp_bytes_saved:
+            print(f"{result.ftp_skipped} already on the console, {result.ftp_bytes_saved} bytes not re-sent")
+        if len(result.ftp_hosts) > 1:
+            for host in result.ftp_hosts.values():
+                state = "OFFLINE" if host.offline else f"{host.uploaded} uploaded"
+                print(f"  {host.target}: {state}, {host.failed} failed")
+    upload_failed = any(host.failed for host in result.ftp_hosts.values())
+    return 1 if result.failed or upload_failed else 0
+
+def cmd_watch(args) -> int:
+    from .watch import FolderWatcher
+    if not args.input_dir.is_dir():
+        logger.error(f"Input folder {args.input_dir} does not exist")
+        return 2
+    watcher = FolderWatcher(args.input_dir, UserType(args.user_type), args.output_dir, ftp_targets=_ftp_targets(args),
+                            ftp_sessions=args.ftp_sessions, ftp_concurrency=args.ftp_concurrency,
+                            ftp_compare=UploadCompare(args.ftp_compare), zip_codecs=_zip_codecs(args),
+                            dds_format=DDSFormat(args.dds_format),
+                            recursive=args.recursive, include=args.include, exclude=args.exclude,
+                            settle=args.settle, poll_interval=args.poll or 1.0, queue_size=args.queue_size,
+                            workers=args.workers, cache=_make_cache(args), memory_budget=_memory_budget(args),
+                            use_inotify=False if args.poll else None, initial_scan=not args.no_initial_scan)
+    stops = []
+
+    def on_signal(signum, frame):
+        # First signal drains the queue, a second one drops it
+        stops.append(signum)
+        if len(stops) == 1:
+            logger.info("Stopping, finishing queued images (signal again to abort)")
+        watcher.stop(drain=len(stops) == 1)
+    signal.signal(signal.SIGINT, on_signal)
+    if hasattr(signal, 'SIGTERM'):
+        signal.signal(signal.SIGTERM, on_signal)
+    watcher.run()
+    return 1 if watcher.failed else 0
+
+def cmd_serve(args) -> int:
+    import threading
+    from .server import AvatarService, make_server
+    service = AvatarService(workers=args.workers, max_concurrent=args.max_concurrent,
+                            cache_bytes=args.response_cache * 1024 * 1024, package_cache=_make_cache(args),
+                            zip_codecs=_zip_codecs(args), memory_budget=_memory_budget(args),
+                            dds_format=DDSFormat(args.dds_format))
+    try:
+        server = make_server(service, args.host, args.port, max_body=args.max_body * 1024 * 1024,
+                             user_type=UserType(args.user_type))
+    except OSError as e:
+        logger.error(f"Cannot listen on {args.host}:{args.port}: {e}")
+        service.close()
+        return 2
+
+    def on_signal(signum, frame):
+        # shutdown() waits for serve_forever(), which runs on this very thread
+        threading.Thread(target=server.shutdown, daemon=True).start()
+    signal.signal(signal.SIGINT, on_signal)
+    if hasattr(signal, 'SIGTERM'):
+        signal.signal(signal.SIGTERM, on_signal)
+    try:
+        service.warm()
+        server.serve_forever()
+    finally:
+        server.server_close()
+        service.close()
+    logger.info("Server stopped")
+    return 0
+
+def cmd_bench(args) -> int:
+    from . import bench
+    if args.bench_command == 'compare':
+        rows = bench.compare_reports(bench.load_report(args.baseline), bench.load_report(args.candidate), args.threshold)
+        print(bench.format_comparison(rows))
+        regressions = [row['name'] for row in rows if row['regression']]
+        if regressions:
+            logger.error(f"{len(regressions)} benchmark(s) regressed by more than {args.threshold:.0%}")
+            return 1
+        return 0
+    report = bench.run_benchmarks(args.sizes, args.counts, args.repeat, args.workers, ftp=not args.no_ftp)
+    if args.output:
+        bench.save_report(report, args.output)
+        print(args.output)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    slow = bench.check_resize_throughput(report)
+    if slow:
+        logger.error(f"Resampling slower than {bench.RESIZE_MAX_SLOWDOWN:g}x Pillow: {', '.join(slow)}")
+        return 1
+    return 0
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    if args.command in (None, 'gui'):
+        from .ui_main import main as gui_main
+        gui_main()
+        return 0
+    if args.quiet:
+        logging.getLogger("pys4_avatar_maker").setLevel(logging.WARNING)
+    return {'make': cmd_make, 'batch': cmd_batch, 'watch': cmd_watch, 'serve': cmd_serve,
+            'bench': cmd_bench}[args.command](args)
@@ -1,31 +1,171 @@
 import subprocess
 import sys
+import time
+import shutil
+import argparse
+import statistics
 from pathlib import Path
 import os
+from typing import Dict, List, Optional, Sequence, Tuple
 
-def build_exe():
+PROJECT_ROOT = Path(__file__).parent.parent.parent
+APP_NAME = 'pyS4_Avatar_Maker'
+PROFILES = ('onefile', 'onedir')
+# Read by ui_main.main: the GUI quits as soon as its window is up
+STARTUP_PROBE_ENV = 'PYS4_STARTUP_PROBE'
+
+# Modules PyInstaller's hooks would otherwise collect although the app never imports them
+ONEDIR_EXCLUDES = (
+    'imageio', 'tkinter', 'unittest', 'pydoc', 'pytest',
+    'PyQt6.QtNetwork', 'PyQt6.QtQml', 'PyQt6.QtQuick', 'PyQt6.QtQuickWidgets', 'PyQt6.QtWebEngineCore',
+    'PyQt6.QtWebEngineWidgets', 'PyQt6.QtWebChannel', 'PyQt6.QtMultimedia', 'PyQt6.QtMultimediaWidgets',
+    'PyQt6.QtSql', 'PyQt6.QtSvg', 'PyQt6.QtSvgWidgets', 'PyQt6.QtPdf', 'PyQt6.QtPdfWidgets', 'PyQt6.QtOpenGL',
+    'PyQt6.QtOpenGLWidgets', 'PyQt6.QtBluetooth', 'PyQt6.QtPositioning', 'PyQt6.QtSensors', 'PyQt6.QtSerialPort',
+    'PyQt6.QtTest', 'PyQt6.QtDesigner', 'PyQt6.QtHelp', 'PyQt6.QtPrintSupport',
+)
+# Qt plugins (globs under Qt6/plugins) removed from the onedir build. Pillow decodes the
+# images; Qt only loads the preview (PNG is built in, JPEG needs qjpeg) and draws widgets.
+QT_PLUGIN_PRUNE = (
+    'iconengines', 'tls', 'networkinformation', 'sqldrivers', 'multimedia', 'printsupport', 'qmltooling',
+    'position', 'sensors', 'imageformats/*qpdf*', 'imageformats/*qsvg*', 'imageformats/*qtiff*',
+    'imageformats/*qwebp*', 'imageformats/*qicns*', 'imageformats/*qtga*', 'imageformats/*qwbmp*',
+)
+
+def _pyinstaller_args(profile: str) -> List[str]:
+    if profile == 'onefile':
+        return ['--onefile']
+    # Separate dist/build/spec dirs so the two layouts can sit side by side
+    args = ['--onedir', '--noupx', '--distpath', str(PROJECT_ROOT / 'dist' / 'onedir'),
+            '--workpath', str(PROJECT_ROOT / 'build' / 'onedir'), '--specpath', str(PROJECT_ROOT / 'build' / 'onedir')]
+    for module in ONEDIR_EXCLUDES:
+        args += ['--exclude-module', module]
+    return args
+
+def executable_path(profile: str) -> Path:
+    """Where build_exe(profile) puts the application binary."""
+    name = APP_NAME + ('.exe' if sys.platform == 'win32' else '')
+    if profile == 'onefile':
+        return PROJECT_ROOT / 'dist' / name
+    return PROJECT_ROOT / 'dist' / 'onedir' / APP_NAME / name
+
+def build_exe(profile: str = 'onefile'):
     """
     Build a standalone executable using PyInstaller.
     Output will be in the 'dist' folder.
     Only the minimum runtime dependencies are included (see requirements.txt).
+    ``onefile`` produces a single binary that unpacks itself to a temp dir on every launch;
+    ``onedir`` produces dist/onedir/<name>/ that starts in place, with unused modules and
+    Qt plugins left out.
     """
-    project_root = Path(__file__).parent.parent.parent
-    run_py = project_root / 'run.py'
-    icon_path = project_root / 'src' / 'pys4_avatar_maker' / 'default_avatar.png'
+    if profile not in PROFILES:
+        raise ValueError(f"unknown build profile {profile!r}, expected one of {', '.join(PROFILES)}")
+    run_py = PROJECT_ROOT / 'run.py'
+    icon_path = PROJECT_ROOT / 'src' / 'pys4_avatar_maker' / 'default_avatar.png'
     add_data_arg = f"{icon_path}{os.pathsep}src/pys4_avatar_maker"
     cmd = [
         sys.executable, '-m', 'PyInstaller',
         '--noconfirm',
-        '--onefile',
+        *_pyinstaller_args(profile),
         '--windowed',
-        '--name', 'pyS4_Avatar_Maker',
-        '--hidden-import', 'imageio.plugins',
+        '--name', APP_NAME,
         '--add-data', add_data_arg,
         str(run_py)
     ]
     # If you have a .ico icon, add: '--icon', str(icon_path.with_suffix('.ico'))
     print(f"Running: {' '.join(map(str, cmd))}")
     subprocess.run(cmd, check=True)
+    if profile == 'onedir':
+        prune_qt_plugins(executable_path(profile).parent)
+
+def prune_qt_plugins(dist_dir: Path, patterns: Sequence[str] = QT_PLUGIN_PRUNE) -> int:
+    """Delete the Qt plugins matching ``patterns`` from a onedir build; returns the bytes freed."""
+    freed = 0
+    for plugins in dist_dir.rglob('Qt6/plugins'):
+        for pattern in patterns:
+            for path in plugins.glob(pattern):
+                files = [path] if path.is_file() else [f for f in path.rglob('*') if f.is_file()]
+                freed += sum(f.stat().st_size for f in files)
+                if path.is_dir():
+                    shutil.rmtree(path)
+                else:
+                    path.unlink()
+    print(f"Pruned {freed / 1e6:.1f} MB of unused Qt plugins from {dist_dir}")
+    return freed
+
+def importtime_report(module: str = 'pys4_avatar_maker.ui_main', top: int = 25) -> List[Tuple[str, int, int]]:
+    """
+    Import ``module`` in a fresh interpreter under ``-X importtime`` and return the ``top``
+    slowest imports as ``(module, self_us, cumulative_us)``, slowest cumulative first.
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [str(PROJECT_ROOT / 'src'),
+                                                                   os.environ.get('PYTHONPATH')])))
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], env=env,
+                          capture_output=True, text=True, check=True)
+    rows = []
+    for line in proc.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        fields = line.partition('import time:')[2].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        rows.append((fields[2].strip(), int(fields[0]), int(fields[1])))
+    rows.sort(key=lambda row: row[2], reverse=True)
+    return rows[:top]
+
+def print_importtime_report(module: str = 'pys4_avatar_maker.ui_main', top: int = 25):
+    rows = importtime_report(module, top)
+    print(f"Slowest imports of {module} (ms):")
+    print(f"{'cumulative':>11} {'self':>8}  module")
+    for name, self_us, cumulative_us in rows:
+        print(f"{cumulative_us / 1000:11.1f} {self_us / 1000:8.1f}  {name}")
+
+def benchmark_startup(commands: Dict[str, Sequence[str]], runs: int = 5, timeout: float = 120.0) -> Dict[str, dict]:
+    """
+    Time each command from launch until the GUI is up and exits again (via the
+    PYS4_STARTUP_PROBE hook). The first launch is reported separately as the cold start,
+    later ones as warm (min/median); commands are interleaved so caches affect them alike.
+    """
+    env = dict(os.environ, **{STARTUP_PROBE_ENV: '1'})
+    timings: Dict[str, List[float]] = {label: [] for label in commands}
+    for _ in range(runs):
+        for label, cmd in commands.items():
+            start = time.perf_counter()
+            subprocess.run(list(cmd), env=env, check=True, timeout=timeout,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            timings[label].append(time.perf_counter() - start)
+    results = {}
+    for label, times in timings.items():
+        warm = times[1:] or times
+        results[label] = {'cold': times[0], 'warm_min': min(warm), 'warm_median': statistics.median(warm),
+                          'runs': len(times)}
+    return results
+
+def print_startup_benchmark(results: Dict[str, dict]):
+    print(f"{'layout':<10} {'cold':>8} {'warm min':>9} {'warm med':>9}  (seconds)")
+    for label, r in results.items():
+        print(f"{label:<10} {r['cold']:8.2f} {r['warm_min']:9.2f} {r['warm_median']:9.2f}")
+
+def main(argv: Optional[Sequence[str]] = None):
+    parser = argparse.ArgumentParser(prog="compile_dist", description="Build and profile the packaged application.")
+    parser.add_argument('--profile', choices=PROFILES + ('both',), default='onefile',
+                        help="layout to build (default: onefile)")
+    parser.add_argument('--no-build', action='store_true', help="only profile/benchmark existing builds")
+    parser.add_argument('--importtime', action='store_true', help="report the slowest imports of the GUI")
+    parser.add_argument('--bench-startup', action='store_true',
+                        help="compare startup time of the built layouts (and the source tree)")
+    parser.add_argument('--runs', type=int, default=5, help="launches per layout for --bench-startup (default: 5)")
+    args = parser.parse_args(argv)
+    profiles = PROFILES if args.profile == 'both' else (args.profile,)
+    if not args.no_build:
+        for profile in profiles:
+            build_exe(profile)
+    if args.importtime:
+        print_importtime_report()
+    if args.bench_startup:
+        commands = {'source': [sys.executable, str(PROJECT_ROOT / 'run.py')]}
+        for profile in PROFILES:
+            if executable_path(profile).exists():
+                commands[profile] = [str(executable_path(profile))]
+        print_startup_benchmark(benchmark_startup(commands, args.runs))
 
 if __name__ == "__main__":
-    build_exe() 
\ No newline at end of file
+    main()
@@ -1,7 +1,13 @@
 from pathlib import Path
-from .models import AvatarPackage, UserType
+from typing import Optional
+from .models import AvatarPackage, UserType, DDSFormat, ZipCodecRules, DEFAULT_ZIP_CODECS
+from .cache import PackageCache
 from .services import package_avatar
 
-def create_avatar_package(image_path: Path, user_type: UserType, output_path: Path, tmp_dir: Path):
-    pkg = AvatarPackage(image_path=image_path, user_type=user_type, output_path=output_path)
-    package_avatar(pkg, tmp_dir) 
\ No newline at end of file
+def create_avatar_package(image_path: Path, user_type: UserType, output_path: Path, tmp_dir: Optional[Path] = None,
+                          *, debug_dir: Optional[Path] = None, cache: Optional[PackageCache] = None,
+                          codecs: ZipCodecRules = DEFAULT_ZIP_CODECS, dds_format: DDSFormat = DDSFormat.DXT5):
+    # tmp_dir is kept for existing positional callers; packages are built in memory now, so it is unused
+    pkg = AvatarPackage(image_path=image_path, user_type=user_type, output_path=output_path, codecs=codecs,
+                        dds_format=dds_format)
+    package_avatar(pkg, debug_dir, cache)
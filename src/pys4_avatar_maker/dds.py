@@ -0,0 +1,190 @@
+import struct
+from typing import Tuple, Union
+import numpy as np
+from PIL import Image
+from .models import DDSFormat
+
+# Bump whenever the bytes produced for a given input change (used to key caches)
+ENCODER_VERSION = 1
+
+DDS_MAGIC = b'DDS '
+DDSD_CAPS, DDSD_HEIGHT, DDSD_WIDTH, DDSD_PITCH = 0x1, 0x2, 0x4, 0x8
+DDSD_PIXELFORMAT, DDSD_LINEARSIZE = 0x1000, 0x80000
+DDPF_ALPHAPIXELS, DDPF_FOURCC, DDPF_RGB = 0x1, 0x4, 0x40
+DDSCAPS_TEXTURE = 0x1000
+
+_FOURCC = {DDSFormat.DXT1: b'DXT1', DDSFormat.DXT5: b'DXT5'}
+_BLOCK_BYTES = {DDSFormat.DXT1: 8, DDSFormat.DXT5: 16}
+
+_BC1_DTYPE = np.dtype([('c0', '<u2'), ('c1', '<u2'), ('idx', '<u4')])
+_BC3_DTYPE = np.dtype([('a0', 'u1'), ('a1', 'u1'), ('aidx', 'u1', 6), ('c0', '<u2'), ('c1', '<u2'), ('idx', '<u4')])
+
+def dds_header(width: int, height: int, fmt: DDSFormat) -> bytes:
+    """Return the 128-byte magic + DDS_HEADER for a single-surface texture."""
+    flags = DDSD_CAPS | DDSD_HEIGHT | DDSD_WIDTH | DDSD_PIXELFORMAT
+    if fmt == DDSFormat.RGBA8:
+        flags |= DDSD_PITCH
+        pitch = width * 4
+        pixel_format = struct.pack('<4I4I', 32, DDPF_RGB | DDPF_ALPHAPIXELS, 0, 32,
+                                   0x00FF0000, 0x0000FF00, 0x000000FF, 0xFF000000)
+    else:
+        flags |= DDSD_LINEARSIZE
+        pitch = ((width + 3) // 4) * ((height + 3) // 4) * _BLOCK_BYTES[fmt]
+        pixel_format = struct.pack('<2I4s5I', 32, DDPF_FOURCC, _FOURCC[fmt], 0, 0, 0, 0, 0)
+    return (DDS_MAGIC
+            + struct.pack('<7I', 124, flags, height, width, pitch, 0, 0)
+            + struct.pack('<11I', *((0,) * 11))
+            + pixel_format
+            + struct.pack('<5I', DDSCAPS_TEXTURE, 0, 0, 0, 0))
+
+def _as_rgba_array(img: Union[Image.Image, np.ndarray]) -> np.ndarray:
+    if isinstance(img, Image.Image):
+        img = np.asarray(img.convert('RGBA'))
+    if img.dtype != np.uint8 or img.ndim != 3 or img.shape[2] != 4:
+        raise ValueError(f"expected an HxWx4 uint8 RGBA array, got {img.dtype} {img.shape}")
+    return img
+
+def _to_blocks(rgba: np.ndarray) -> np.ndarray:
+    """Split an HxWx4 array into (N, 16, 4) 4x4 blocks in row-major block order (edges replicated)."""
+    h, w = rgba.shape[:2]
+    ph, pw = -h % 4, -w % 4
+    if ph or pw:
+        rgba = np.pad(rgba, ((0, ph), (0, pw), (0, 0)), mode='edge')
+    bh, bw = rgba.shape[0] // 4, rgba.shape[1] // 4
+    return rgba.reshape(bh, 4, bw, 4, 4).transpose(0, 2, 1, 3, 4).reshape(bh * bw, 16, 4)
+
+def _from_blocks(blocks: np.ndarray, width: int, height: int) -> np.ndarray:
+    bh, bw = (height + 3) // 4, (width + 3) // 4
+    out = blocks.reshape(bh, bw, 4, 4, 4).transpose(0, 2, 1, 3, 4).reshape(bh * 4, bw * 4, 4)
+    return np.ascontiguousarray(out[:height, :width])
+
+def _pack565(rgb: np.ndarray) -> np.ndarray:
+    rgb = rgb.astype(np.uint32)
+    r = (rgb[..., 0] * 31 + 127) // 255
+    g = (rgb[..., 1] * 63 + 127) // 255
+    b = (rgb[..., 2] * 31 + 127) // 255
+    return ((r << 11) | (g << 5) | b).astype(np.uint16)
+
+def _unpack565(c: np.ndarray) -> np.ndarray:
+    c = c.astype(np.int32)
+    r, g, b = (c >> 11) & 0x1F, (c >> 5) & 0x3F, c & 0x1F
+    return np.stack([(r << 3) | (r >> 2), (g << 2) | (g >> 4), (b << 3) | (b >> 2)], axis=-1)
+
+def _color_palette(c0: np.ndarray, c1: np.ndarray, four_color: np.ndarray) -> np.ndarray:
+    """Decoded (N, 4, 3) palettes; integer rounding matches the reference decoder."""
+    p0, p1 = _unpack565(c0), _unpack565(c1)
+    four = four_color[:, None]
+    p2 = np.where(four, (2 * p0 + p1) // 3, (p0 + p1) // 2)
+    p3 = np.where(four, (p0 + 2 * p1) // 3, 0)
+    return np.stack([p0, p1, p2, p3], axis=1)
+
+def _principal_endpoints(rgb: np.ndarray, weight: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Pick the block pixels at both extremes of each block's principal colour axis."""
+    w = weight.astype(np.float32)[..., None]
+    count = np.maximum(w.sum(axis=1, keepdims=True), 1.0)
+    mean = (rgb * w).sum(axis=1, keepdims=True) / count
+    centered = (rgb - mean) * w
+    cov = np.einsum('nki,nkj->nij', centered, centered)
+    axis = np.ones((rgb.shape[0], 3), dtype=np.float32)
+    for _ in range(8):
+        axis = np.einsum('nij,nj->ni', cov, axis)
+        axis /= np.maximum(np.abs(axis).max(axis=1, keepdims=True), 1e-12)
+    proj = np.einsum('nki,ni->nk', rgb - mean, axis)
+    lo = np.argmin(np.where(weight, proj, np.inf), axis=1)
+    hi = np.argmax(np.where(weight, proj, -np.inf), axis=1)
+    rows = np.arange(rgb.shape[0])
+    return rgb[rows, hi], rgb[rows, lo]
+
+def _encode_color(blocks: np.ndarray, punch_through: bool) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Encode the colour half of BC1/BC3 blocks; returns (c0, c1, packed indices)."""
+    rgb = blocks[..., :3].astype(np.float32)
+    opaque = blocks[..., 3] >= 128 if punch_through else np.ones(blocks.shape[:2], dtype=bool)
+    hi, lo = _principal_endpoints(rgb, opaque)
+    c0, c1 = _pack565(hi), _pack565(lo)
+    # Four-colour mode needs c0 > c1; punch-through (3 colours + transparent) needs c0 <= c1
+    transparent_block = ~opaque.all(axis=1)
+    swap = np.where(transparent_block, c0 > c1, c0 < c1)
+    c0, c1 = np.where(swap, c1, c0), np.where(swap, c0, c1)
+    four_color = (c0 > c1) & ~transparent_block
+    palette = _color_palette(c0, c1, four_color).astype(np.float32)
+    dist = sum((rgb[:, :, None, ch] - palette[:, None, :, ch]) ** 2 for ch in range(3))
+    dist[:, :, 3] = np.where(four_color[:, None], dist[:, :, 3], np.inf)
+    idx = np.argmin(dist, axis=2).astype(np.uint32)
+    idx = np.where(opaque, idx, 3)
+    idx[(c0 == c1) & ~transparent_block] = 0
+    packed = (idx << (2 * np.arange(16, dtype=np.uint32))).sum(axis=1, dtype=np.uint32)
+    return c0, c1, packed
+
+def _encode_alpha(blocks: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Encode BC3 alpha blocks in 8-level mode; returns (a0, a1, 6-byte index rows)."""
+    alpha = blocks[..., 3].astype(np.int32)
+    a0, a1 = alpha.max(axis=1), alpha.min(axis=1)
+    palette = _alpha_palette(a0, a1)
+    idx = np.argmin(np.abs(alpha[:, :, None] - palette[:, None, :]), axis=2).astype(np.uint64)
+    idx[a0 == a1] = 0
+    packed = (idx << (3 * np.arange(16, dtype=np.uint64))).sum(axis=1, dtype=np.uint64)
+    return a0.astype(np.uint8), a1.astype(np.uint8), packed.astype('<u8').view(np.uint8).reshape(-1, 8)[:, :6]
+
+def _alpha_palette(a0: np.ndarray, a1: np.ndarray) -> np.ndarray:
+    a0, a1 = a0.astype(np.int32)[:, None], a1.astype(np.int32)[:, None]
+    i = np.arange(2, 8, dtype=np.int32)[None, :]
+    eight = ((8 - i) * a0 + (i - 1) * a1) // 7
+    j = np.arange(2, 6, dtype=np.int32)[None, :]
+    six = np.concatenate([((6 - j) * a0 + (j - 1) * a1) // 5,
+                          np.zeros_like(a0), np.full_like(a0, 255)], axis=1)
+    return np.concatenate([a0, a1, np.where(a0 > a1, eight, six)], axis=1)
+
+def encode_dds(img: Union[Image.Image, np.ndarray], fmt: DDSFormat = DDSFormat.DXT5) -> bytes:
+    """
+    Encode an RGBA image as a single-surface DDS file.
+    DXT1/DXT5 blocks are compressed for the whole surface at once with NumPy;
+    RGBA8 writes uncompressed BGRA pixels.
+    """
+    rgba = _as_rgba_array(img)
+    height, width = rgba.shape[:2]
+    header = dds_header(width, height, fmt)
+    if fmt == DDSFormat.RGBA8:
+        return header + np.ascontiguousarray(rgba[..., [2, 1, 0, 3]]).tobytes()
+    blocks = _to_blocks(rgba)
+    if fmt == DDSFormat.DXT1:
+        out = np.empty(len(blocks), dtype=_BC1_DTYPE)
+        out['c0'], out['c1'], out['idx'] = _encode_color(blocks, punch_through=True)
+    else:
+        out = np.empty(len(blocks), dtype=_BC3_DTYPE)
+        out['a0'], out['a1'], out['aidx'] = _encode_alpha(blocks)
+        out['c0'], out['c1'], out['idx'] = _encode_color(blocks, punch_through=False)
+    return header + out.tobytes()
+
+def decode_dds(data: bytes) -> np.ndarray:
+    """Reference decoder for the formats written by encode_dds; returns an HxWx4 RGBA array."""
+    if data[:4] != DDS_MAGIC:
+        raise ValueError("not a DDS file")
+    height, width = struct.unpack_from('<2I', data, 12)
+    pf_flags, fourcc = struct.unpack_from('<I4s', data, 80)
+    body = data[128:]
+    if not pf_flags & DDPF_FOURCC:
+        bgra = np.frombuffer(body, dtype=np.uint8, count=width * height * 4).reshape(height, width, 4)
+        return bgra[..., [2, 1, 0, 3]].copy()
+    fmt = {v: k for k, v in _FOURCC.items()}.get(fourcc)
+    if fmt is None:
+        raise ValueError(f"unsupported DDS fourcc {fourcc!r}")
+    count = ((width + 3) // 4) * ((height + 3) // 4)
+    shifts = np.arange(16, dtype=np.uint32)
+    if fmt == DDSFormat.DXT1:
+        raw = np.frombuffer(body, dtype=_BC1_DTYPE, count=count)
+        four_color = raw['c0'] > raw['c1']
+    else:
+        raw = np.frombuffer(body, dtype=_BC3_DTYPE, count=count)
+        four_color = np.ones(count, dtype=bool)
+    palette = _color_palette(raw['c0'], raw['c1'], four_color)
+    idx = ((raw['idx'][:, None] >> (2 * shifts)) & 3).astype(np.intp)
+    rgb = np.take_along_axis(palette, idx[..., None], axis=1)
+    if fmt == DDSFormat.DXT1:
+        alpha = np.where((idx == 3) & ~four_color[:, None], 0, 255)
+    else:
+        abits = np.zeros((count, 8), dtype=np.uint8)
+        abits[:, :6] = raw['aidx']
+        aidx = ((abits.view('<u8')[:, 0][:, None] >> (3 * shifts.astype(np.uint64))) & 7).astype(np.intp)
+        alpha = np.take_along_axis(_alpha_palette(raw['a0'], raw['a1']), aidx, axis=1)
+    blocks = np.concatenate([rgb, alpha[..., None]], axis=-1).astype(np.uint8)
+    return _from_blocks(blocks, width, height)
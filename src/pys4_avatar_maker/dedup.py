@@ -0,0 +1,105 @@
+import io
+import hashlib
+import logging
+from pathlib import Path
+from typing import BinaryIO, Dict, List, Optional, Tuple, Union
+from PIL import Image
+from .memory import MemoryBudget, estimate_decode_bytes
+from .utils import load_rgba
+
+logger = logging.getLogger("pys4_avatar_maker.dedup")
+
+DHASH_SIDE = 8
+DHASH_BITS = DHASH_SIDE * DHASH_SIDE
+MAX_THRESHOLD = 16
+# SHA-256 digest and, for perceptual matching, dHash of one input
+Fingerprint = Tuple[str, Optional[int]]
+
+def dhash(image: Union[Path, BinaryIO], side: int = DHASH_SIDE) -> int:
+    """
+    Difference hash: one bit per horizontally adjacent pixel pair of a (side+1) x side
+    greyscale thumbnail. Re-encodes, resizes and small edits flip only a few bits.
+    The source is decoded at reduced scale (see utils.load_rgba).
+    """
+    small = load_rgba(image, side * 4).convert('L').resize((side + 1, side), Image.Resampling.BOX)
+    pixels = small.tobytes()
+    bits = 0
+    for y in range(side):
+        row = pixels[y * (side + 1):(y + 1) * (side + 1)]
+        for x in range(side):
+            bits = (bits << 1) | (row[x] > row[x + 1])
+    return bits
+
+class Deduplicator:
+    """
+    Recognises inputs that were already seen in this batch. Every path is SHA-256 hashed
+    as it streams in; with a ``threshold`` its dHash is also compared against earlier
+    images, and one within ``threshold`` differing bits counts as the same picture.
+    fingerprint() does the hashing and may run concurrently; original_of() must see the
+    paths in input order.
+    Near matches are found through pigeonhole chunk indexes (two hashes within t bits
+    agree exactly on at least one of t+1 chunks), not by comparing against every image.
+    """
+    def __init__(self, threshold: Optional[int] = None):
+        if threshold is not None and not 0 <= threshold <= MAX_THRESHOLD:
+            raise ValueError(f"perceptual threshold must be between 0 and {MAX_THRESHOLD}, got {threshold}")
+        self.threshold = threshold
+        self._exact: Dict[str, Path] = {}
+        self._chunks = self._chunk_spans(threshold) if threshold is not None else []
+        self._near: List[Dict[int, List[Tuple[int, Path]]]] = [{} for _ in self._chunks]
+        self.duplicates = 0
+
+    @staticmethod
+    def _chunk_spans(threshold: int) -> List[Tuple[int, int]]:
+        count = threshold + 1
+        bounds = [DHASH_BITS * i // count for i in range(count + 1)]
+        return [(lo, hi - lo) for lo, hi in zip(bounds, bounds[1:])]
+
+    def fingerprint(self, path: Path, budget: Optional[MemoryBudget] = None) -> Fingerprint:
+        """
+        Hash ``path`` for original_of, reading it once. Safe to call from several threads
+        ahead of the (ordered) original_of calls; with a ``budget`` the dHash decode waits
+        for its estimated memory. Raises OSError for unreadable files.
+        """
+        data = path.read_bytes()
+        digest = hashlib.sha256(data).hexdigest()
+        if self.threshold is None:
+            return digest, None
+        try:
+            if budget is None:
+                return digest, dhash(io.BytesIO(data))
+            with budget.reserve(estimate_decode_bytes(io.BytesIO(data), DHASH_SIDE * 4)):
+                return digest, dhash(io.BytesIO(data))
+        except (OSError, ValueError, Image.DecompressionBombError):
+            return digest, None
+
+    def original_of(self, path: Path, fingerprint: Optional[Fingerprint] = None) -> Optional[Path]:
+        """
+        The earlier input ``path`` duplicates, or None (and remember it) if it is new.
+        ``fingerprint`` is its fingerprint() if that was already computed.
+        """
+        if fingerprint is None:
+            try:
+                fingerprint = self.fingerprint(path)
+            except OSError:
+                return None  # unreadable: let the pipeline report it
+        digest, bits = fingerprint
+        original = self._exact.get(digest)
+        if original is None and bits is not None:
+            original = self._near_match(path, bits)
+        if original is not None:
+            self._exact.setdefault(digest, original)
+            self.duplicates += 1
+            logger.info(f"{path.name} duplicates {original.name}")
+            return original
+        self._exact[digest] = path
+        return None
+
+    def _near_match(self, path: Path, bits: int) -> Optional[Path]:
+        for (lo, width), index in zip(self._chunks, self._near):
+            for other, other_path in index.get((bits >> lo) & ((1 << width) - 1), ()):
+                if bin(bits ^ other).count('1') <= self.threshold:
+                    return other_path
+        for (lo, width), index in zip(self._chunks, self._near):
+            index.setdefault((bits >> lo) & ((1 << width) - 1), []).append((bits, path))
+        return None
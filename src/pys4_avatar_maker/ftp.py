@@ -0,0 +1,542 @@
+import io
+import time
+import itertools
+import posixpath
+import hashlib
+import queue
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from ftplib import FTP, all_errors, error_perm
+from pathlib import Path
+from typing import BinaryIO, Callable, Dict, Iterator, List, Optional, Sequence, Set, Tuple, Union
+from .models import FTPConfig, HostUploadResult, TransferResult, UploadCompare
+from .utils import hash_file
+
+logger = logging.getLogger("pys4_avatar_maker.ftp")
+
+UploadSource = Union[bytes, Path, BinaryIO]
+
+def ftp_target_key(ftp_cfg: FTPConfig) -> str:
+    return f"{ftp_cfg.host}:{ftp_cfg.port}{ftp_cfg.upload_dir}"
+
+@contextmanager
+def _open_source(data: UploadSource) -> Iterator[BinaryIO]:
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        yield io.BytesIO(data)
+    elif isinstance(data, Path):
+        with open(data, 'rb') as f:
+            yield f
+    else:
+        yield data
+
+def _login_key(ftp_cfg: FTPConfig) -> Tuple[str, int, Optional[str], Optional[str]]:
+    return ftp_cfg.host, ftp_cfg.port, ftp_cfg.username, ftp_cfg.password
+
+def _checksum_name(name: str) -> str:
+    return f".{name}.sha256"
+
+def _describe(data: UploadSource) -> Tuple[Optional[int], Optional[str]]:
+    """Size and SHA-256 of a replayable source; (None, None) for caller-owned streams."""
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return len(data), hashlib.sha256(data).hexdigest()
+    if isinstance(data, Path):
+        return data.stat().st_size, hash_file(data)
+    return None, None
+
+class FTPSession:
+    """
+    One logged-in FTP connection reused across uploads. Idle connections are probed
+    with NOOP before use and transparently re-established if the server dropped them.
+    ``timeout`` defaults to ``ftp_cfg.timeout``.
+    """
+    def __init__(self, ftp_cfg: FTPConfig, keepalive: float = 30.0, timeout: Optional[float] = None):
+        self.ftp_cfg = ftp_cfg
+        self.keepalive = keepalive
+        self.timeout = ftp_cfg.timeout if timeout is None else timeout
+        self._ftp: Optional[FTP] = None
+        self._last_used = 0.0
+        # Hidden names (partial uploads, checksum sidecars) in the upload dir, listed once per connection
+        self._hidden: Optional[Set[str]] = None
+
+    @property
+    def connected(self) -> bool:
+        return self._ftp is not None
+
+    def connect(self) -> FTP:
+        self.close()
+        ftp = FTP(timeout=self.timeout)
+        try:
+            ftp.connect(self.ftp_cfg.host, self.ftp_cfg.port)
+            if self.ftp_cfg.username and self.ftp_cfg.password:
+                ftp.login(self.ftp_cfg.username, self.ftp_cfg.password)
+            else:
+                ftp.login()
+            ftp.cwd(self.ftp_cfg.upload_dir)
+            ftp.voidcmd('TYPE I')  # SIZE is only meaningful in binary mode
+        except BaseException:
+            ftp.close()
+            raise
+        self._ftp = ftp
+        self._hidden = None
+        self._last_used = time.monotonic()
+        logger.info(f"Opened FTP session to {self.ftp_cfg.host}:{self.ftp_cfg.port}{self.ftp_cfg.upload_dir}")
+        return ftp
+
+    def close(self):
+        ftp, self._ftp = self._ftp, None
+        if ftp is None:
+            return
+        try:
+            ftp.quit()
+        except all_errors:
+            ftp.close()
+
+    def ensure_connected(self) -> FTP:
+        if self._ftp is None:
+            return self.connect()
+        if time.monotonic() - self._last_used >= self.keepalive:
+            try:
+                self._ftp.voidcmd('NOOP')
+                self._last_used = time.monotonic()
+            except all_errors:
+                logger.info(f"FTP session to {self.ftp_cfg.host} went stale, reconnecting")
+                return self.connect()
+        return self._ftp
+
+    def rebind(self, ftp_cfg: FTPConfig):
+        """Point the session at ``ftp_cfg`` (same server, possibly another upload dir), keeping the login."""
+        self.ftp_cfg = ftp_cfg
+        self._hidden = None
+        if self._ftp is None:
+            return
+        try:
+            self._ftp.cwd(ftp_cfg.upload_dir)
+            self._last_used = time.monotonic()
+        except all_errors:
+            self.close()  # the next use reconnects and reports the problem
+
+    def list_dirs(self, path: str) -> List[str]:
+        """Names of the subdirectories of ``path`` (MLSD, falling back to parsing LIST)."""
+        ftp = self.ensure_connected()
+        try:
+            names = [name for name, facts in ftp.mlsd(path, facts=['type']) if facts.get('type') == 'dir']
+        except error_perm:
+            lines: List[str] = []
+            ftp.retrlines(f'LIST {path}', lines.append)
+            names = [line.split(None, 8)[-1] for line in lines if line.startswith('d')]
+        ftp.voidcmd('TYPE I')  # back to binary for SIZE once the session is handed to an uploader
+        self._last_used = time.monotonic()
+        return sorted(name for name in names if name not in ('.', '..'))
+
+    def remote_size(self, name: str) -> Optional[int]:
+        """SIZE of ``name`` on the server, or None if it does not exist (or SIZE is unsupported)."""
+        try:
+            return self.ensure_connected().size(name)
+        except error_perm:
+            return None
+
+    def _read_checksum(self, name: str) -> Optional[str]:
+        buf = io.BytesIO()
+        try:
+            self.ensure_connected().retrbinary(f'RETR {_checksum_name(name)}', buf.write)
+        except error_perm:
+            return None
+        return buf.getvalue().decode('ascii', 'replace').strip() or None
+
+    def _hidden_names(self, ftp: FTP) -> Set[str]:
+        # One NLST per connection instead of probing every upload's part file and sidecar
+        if self._hidden is None:
+            try:
+                names = ftp.nlst()
+            except error_perm:
+                names = []  # some servers answer 550 for an empty directory
+            ftp.voidcmd('TYPE I')  # the listing switched to ASCII, where SIZE is refused
+            self._hidden = {posixpath.basename(n) for n in names if posixpath.basename(n).startswith('.')}
+        return self._hidden
+
+    def _drop_checksum(self, ftp: FTP, name: str):
+        # A sidecar left by an earlier CHECKSUM upload would now describe stale content
+        sidecar = _checksum_name(name)
+        if sidecar not in self._hidden_names(ftp):
+            return
+        try:
+            ftp.delete(sidecar)
+        except error_perm:
+            pass
+        self._hidden.discard(sidecar)
+
+    def is_identical(self, name: str, size: int, digest: Optional[str], compare: UploadCompare) -> bool:
+        if compare == UploadCompare.NONE or self.remote_size(name) != size:
+            return False
+        if compare == UploadCompare.SIZE:
+            return True
+        return digest is not None and self._read_checksum(name) == digest
+
+    def _store(self, ftp: FTP, name: str, data: UploadSource, offset: int) -> Tuple[int, int]:
+        """STOR ``data`` from ``offset`` (REST); returns the offset actually used and the bytes sent."""
+        sent = 0
+
+        def count(block: bytes):
+            nonlocal sent
+            sent += len(block)
+        with _open_source(data) as f:
+            if offset:
+                f.seek(offset)
+            try:
+                ftp.storbinary(f'STOR {name}', f, callback=count, rest=offset or None)
+            except error_perm:
+                if not offset:
+                    raise
+                # Server refused REST: send the whole file instead
+                logger.info(f"FTP server does not support REST, re-sending {name} from the start")
+                f.seek(0)
+                sent = 0
+                ftp.storbinary(f'STOR {name}', f, callback=count)
+                return 0, sent
+        return offset, sent
+
+    def _publish(self, ftp: FTP, temp: str, name: str):
+        try:
+            ftp.rename(temp, name)
+        except error_perm:
+            # Some servers will not rename over an existing file
+            ftp.delete(name)
+            ftp.rename(temp, name)
+
+    def upload(self, name: str, data: UploadSource, compare: UploadCompare = UploadCompare.NONE) -> TransferResult:
+        """
+        Upload ``data`` as ``name`` in the upload directory and return what was transferred.
+
+        The data is written to a hidden temporary name and renamed into place, so readers
+        never see a partial package. With ``compare`` an identical remote file is left
+        alone (CHECKSUM also stores a ``.name.sha256`` sidecar for the next comparison;
+        other modes remove it so it can never vouch for content it did not describe).
+        Bytes and paths are retried once on a fresh connection if the link drops, resuming
+        the partial temp file with REST; the temp name embeds the content hash, so a part
+        left by an earlier interrupted run is resumed too. Which parts and sidecars exist is
+        listed once per connection, so an upload with nothing to resume or remove costs
+        just STOR and the rename. Caller-owned streams are sent once, in full.
+        """
+        size, digest = _describe(data)
+        if size is not None and self.is_identical(name, size, digest, compare):
+            logger.info(f"{name} is already up to date on {self.ftp_cfg.host}, skipping")
+            return TransferResult(name=name, size=size, skipped=True)
+        temp = f".{name}.{digest[:16]}.part" if digest else f".{name}.part"
+        retries = 1 if digest else 0
+        for attempt in range(retries + 1):
+            ftp = self.ensure_connected()
+            try:
+                # Only ask for the part's size if one is known to exist (or this is the retry)
+                partial = digest and (attempt or temp in self._hidden_names(ftp))
+                offset = (self.remote_size(temp) or 0) if partial else 0
+                if size is not None and offset > size:
+                    offset = 0
+                sent = 0
+                if size is None or offset < size or size == 0:
+                    offset, sent = self._store(ftp, temp, data, offset)
+                self._publish(ftp, temp, name)
+                self._hidden_names(ftp).discard(temp)
+                if compare == UploadCompare.CHECKSUM and digest:
+                    ftp.storbinary(f'STOR {_checksum_name(name)}', io.BytesIO(f"{digest}\n".encode('ascii')))
+                    self._hidden_names(ftp).add(_checksum_name(name))
+                else:
+                    self._drop_checksum(ftp, name)
+                self._last_used = time.monotonic()
+                if offset:
+                    logger.info(f"Resumed upload of {name} at byte {offset}")
+                return TransferResult(name=name, size=sent if size is None else size, sent=sent, resumed_from=offset)
+            except error_perm:
+                raise
+            except all_errors as e:
+                self.close()
+                if attempt == retries:
+                    raise
+                logger.info(f"FTP upload of {name} interrupted ({e}), reconnecting to resume")
+
+    def __enter__(self) -> 'FTPSession':
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class FTPSessionPool:
+    """
+    Up to ``size`` FTPSessions to the same server, created lazily and shared between
+    threads so several STORs can run at once. Each session logs in only once.
+    """
+    def __init__(self, ftp_cfg: FTPConfig, size: int = 1, keepalive: float = 30.0, timeout: Optional[float] = None):
+        self.ftp_cfg = ftp_cfg
+        self.size = max(1, size)
+        self.keepalive = keepalive
+        self.timeout = timeout
+        self._idle: 'queue.LifoQueue[FTPSession]' = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def session(self) -> Iterator[FTPSession]:
+        sess = self._acquire()
+        try:
+            yield sess
+        finally:
+            self._idle.put(sess)
+
+    def _acquire(self) -> FTPSession:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                return FTPSession(self.ftp_cfg, self.keepalive, self.timeout)
+        return self._idle.get()
+
+    def adopt(self, sess: FTPSession) -> bool:
+        """
+        Take over an already logged-in session to the same server and account (e.g. the
+        one the GUI browsed with), so it is not logged into again. False if it does not
+        belong here or the pool is full; the caller keeps it then.
+        """
+        if _login_key(sess.ftp_cfg) != _login_key(self.ftp_cfg):
+            return False
+        with self._lock:
+            if self._created >= self.size:
+                return False
+            self._created += 1
+        sess.rebind(self.ftp_cfg)
+        self._idle.put(sess)
+        return True
+
+    def upload(self, name: str, data: UploadSource, compare: UploadCompare = UploadCompare.NONE) -> TransferResult:
+        with self.session() as sess:
+            return sess.upload(name, data, compare)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def __enter__(self) -> 'FTPSessionPool':
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class FanOutUploader:
+    """
+    Runs every upload job against several FTP targets concurrently. Each target gets its
+    own lane of ``per_host`` threads (and an FTPSessionPool of that size), while at most
+    ``max_concurrency`` transfers run at once across all targets. After ``offline_after``
+    consecutive connection failures a target is marked offline and its remaining jobs fail
+    immediately, so one unreachable console neither stalls the others nor holds a slot.
+    Logged-in sessions passed as ``adopt`` are handed to the pool of their server.
+    """
+    def __init__(self, targets: Sequence[FTPConfig], per_host: int = 1, max_concurrency: Optional[int] = None,
+                 offline_after: int = 2, keepalive: float = 30.0, adopt: Sequence[FTPSession] = ()):
+        self.targets = {ftp_target_key(cfg): cfg for cfg in targets}
+        self.per_host = max(1, per_host)
+        self.max_concurrency = max_concurrency or min(32, len(self.targets) * self.per_host)
+        self.offline_after = offline_after
+        self.pools = {key: FTPSessionPool(cfg, self.per_host, keepalive) for key, cfg in self.targets.items()}
+        self.results = {key: HostUploadResult(target=key) for key in self.targets}
+        self._lanes = {key: ThreadPoolExecutor(max_workers=self.per_host, thread_name_prefix=f"ftp-{cfg.host}")
+                       for key, cfg in self.targets.items()}
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        self._failures = {key: 0 for key in self.targets}
+        self._lock = threading.Lock()
+        self.adopt(adopt)
+
+    def adopt(self, sessions: Sequence[FTPSession]):
+        """Hand logged-in ``sessions`` to the pool of their server; the rest are closed."""
+        for sess in sessions:
+            if not any(pool.adopt(sess) for pool in self.pools.values()):
+                sess.close()
+
+    def reset(self) -> Dict[str, HostUploadResult]:
+        """
+        Return the per-target results so far and start counting afresh, giving offline
+        targets another chance. The sessions stay logged in, so an uploader kept across
+        batches (as watch mode does) is reset between them instead of being replaced.
+        """
+        with self._lock:
+            results, self.results = self.results, {key: HostUploadResult(target=key) for key in self.targets}
+            self._failures = {key: 0 for key in self.targets}
+        return results
+
+    def submit(self, job: Callable[[FTPConfig, FTPSessionPool], TransferResult],
+               targets: Optional[Sequence[FTPConfig]] = None) -> Dict[str, Future]:
+        """
+        Queue ``job(ftp_cfg, pool)`` for every target (or just ``targets``); it should
+        perform the upload and return its TransferResult. Returns one Future per target key.
+        """
+        keys = [ftp_target_key(cfg) for cfg in targets] if targets is not None else list(self.targets)
+        return {key: self._lanes[key].submit(self._run, key, job) for key in keys}
+
+    def _run(self, key: str, job: Callable[[FTPConfig, FTPSessionPool], TransferResult]) -> TransferResult:
+        result = self.results[key]
+        if result.offline:
+            with self._lock:
+                result.failed += 1
+            raise ConnectionError(f"FTP target {key} is offline: {result.last_error}")
+        with self._slots:
+            start = time.perf_counter()
+            try:
+                transfer = job(self.targets[key], self.pools[key])
+            except error_perm as e:
+                # The server answered, so the host is up; only this file failed
+                with self._lock:
+                    result.failed += 1
+                    result.last_error = str(e)
+                raise
+            except all_errors as e:
+                with self._lock:
+                    result.failed += 1
+                    result.last_error = str(e)
+                    self._failures[key] += 1
+                    if self._failures[key] >= self.offline_after and not result.offline:
+                        result.offline = True
+                        logger.warning(f"FTP target {key} marked offline after {self._failures[key]} failures: {e}")
+                raise
+            finally:
+                with self._lock:
+                    result.elapsed += time.perf_counter() - start
+        with self._lock:
+            self._failures[key] = 0
+            if transfer.skipped:
+                result.skipped += 1
+            else:
+                result.uploaded += 1
+            result.bytes += transfer.sent
+            result.bytes_saved += transfer.saved
+        return transfer
+
+    def close(self):
+        """Wait for queued jobs, then log out of every target."""
+        for lane in self._lanes.values():
+            lane.shutdown(wait=True)
+        for pool in self.pools.values():
+            pool.close()
+
+    def __enter__(self) -> 'FanOutUploader':
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def _failed(future: Future) -> bool:
+    return future.done() and (future.cancelled() or future.exception() is not None)
+
+class FTPBrowser:
+    """
+    Directory browsing over a single FTPSession. Listings run on one background thread
+    (an FTP connection serves one command at a time) and are returned as Futures that
+    are cached per path; the subdirectories of the folder being viewed are prefetched
+    behind any listing the user asks for, so stepping into one is usually instant.
+    detach() hands the logged-in session on (e.g. to FanOutUploader), so browsing and
+    then uploading costs a single login.
+    """
+    _USER, _PREFETCH = 0, 1
+
+    def __init__(self, ftp_cfg: FTPConfig, prefetch: int = 32, timeout: Optional[float] = None):
+        self.session = FTPSession(ftp_cfg, timeout=timeout)
+        self.prefetch = prefetch
+        self._listings: Dict[str, Future] = {}
+        self._queue: 'queue.PriorityQueue[Tuple[int, int, Optional[str]]]' = queue.PriorityQueue()
+        self._seq = itertools.count()
+        self._current: Optional[str] = None
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._serve, name=f"ftp-browse-{ftp_cfg.host}", daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def join(path: str, name: str) -> str:
+        return posixpath.normpath(posixpath.join(path or "/", name))
+
+    def cached(self, path: str) -> Optional[List[str]]:
+        """The listing of ``path`` if it has already been fetched, without waiting."""
+        future = self._listings.get(path)
+        if future is None or not future.done() or _failed(future):
+            return None
+        return future.result()
+
+    def list_dirs(self, path: str, refresh: bool = False) -> 'Future[List[str]]':
+        """
+        Subdirectory names of ``path``, which becomes the folder being viewed: its listing
+        jumps ahead of queued prefetches, and prefetches outside it are dropped.
+        """
+        with self._lock:
+            self._current = path
+            future = self._listings.get(path)
+            if refresh or future is None or _failed(future):
+                future = self._listings[path] = Future()
+            elif future.done():
+                names = future.result()
+                future = None
+            if future is not None:
+                # Also re-queues a pending prefetch at user priority; whichever entry runs second sees it done
+                self._queue.put((self._USER, next(self._seq), path))
+                return future
+        self._prefetch_children(path, names)
+        return self._listings[path]
+
+    def _prefetch_children(self, path: str, names: List[str]):
+        with self._lock:
+            for name in names[:self.prefetch]:
+                child = self.join(path, name)
+                if child not in self._listings:
+                    self._listings[child] = Future()
+                    self._queue.put((self._PREFETCH, next(self._seq), child))
+
+    def _serve(self):
+        while True:
+            priority, _, path = self._queue.get()
+            if path is None:
+                return
+            with self._lock:
+                future = self._listings.get(path)
+                if future is None or future.done():
+                    continue
+                if priority == self._PREFETCH and posixpath.dirname(path) != self._current:
+                    del self._listings[path]  # the user moved on; fetched again if they come back
+                    continue
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                names = self.session.list_dirs(path)
+            except error_perm as e:
+                future.set_exception(e)
+                continue
+            except all_errors as e:
+                self.session.close()
+                future.set_exception(e)
+                continue
+            future.set_result(names)
+            if path == self._current:
+                self._prefetch_children(path, names)
+
+    def _stop(self):
+        self._queue.put((-1, next(self._seq), None))
+        self._thread.join()
+        with self._lock:
+            for future in self._listings.values():
+                future.cancel()
+
+    def detach(self) -> FTPSession:
+        """Stop browsing and return the (still logged-in) session; the caller now owns it."""
+        self._stop()
+        return self.session
+
+    def close(self):
+        self._stop()
+        self.session.close()
+
+    def __enter__(self) -> 'FTPBrowser':
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
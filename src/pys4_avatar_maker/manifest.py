@@ -0,0 +1,138 @@
+import json
+import time
+import logging
+import threading
+from dataclasses import dataclass, field, asdict
+from pathlib import Path
+from typing import Any, Dict, List
+from .models import FTPConfig, UserType, DDSFormat, ZipCodecRules, DEFAULT_ZIP_CODECS
+from .dds import ENCODER_VERSION
+from .resample import RESAMPLER_VERSION
+from .ftp import ftp_target_key
+from .zipwriter import format_codec_rules
+from .utils import hash_file, write_atomic
+
+logger = logging.getLogger("pys4_avatar_maker.manifest")
+
+MANIFEST_NAME = '.pys4_manifest.json'
+MANIFEST_VERSION = 2
+
+@dataclass
+class ManifestEntry:
+    size: int
+    mtime_ns: int
+    sha256: str
+    user_type: str
+    output: str
+    output_size: int
+    output_mtime_ns: int
+    output_sha256: str
+    # Settings the output was built with: a change to any of them means a rebuild
+    codecs: str
+    dds_format: str
+    encoder_version: int
+    resampler_version: int
+    uploaded: List[str] = field(default_factory=list)
+
+class BatchManifest:
+    """
+    Record of what a batch has already produced in ``output_dir``: per input its size,
+    mtime and hash, the settings it was built with, plus the output's checksum and which
+    FTP targets received it.
+    Saved (atomically, throttled to ``save_interval``) as items complete, so an
+    interrupted run can resume where it stopped.
+    """
+    def __init__(self, output_dir: Path, save_interval: float = 1.0):
+        self.path = output_dir / MANIFEST_NAME
+        self.save_interval = save_interval
+        self.entries: Dict[str, ManifestEntry] = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._last_save = 0.0
+        self._load()
+
+    def _load(self):
+        try:
+            data = json.loads(self.path.read_text(encoding='utf-8'))
+            if data.get('version') == MANIFEST_VERSION:
+                self.entries = {k: ManifestEntry(**v) for k, v in data.get('entries', {}).items()}
+        except FileNotFoundError:
+            pass
+        except (ValueError, TypeError) as e:
+            logger.warning(f"Ignoring unreadable batch manifest {self.path}: {e}")
+
+    @staticmethod
+    def _key(img_path: Path) -> str:
+        return str(img_path.resolve())
+
+    @staticmethod
+    def _settings(codecs: ZipCodecRules, dds_format: DDSFormat) -> Dict[str, Any]:
+        return {'codecs': format_codec_rules(codecs), 'dds_format': dds_format.value,
+                'encoder_version': ENCODER_VERSION, 'resampler_version': RESAMPLER_VERSION}
+
+    def is_current(self, img_path: Path, out_path: Path, user_type: UserType,
+                   codecs: ZipCodecRules = DEFAULT_ZIP_CODECS, dds_format: DDSFormat = DDSFormat.DXT5) -> bool:
+        """True if ``out_path`` is a verified build of the unchanged ``img_path`` with the same settings."""
+        entry = self.entries.get(self._key(img_path))
+        if entry is None or entry.user_type != user_type.value or entry.output != out_path.name:
+            return False
+        if any(getattr(entry, name) != value for name, value in self._settings(codecs, dds_format).items()):
+            return False
+        try:
+            src_st, out_st = img_path.stat(), out_path.stat()
+        except OSError:
+            return False
+        if (out_st.st_size, out_st.st_mtime_ns) != (entry.output_size, entry.output_mtime_ns):
+            if out_st.st_size != entry.output_size or hash_file(out_path) != entry.output_sha256:
+                return False
+            entry.output_mtime_ns = out_st.st_mtime_ns
+            self._dirty = True
+        if (src_st.st_size, src_st.st_mtime_ns) == (entry.size, entry.mtime_ns):
+            return True
+        # Touched but possibly unchanged (e.g. copied again): fall back to the content hash
+        if src_st.st_size != entry.size or hash_file(img_path) != entry.sha256:
+            return False
+        entry.mtime_ns = src_st.st_mtime_ns
+        self._dirty = True
+        return True
+
+    def record(self, img_path: Path, out_path: Path, user_type: UserType,
+               codecs: ZipCodecRules = DEFAULT_ZIP_CODECS, dds_format: DDSFormat = DDSFormat.DXT5):
+        src_st, out_st = img_path.stat(), out_path.stat()
+        entry = ManifestEntry(
+            size=src_st.st_size, mtime_ns=src_st.st_mtime_ns, sha256=hash_file(img_path),
+            user_type=user_type.value, output=out_path.name, output_size=out_st.st_size,
+            output_mtime_ns=out_st.st_mtime_ns, output_sha256=hash_file(out_path),
+            **self._settings(codecs, dds_format),
+        )
+        with self._lock:
+            self.entries[self._key(img_path)] = entry
+            self._dirty = True
+        self.save()
+
+    def needs_upload(self, img_path: Path, ftp_cfg: FTPConfig) -> bool:
+        entry = self.entries.get(self._key(img_path))
+        return entry is None or ftp_target_key(ftp_cfg) not in entry.uploaded
+
+    def mark_uploaded(self, img_path: Path, ftp_cfg: FTPConfig):
+        with self._lock:
+            entry = self.entries.get(self._key(img_path))
+            target = ftp_target_key(ftp_cfg)
+            if entry is None or target in entry.uploaded:
+                return
+            entry.uploaded.append(target)
+            self._dirty = True
+        self.save()
+
+    def save(self, force: bool = False):
+        with self._lock:
+            if not self._dirty or (not force and time.monotonic() - self._last_save < self.save_interval):
+                return
+            payload = {'version': MANIFEST_VERSION, 'entries': {k: asdict(v) for k, v in self.entries.items()}}
+            try:
+                write_atomic(self.path, json.dumps(payload, indent=1).encode('utf-8'))
+            except OSError as e:
+                logger.warning(f"Could not save batch manifest {self.path}: {e}")
+                return
+            self._dirty = False
+            self._last_save = time.monotonic()
@@ -0,0 +1,94 @@
+import os
+import logging
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Optional
+from PIL import Image
+from .utils import REDUCING_GAP, REDUCE_MODES, BAND_ROWS
+
+logger = logging.getLogger("pys4_avatar_maker.memory")
+
+DEFAULT_MEMORY_FALLBACK = 2 * 1024 * 1024 * 1024
+# Pillow keeps every multi-band mode (RGB included) at 4 bytes per pixel
+_BYTES_PER_PIXEL = {'1': 1, 'L': 1, 'P': 1, 'I;16': 2, 'I;16B': 2, 'I;16L': 2}
+
+def estimate_decode_bytes(image_path: Path, max_size: int, reducing_gap: float = REDUCING_GAP) -> int:
+    """
+    Peak memory load_rgba(image_path, max_size) is expected to need, from the image header
+    alone: the decoded native buffer, which is full resolution for everything but
+    draft-scaled JPEGs, the bands for modes that are reduced band by band, and the
+    reduced RGBA working set.
+    Unreadable files estimate as 0; they fail fast in the worker anyway.
+    """
+    try:
+        with Image.open(image_path) as img:
+            floor = max(1, int(max_size * reducing_gap))
+            img.draft(None, (floor, floor))
+            w, h = img.size
+            native = w * h * _BYTES_PER_PIXEL.get(img.mode, 4)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return 0
+    factor_w, factor_h = max(1, w // floor), max(1, h // floor)
+    if (factor_w, factor_h) == (1, 1):
+        return native + w * h * 4 * 2
+    reduced = (w // factor_w + 1) * (h // factor_h + 1) * 4
+    band = w * (BAND_ROWS + factor_h) * 4 * 2 if img.mode not in REDUCE_MODES else 0
+    return native + band + reduced * 2
+
+def default_memory_limit() -> int:
+    """Half of physical memory, or 2 GiB where it cannot be determined."""
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // 2
+    except (AttributeError, ValueError, OSError):
+        return DEFAULT_MEMORY_FALLBACK
+
+class MemoryBudget:
+    """
+    Counting semaphore over bytes: callers reserve their estimated working set before
+    starting work and block while the budget is exhausted. A request larger than the
+    whole budget is admitted once nothing else is running, so it runs alone instead of
+    never.
+    """
+    def __init__(self, limit: Optional[int] = None):
+        self.limit = max(1, limit if limit is not None else default_memory_limit())
+        self._used = 0
+        self._cond = threading.Condition()
+
+    @property
+    def used(self) -> int:
+        return self._used
+
+    def acquire(self, nbytes: int) -> int:
+        """Block until ``nbytes`` fit; returns the amount actually charged (pass it to release)."""
+        nbytes = min(max(0, nbytes), self.limit)
+        with self._cond:
+            if self._used and self._used + nbytes > self.limit:
+                logger.debug(f"Waiting for {nbytes} bytes of memory budget ({self._used}/{self.limit} in use)")
+            self._cond.wait_for(lambda: self._used == 0 or self._used + nbytes <= self.limit)
+            self._used += nbytes
+        return nbytes
+
+    def release(self, nbytes: int):
+        with self._cond:
+            self._used -= nbytes
+            self._cond.notify_all()
+
+    @contextmanager
+    def reserve(self, nbytes: int) -> Iterator[int]:
+        charged = self.acquire(nbytes)
+        try:
+            yield charged
+        finally:
+            self.release(charged)
+
+_shared: Optional[MemoryBudget] = None
+_shared_lock = threading.Lock()
+
+def shared_memory_budget() -> MemoryBudget:
+    """The process-wide budget batches use unless given their own, so concurrent batches share it."""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = MemoryBudget()
+        return _shared
@@ -0,0 +1,102 @@
+import json
+import time
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional
+from .models import Span, StageHistogram, BatchResult
+from .utils import write_atomic
+
+logger = logging.getLogger("pys4_avatar_maker.metrics")
+
+# Spans are only recorded while a collector is active in the current thread/context;
+# otherwise span() costs one ContextVar lookup and records nothing.
+_collector: ContextVar[Optional[List[Span]]] = ContextVar("pys4_span_collector", default=None)
+
+class _SpanHandle:
+    __slots__ = ('bytes',)
+
+    def __init__(self, nbytes: int = 0):
+        self.bytes = nbytes
+
+@contextmanager
+def span(stage: str, nbytes: int = 0) -> Iterator[_SpanHandle]:
+    """
+    Time the enclosed block as ``stage``. Set ``handle.bytes`` inside the block when the
+    size is only known afterwards (e.g. encoded output).
+    """
+    spans = _collector.get()
+    handle = _SpanHandle(nbytes)
+    if spans is None:
+        yield handle
+        return
+    start, wall = time.perf_counter(), time.time()
+    try:
+        yield handle
+    finally:
+        spans.append(Span(stage=stage, start=wall, duration=time.perf_counter() - start, bytes=handle.bytes))
+
+@contextmanager
+def collect_spans(enabled: bool = True) -> Iterator[List[Span]]:
+    """Record every span() in this context into the yielded list (left empty when not ``enabled``)."""
+    spans: List[Span] = []
+    if not enabled:
+        yield spans
+        return
+    token = _collector.set(spans)
+    try:
+        yield spans
+    finally:
+        _collector.reset(token)
+
+def aggregate_spans(spans: Iterable[Span], stages: Optional[Dict[str, StageHistogram]] = None) -> Dict[str, StageHistogram]:
+    stages = {} if stages is None else stages
+    for s in spans:
+        stages.setdefault(s.stage, StageHistogram()).observe(s.duration, s.bytes)
+    return stages
+
+def write_trace_jsonl(result: BatchResult, path: Path):
+    """One JSON object per span, tagged with the image it belongs to."""
+    lines = []
+    for item in result.items:
+        for s in item.spans:
+            lines.append(json.dumps({'image': str(item.image_path), 'stage': s.stage, 'start': s.start,
+                                     'duration': s.duration, 'bytes': s.bytes}))
+    write_atomic(path, ('\n'.join(lines) + '\n' if lines else '').encode('utf-8'))
+    logger.info(f"Wrote {len(lines)} span(s) to {path}")
+
+def _fmt(value: float) -> str:
+    return '+Inf' if value == float('inf') else repr(float(value))
+
+def format_prometheus(result: BatchResult, prefix: str = "pys4") -> str:
+    """Render the batch's stage histograms and counters in the Prometheus text exposition format."""
+    out = [
+        f"# HELP {prefix}_stage_duration_seconds Time spent per pipeline stage in the last batch.",
+        f"# TYPE {prefix}_stage_duration_seconds histogram",
+    ]
+    for stage, hist in sorted(result.stages.items()):
+        cumulative = 0
+        for bound, count in zip(list(hist.buckets) + [float('inf')], hist.counts):
+            cumulative += count
+            out.append(f'{prefix}_stage_duration_seconds_bucket{{stage="{stage}",le="{_fmt(bound)}"}} {cumulative}')
+        out.append(f'{prefix}_stage_duration_seconds_sum{{stage="{stage}"}} {_fmt(hist.total)}')
+        out.append(f'{prefix}_stage_duration_seconds_count{{stage="{stage}"}} {hist.count}')
+    out += [f"# HELP {prefix}_stage_bytes Bytes processed per pipeline stage in the last batch.",
+            f"# TYPE {prefix}_stage_bytes gauge"]
+    out += [f'{prefix}_stage_bytes{{stage="{stage}"}} {hist.bytes}' for stage, hist in sorted(result.stages.items())]
+    for name, value, help_text in (
+        ('batch_items', result.total, "Items handled by the last batch."),
+        ('batch_failed', result.failed, "Items that failed in the last batch."),
+        ('batch_cache_hits', result.cache_hits, "Items restored from the package cache in the last batch."),
+        ('batch_skipped', result.skipped, "Items skipped as unchanged in the last batch."),
+        ('batch_uploaded', result.ftp_transferred, "Packages uploaded over FTP in the last batch."),
+        ('batch_duration_seconds', result.elapsed, "Wall time of the last batch."),
+    ):
+        out += [f"# HELP {prefix}_{name} {help_text}", f"# TYPE {prefix}_{name} gauge", f"{prefix}_{name} {value}"]
+    return '\n'.join(out) + '\n'
+
+def write_prometheus_textfile(result: BatchResult, path: Path):
+    """Write atomically, as the node_exporter textfile collector expects."""
+    write_atomic(path, format_prometheus(result).encode('utf-8'))
+    logger.info(f"Wrote batch metrics to {path}")
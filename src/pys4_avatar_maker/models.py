@@ -1,17 +1,60 @@
 from enum import Enum
 from pathlib import Path
-from dataclasses import dataclass
-from typing import Optional, List
+from dataclasses import dataclass, field, asdict
+from typing import Any, Dict, Optional, List, Tuple
+
+# Sizes (in px) of the square DDS surfaces PS4-Xplorer expects in a package
+AVATAR_SIZES: Tuple[int, ...] = (440, 260, 128, 64)
+
+# Upper bounds (in seconds) of the per-stage duration histogram buckets
+STAGE_BUCKETS: Tuple[float, ...] = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _jsonable(value: Any) -> Any:
+    if isinstance(value, Path):
+        return str(value)
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, dict):
+        return {k: _jsonable(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(v) for v in value]
+    return value
 
 class UserType(Enum):
     LOCAL = 'local'
     OFFLINE_ACTIVATED = 'offline_activated'
 
+class DDSFormat(Enum):
+    DXT1 = 'dxt1'    # BC1, 1-bit alpha, 4 bpp
+    DXT5 = 'dxt5'    # BC3, interpolated alpha, 8 bpp
+    RGBA8 = 'rgba8'  # uncompressed, 32 bpp
+
+class ZipCodec(Enum):
+    STORED = 'stored'
+    DEFLATE = 'deflate'
+
+# Per-member ZIP compression: (glob, codec, level) rules, the first matching glob wins.
+# DDS surfaces and JSON shrink well; the source PNG/JPEG is already compressed.
+ZipCodecRules = Tuple[Tuple[str, ZipCodec, int], ...]
+DEFAULT_ZIP_CODECS: ZipCodecRules = (
+    ('*.dds', ZipCodec.DEFLATE, 6),
+    ('*.json', ZipCodec.DEFLATE, 6),
+    ('*', ZipCodec.STORED, 0),
+)
+
+class UploadCompare(Enum):
+    NONE = 'none'          # always transfer
+    SIZE = 'size'          # skip when the remote file has the same size
+    CHECKSUM = 'checksum'  # skip when size and the remote SHA-256 sidecar both match
+
 @dataclass
 class AvatarPackage:
     image_path: Path
     user_type: UserType
     output_path: Path
+    sizes: Tuple[int, ...] = AVATAR_SIZES
+    dds_format: DDSFormat = DDSFormat.DXT5
+    codecs: ZipCodecRules = DEFAULT_ZIP_CODECS
 
 @dataclass
 class FTPConfig:
@@ -20,9 +63,144 @@ class FTPConfig:
     username: Optional[str] = None
     password: Optional[str] = None
     upload_dir: str = "/"
+    timeout: Optional[float] = 30.0  # connect/transfer timeout, keeps an offline console from stalling a batch
+
+@dataclass
+class Span:
+    """One timed pipeline stage (``read``, ``decode``, ``resize``, ``dds_encode``, ``zip``, ``write``, ``ftp``)."""
+    stage: str
+    start: float  # wall clock, comparable across worker processes
+    duration: float
+    bytes: int = 0
+
+@dataclass
+class StageHistogram:
+    """Duration histogram for one stage; ``counts[i]`` is the number of spans in bucket ``i`` (not cumulative)."""
+    buckets: Tuple[float, ...] = STAGE_BUCKETS
+    counts: List[int] = field(default_factory=lambda: [0] * (len(STAGE_BUCKETS) + 1))
+    count: int = 0
+    total: float = 0.0
+    bytes: int = 0
+
+    def observe(self, duration: float, nbytes: int = 0):
+        index = next((i for i, bound in enumerate(self.buckets) if duration <= bound), len(self.buckets))
+        self.counts[index] += 1
+        self.count += 1
+        self.total += duration
+        self.bytes += nbytes
+
+@dataclass
+class TransferResult:
+    """Outcome of one FTP upload: what was actually sent versus the file size."""
+    name: str
+    size: int
+    sent: int = 0
+    skipped: bool = False  # identical file already on the server
+    resumed_from: int = 0  # offset a partial upload was continued from (REST)
+
+    @property
+    def saved(self) -> int:
+        return max(self.size - self.sent, 0)
+
+@dataclass
+class HostUploadResult:
+    """Upload totals for one FTP target of a batch."""
+    target: str
+    uploaded: int = 0
+    skipped: int = 0  # already identical on the host
+    failed: int = 0
+    bytes: int = 0
+    bytes_saved: int = 0  # not sent thanks to skips and resumed transfers
+    elapsed: float = 0.0
+    offline: bool = False
+    last_error: Optional[str] = None
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    stores: int = 0
+    evictions: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+@dataclass
+class BatchItemResult:
+    image_path: Path
+    output_path: Path
+    success: bool
+    error: Optional[str] = None
+    ftp_uploaded: bool = False
+    cache_hit: bool = False
+    skipped: bool = False
+    elapsed: float = 0.0
+    spans: List[Span] = field(default_factory=list)
+    ftp_errors: Dict[str, str] = field(default_factory=dict)  # target -> error, for failed uploads
+    bytes: int = 0  # package size
+    ftp_transfers: Dict[str, TransferResult] = field(default_factory=dict)  # target -> completed upload
+    duplicate_of: Optional[Path] = None  # input this one duplicates; its output was linked/copied, not rebuilt
+    payload: Optional[bytes] = field(default=None, repr=False)  # in-memory package until it is uploaded
+    # PackageCache.changes() of the worker that built it, merged into the parent's cache
+    cache_changes: Optional[Tuple[CacheStats, Dict[str, int]]] = field(default=None, repr=False)
+
+    def to_dict(self) -> dict:
+        """JSON-serialisable record of this item."""
+        data = asdict(self)
+        del data['payload'], data['cache_changes']
+        return _jsonable(data)
 
 @dataclass
 class BatchResult:
     total: int
     ftp_transferred: int
-    output_files: List[Path] 
\ No newline at end of file
+    output_files: List[Path]
+    items: List[BatchItemResult] = field(default_factory=list)
+    elapsed: float = 0.0
+    cancelled: bool = False
+    stages: Dict[str, StageHistogram] = field(default_factory=dict)
+    ftp_hosts: Dict[str, HostUploadResult] = field(default_factory=dict)
+
+    def to_dict(self) -> dict:
+        """JSON-serialisable summary including the derived counters."""
+        data = _jsonable(asdict(self))
+        data['items'] = [item.to_dict() for item in self.items]
+        data.update(succeeded=self.succeeded, failed=self.failed, skipped=self.skipped, cache_hits=self.cache_hits,
+                    duplicates=self.duplicates,
+                    ftp_skipped=self.ftp_skipped, ftp_bytes_sent=self.ftp_bytes_sent,
+                    ftp_bytes_saved=self.ftp_bytes_saved)
+        return data
+
+    @property
+    def succeeded(self) -> int:
+        return sum(1 for item in self.items if item.success)
+
+    @property
+    def failed(self) -> int:
+        return sum(1 for item in self.items if not item.success)
+
+    @property
+    def skipped(self) -> int:
+        return sum(1 for item in self.items if item.skipped)
+
+    @property
+    def duplicates(self) -> int:
+        return sum(1 for item in self.items if item.duplicate_of is not None)
+
+    @property
+    def cache_hits(self) -> int:
+        return sum(1 for item in self.items if item.cache_hit)
+
+    @property
+    def ftp_skipped(self) -> int:
+        return sum(host.skipped for host in self.ftp_hosts.values())
+
+    @property
+    def ftp_bytes_sent(self) -> int:
+        return sum(host.bytes for host in self.ftp_hosts.values())
+
+    @property
+    def ftp_bytes_saved(self) -> int:
+        return sum(host.bytes_saved for host in self.ftp_hosts.values())
@@ -0,0 +1,186 @@
+import math
+import logging
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+import numpy as np
+from PIL import Image
+from .models import AVATAR_SIZES
+
+logger = logging.getLogger("pys4_avatar_maker.resample")
+
+# Part of the package cache key: bump whenever resampled pixels change
+RESAMPLER_VERSION = 2
+
+LANCZOS_LOBES = 3
+_BLOCK_ROWS = 16
+
+# sRGB -> linear light is a 256-entry table applied by Pillow's point() into float
+# ("F") bands, which is several times faster than a NumPy gather. Linear -> sRGB goes
+# through a 16k-entry table on the linear value, fine enough for every 8-bit step near black.
+_SRGB = np.arange(256, dtype=np.float64) / 255.0
+_SRGB_TO_LINEAR = np.where(_SRGB <= 0.04045, _SRGB / 12.92, ((_SRGB + 0.055) / 1.055) ** 2.4)
+_LINEAR_LUT = _SRGB_TO_LINEAR.astype(np.float32).tolist()
+_ALPHA_LUT = _SRGB.astype(np.float32).tolist()
+_ENCODE_STEPS = 16383
+_LINEAR = np.linspace(0.0, 1.0, _ENCODE_STEPS + 1)
+_LINEAR_TO_SRGB = np.round(255.0 * np.where(_LINEAR <= 0.0031308, _LINEAR * 12.92,
+                                             1.055 * _LINEAR ** (1 / 2.4) - 0.055)).astype(np.uint8)
+
+def _lanczos(x: np.ndarray) -> np.ndarray:
+    x = np.abs(x)
+    out = np.sinc(x) * np.sinc(x / LANCZOS_LOBES)
+    return np.where(x < LANCZOS_LOBES, out, 0.0)
+
+@lru_cache(maxsize=64)
+def filter_taps(src: int, dst: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Lanczos-3 weights for resampling ``src`` samples to ``dst``, as ``(index, weight)``
+    arrays of shape (dst, taps); rows are normalised and out-of-range taps carry zero
+    weight. Computed once per size pair and shared by every image that needs it.
+    """
+    scale = src / dst
+    stretch = max(scale, 1.0)
+    support = LANCZOS_LOBES * stretch
+    taps = int(math.ceil(support)) * 2 + 1
+    centers = (np.arange(dst) + 0.5) * scale
+    first = np.floor(centers - support + 0.5).astype(np.int64)
+    index = first[:, None] + np.arange(taps)[None, :]
+    weight = _lanczos((index + 0.5 - centers[:, None]) / stretch)
+    weight[(index < 0) | (index >= src)] = 0.0
+    weight /= weight.sum(axis=1, keepdims=True)
+    return np.clip(index, 0, src - 1), weight.astype(np.float32)
+
+@lru_cache(maxsize=64)
+def _band(src: int, dst: int) -> Tuple[np.ndarray, Tuple[Tuple[int, int, int, int], ...]]:
+    # Dense (dst, src) filter matrix plus, per block of output samples, the input range it
+    # touches: each block is one small GEMM instead of a multiply by mostly zeros.
+    index, weight = filter_taps(src, dst)
+    matrix = np.zeros((dst, src), dtype=np.float32)
+    np.add.at(matrix, (np.repeat(np.arange(dst), index.shape[1]), index.ravel()), weight.ravel())
+    blocks = []
+    for start in range(0, dst, _BLOCK_ROWS):
+        stop = min(start + _BLOCK_ROWS, dst)
+        blocks.append((start, stop, int(index[start:stop].min()), int(index[start:stop].max()) + 1))
+    return matrix, tuple(blocks)
+
+def _filter_rows(planes: np.ndarray, size: int) -> np.ndarray:
+    # (H, P, W) -> (size, P, W): multiplying from the left covers every plane in one product
+    height, count, width = planes.shape
+    matrix, blocks = _band(height, size)
+    flat = planes.reshape(height, count * width)
+    out = np.empty((size, count * width), dtype=np.float32)
+    for start, stop, lo, hi in blocks:
+        np.matmul(matrix[start:stop, lo:hi], flat[lo:hi], out=out[start:stop])
+    return out.reshape(size, count, width)
+
+def _filter_columns(plane: np.ndarray, size: int, out: np.ndarray):
+    # (H, W) -> (H, size) into ``out`` by multiplying from the right
+    matrix, blocks = _band(plane.shape[1], size)
+    for start, stop, lo, hi in blocks:
+        np.matmul(plane[:, lo:hi], matrix[start:stop, lo:hi].T, out=out[:, start:stop])
+
+def _resize_planes(planes: np.ndarray, size: int) -> np.ndarray:
+    """
+    Resample (H, P, W) ``planes`` (P = images x channels) to (size, P, size): rows by
+    multiplying from the left, columns by multiplying from the right. In this layout
+    both passes cover every plane of every image in one product and the data is never
+    transposed, so a stack only widens the GEMMs.
+    """
+    rows = _filter_rows(planes, size)
+    out = np.empty((size * rows.shape[1], size), dtype=np.float32)
+    _filter_columns(rows.reshape(-1, rows.shape[2]), size, out)
+    return out.reshape(size, rows.shape[1], size)
+
+def _premultiplied_linear_bands(img: Image.Image, opaque: bool, channels: int) -> List[Optional[np.ndarray]]:
+    # RGBA image -> ``channels`` premultiplied linear (H, W) float32 bands; an opaque
+    # image's alpha band is None (all 1) and its colour needs no premultiplying
+    red, green, blue, alpha = img.split()
+    colour = [np.asarray(band.point(_LINEAR_LUT, 'F')) for band in (red, green, blue)]
+    if opaque:
+        return colour + [None] * (channels - 3)
+    weight = np.asarray(alpha.point(_ALPHA_LUT, 'F'))
+    return [band * weight for band in colour] + [weight]
+
+def _to_srgb8(planes: np.ndarray, opaque: bool) -> np.ndarray:
+    # (H, 3 or 4, W) premultiplied linear -> (H, W, 4) uint8; an opaque image's alpha is exactly 1
+    out = np.empty((planes.shape[0], planes.shape[2], 4), dtype=np.uint8)
+    if opaque:
+        level = planes[:, :3] * np.float32(_ENCODE_STEPS)
+        out[..., 3] = 255
+    else:
+        alpha = np.clip(planes[:, 3], 0.0, 1.0)
+        scale = np.divide(np.float32(_ENCODE_STEPS), alpha, out=np.zeros_like(alpha), where=alpha > 0)
+        level = planes[:, :3] * scale[:, None, :]
+        alpha *= 255.0
+        alpha += 0.5
+        out[..., 3] = alpha
+    np.clip(level, 0, _ENCODE_STEPS, out=level)
+    level += 0.5
+    out[..., :3] = _LINEAR_TO_SRGB[level.astype(np.intp)].transpose(0, 2, 1)
+    return out
+
+def _as_image(img: Union[Image.Image, np.ndarray]) -> Image.Image:
+    if isinstance(img, Image.Image):
+        return img if img.mode == 'RGBA' else img.convert('RGBA')
+    if img.ndim != 3 or img.shape[2] != 4 or img.dtype != np.uint8:
+        raise ValueError(f"expected an HxWx4 uint8 RGBA image, got {img.dtype} {img.shape}")
+    return Image.fromarray(img, 'RGBA')
+
+def resample_stack(images: Sequence[Union[Image.Image, np.ndarray]], sizes: Sequence[int] = AVATAR_SIZES,
+                   cascade: bool = True) -> List[Dict[int, np.ndarray]]:
+    """
+    Resize same-sized RGBA images (or HxWx4 uint8 arrays) to every square size in
+    ``sizes`` in one vectorized pass over the whole stack and return one
+    ``{size: HxWx4 uint8 array}`` per image, ready for dds.encode_dds. Each axis is a
+    banded matrix product. Filtering happens in linear light on premultiplied alpha:
+    colour does not bleed out of transparent pixels and dark/bright edges keep their
+    weight. Opaque images skip the alpha plane. With ``cascade`` each size is filtered
+    from the next larger one (kept as float, never requantised).
+    """
+    images = [_as_image(img) for img in images]
+    if len({img.size for img in images}) > 1:
+        raise ValueError(f"resample_stack needs images of one size, got {sorted({img.size for img in images})}")
+    opaque = [img.getchannel('A').getextrema() == (255, 255) for img in images]
+    channels = 3 if all(opaque) else 4
+    height = images[0].height
+    chains: List[Dict[int, np.ndarray]] = [{} for _ in images]
+    planes = None
+    for size in sorted(set(sizes), reverse=True):
+        if planes is None or not cascade:
+            # From the source: filter each image's columns while its full-size float bands
+            # are the only ones alive, then one row product covers the whole stack
+            cols = np.empty((height, len(images) * channels, size), dtype=np.float32)
+            for n, img in enumerate(images):
+                for c, band in enumerate(_premultiplied_linear_bands(img, opaque[n], channels)):
+                    if band is None:
+                        cols[:, n * channels + c] = 1.0
+                    else:
+                        _filter_columns(band, size, cols[:, n * channels + c])
+            planes = _filter_rows(cols, size)
+            del cols
+        else:
+            planes = _resize_planes(planes, size)
+        for n, chain in enumerate(chains):
+            chain[size] = _to_srgb8(planes[:, n * channels:(n + 1) * channels], opaque[n])
+    return [{size: chain[size] for size in sizes} for chain in chains]
+
+def resample_chains(images: Sequence[Union[Image.Image, np.ndarray]], sizes: Sequence[int] = AVATAR_SIZES,
+                    cascade: bool = True) -> List[Dict[int, np.ndarray]]:
+    """
+    resample_chain for many images: images of the same size are grouped and each group
+    is resampled as one stack (resample_stack). Results come back in input order.
+    """
+    images = [_as_image(img) for img in images]
+    groups: Dict[Tuple[int, int], List[int]] = {}
+    for index, img in enumerate(images):
+        groups.setdefault(img.size, []).append(index)
+    chains: List[Optional[Dict[int, np.ndarray]]] = [None] * len(images)
+    for indices in groups.values():
+        for index, chain in zip(indices, resample_stack([images[i] for i in indices], sizes, cascade)):
+            chains[index] = chain
+    return chains
+
+def resample_chain(img: Union[Image.Image, np.ndarray], sizes: Sequence[int] = AVATAR_SIZES,
+                   cascade: bool = True) -> Dict[int, np.ndarray]:
+    """Resize one RGBA image (or HxWx4 uint8 array) to every size in ``sizes``: a stack of one, see resample_stack."""
+    return resample_stack([img], sizes, cascade)[0]
@@ -0,0 +1,102 @@
+import os
+import logging
+from fnmatch import fnmatch
+from pathlib import Path
+from typing import Iterator, Optional, Sequence
+
+logger = logging.getLogger("pys4_avatar_maker.scanner")
+
+# Magic numbers of the formats the pipeline accepts
+IMAGE_SIGNATURES = {
+    b'\x89PNG\r\n\x1a\n': 'png',
+    b'\xff\xd8\xff': 'jpeg',
+}
+SUFFIX_FORMATS = {'.png': 'png', '.jpg': 'jpeg', '.jpeg': 'jpeg'}
+
+def image_format_of(head: bytes) -> Optional[str]:
+    """Return 'png'/'jpeg' for data starting with ``head``, or None if it is neither."""
+    for magic, fmt in IMAGE_SIGNATURES.items():
+        if head.startswith(magic):
+            return fmt
+    return None
+
+def sniff_image_format(path: Path) -> Optional[str]:
+    """Return 'png'/'jpeg' based on the file's leading bytes, or None if it is neither."""
+    try:
+        with open(path, 'rb') as f:
+            head = f.read(8)
+    except OSError:
+        return None
+    return image_format_of(head)
+
+def _matches(rel: str, name: str, patterns: Sequence[str]) -> bool:
+    return any(fnmatch(name, pat) or fnmatch(rel, pat) for pat in patterns)
+
+def is_candidate(rel: str, include: Sequence[str] = (), exclude: Sequence[str] = ()) -> bool:
+    """Whether the file at ``rel`` (``/``-separated, relative to the scan root) passes the iter_images filters."""
+    parts = rel.split('/')
+    name = parts[-1]
+    if any(part.startswith('.') for part in parts):
+        return False
+    if exclude:
+        # A file inside an excluded folder is excluded too
+        for depth in range(1, len(parts) + 1):
+            if _matches('/'.join(parts[:depth]), parts[depth - 1], exclude):
+                return False
+    if include:
+        return _matches(rel, name, include)
+    return Path(name).suffix.lower() in SUFFIX_FORMATS
+
+def iter_images(root: Path, recursive: bool = False, include: Sequence[str] = (), exclude: Sequence[str] = (),
+                sniff: bool = True, sort: bool = False) -> Iterator[Path]:
+    """
+    Lazily yield image files under ``root`` using ``os.scandir``.
+
+    Candidates are files with a PNG/JPEG suffix, or matching one of the ``include``
+    globs when given; ``exclude`` globs skip files and prune directories. Globs are
+    matched against the name and the ``/``-separated path relative to ``root``.
+    With ``sniff`` each candidate's magic bytes are checked so mislabelled or
+    truncated files are dropped before anything tries to decode them. Hidden
+    entries (dot-files, e.g. manifests and temp files) are ignored.
+    """
+    stack = [(Path(root), '')]
+    while stack:
+        directory, rel_dir = stack.pop()
+        try:
+            with os.scandir(directory) as it:
+                entries = sorted(it, key=lambda e: e.name) if sort else it
+                subdirs = []
+                for entry in entries:
+                    if entry.name.startswith('.'):
+                        continue
+                    rel = f"{rel_dir}{entry.name}"
+                    if exclude and _matches(rel, entry.name, exclude):
+                        continue
+                    try:
+                        if entry.is_dir():
+                            if recursive:
+                                subdirs.append((Path(entry.path), rel + '/'))
+                            continue
+                        if not entry.is_file():
+                            continue
+                    except OSError:
+                        continue
+                    if include:
+                        if not _matches(rel, entry.name, include):
+                            continue
+                    elif Path(entry.name).suffix.lower() not in SUFFIX_FORMATS:
+                        continue
+                    path = Path(entry.path)
+                    if sniff:
+                        fmt = sniff_image_format(path)
+                        if fmt is None:
+                            logger.warning(f"Skipping {path}: not a PNG or JPEG despite its name")
+                            continue
+                        expected = SUFFIX_FORMATS.get(path.suffix.lower())
+                        if expected and fmt != expected:
+                            logger.info(f"{path} is actually {fmt.upper()}, processing it as such")
+                    yield path
+                # Depth-first, visiting subdirectories in listing order
+                stack.extend(reversed(subdirs))
+        except OSError as e:
+            logger.warning(f"Cannot scan {directory}: {e}")
@@ -0,0 +1,228 @@
+import io
+import os
+import json
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlsplit, parse_qs
+from PIL import Image, UnidentifiedImageError
+from .models import AvatarPackage, UserType, DDSFormat, ZipCodecRules, DEFAULT_ZIP_CODECS
+from .cache import PackageCache
+from .memory import MemoryBudget, estimate_decode_bytes, shared_memory_budget
+from .scanner import image_format_of
+from .services import ImageDecodeError, build_avatar_package, default_worker_count
+
+logger = logging.getLogger("pys4_avatar_maker.server")
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+DEFAULT_MAX_BODY = 64 * 1024 * 1024
+DEFAULT_RESPONSE_CACHE_BYTES = 64 * 1024 * 1024
+
+def _warm() -> int:
+    # Importing this module in the worker pulls in Pillow, numpy and the pipeline once
+    return os.getpid()
+
+def _build_in_worker(pkg: AvatarPackage, cache: Optional[PackageCache], source: bytes):
+    # The package plus what the worker's copy of the cache did, for PackageCache.merge
+    return build_avatar_package(pkg, None, cache, source), cache.changes() if cache is not None else None
+
+class AvatarService:
+    """
+    Builds packages from uploaded image bytes on a pool of ``workers`` processes that
+    stay up (and imported) between requests. At most ``max_concurrent`` requests are
+    admitted at once; the caller rejects the rest. Finished packages are kept in an
+    in-memory LRU of ``cache_bytes`` keyed like the PackageCache (content hash plus
+    settings), and identical requests arriving together share a single build.
+    """
+    def __init__(self, workers: Optional[int] = None, max_concurrent: Optional[int] = None,
+                 cache_bytes: int = DEFAULT_RESPONSE_CACHE_BYTES, package_cache: Optional[PackageCache] = None,
+                 zip_codecs: ZipCodecRules = DEFAULT_ZIP_CODECS, memory_budget: Optional[MemoryBudget] = None,
+                 dds_format: DDSFormat = DDSFormat.DXT5):
+        self.workers = workers or default_worker_count()
+        self.max_concurrent = max_concurrent or self.workers * 2
+        self.cache_bytes = cache_bytes
+        self.package_cache = package_cache
+        self.zip_codecs = zip_codecs
+        self.dds_format = dds_format
+        self.budget = memory_budget or shared_memory_budget()
+        self.stats = {'requests': 0, 'cache_hits': 0, 'rejected': 0, 'failed': 0}
+        self._slots = threading.BoundedSemaphore(self.max_concurrent)
+        self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        self._responses: 'OrderedDict[str, bytes]' = OrderedDict()
+        self._response_size = 0
+        self._building: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def warm(self):
+        """Start every worker process now instead of on the first requests."""
+        pids = {f.result() for f in [self._pool.submit(_warm) for _ in range(self.workers)]}
+        logger.info(f"Started {len(pids)} worker process(es)")
+
+    def try_acquire(self) -> bool:
+        if self._slots.acquire(blocking=False):
+            return True
+        with self._lock:
+            self.stats['rejected'] += 1
+        return False
+
+    def release(self):
+        self._slots.release()
+
+    def render(self, source: bytes, user_type: UserType, name: str = 'avatar.png') -> Tuple[bytes, bool]:
+        """Return the .xavatar bytes for ``source`` and whether they came from the response cache."""
+        pkg = AvatarPackage(image_path=Path(name), user_type=user_type, output_path=Path(name).with_suffix('.xavatar'),
+                            codecs=self.zip_codecs, dds_format=self.dds_format)
+        key = PackageCache.key(source, pkg)
+        with self._lock:
+            self.stats['requests'] += 1
+            data = self._responses.get(key)
+            if data is not None:
+                self._responses.move_to_end(key)
+                self.stats['cache_hits'] += 1
+                return data, True
+            building = self._building.get(key)
+            if building is None:
+                self._building[key] = future = Future()
+        if building is not None:
+            return building.result(), True
+        try:
+            data = self._build(source, pkg)
+        except BaseException as e:
+            with self._lock:
+                self.stats['failed'] += 1
+                del self._building[key]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            del self._building[key]
+            if len(data) <= self.cache_bytes:
+                self._responses[key] = data
+                self._response_size += len(data)
+                while self._response_size > self.cache_bytes:
+                    _, evicted = self._responses.popitem(last=False)
+                    self._response_size -= len(evicted)
+        future.set_result(data)
+        return data, False
+
+    def _build(self, source: bytes, pkg: AvatarPackage) -> bytes:
+        with self.budget.reserve(estimate_decode_bytes(io.BytesIO(source), max(pkg.sizes))):
+            pool = self._pool
+            try:
+                data, changes = pool.submit(_build_in_worker, pkg, self.package_cache, source).result()
+            except BrokenProcessPool as e:
+                # A worker died (e.g. killed for memory): replace the pool for later requests
+                with self._lock:
+                    if self._pool is pool:
+                        logger.error("Worker pool broke, restarting it")
+                        self._pool = ProcessPoolExecutor(max_workers=self.workers)
+                raise RuntimeError(f"worker crashed while building {pkg.image_path.name}") from e
+        if changes is not None:
+            with self._lock:
+                self.package_cache.merge(*changes)
+        return data
+
+    def health(self) -> dict:
+        with self._lock:
+            return dict(self.stats, workers=self.workers, max_concurrent=self.max_concurrent,
+                        cached=len(self._responses), cached_bytes=self._response_size)
+
+    def close(self):
+        self._pool.shutdown(wait=True, cancel_futures=True)
+
+class AvatarHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], service: AvatarService, max_body: int = DEFAULT_MAX_BODY,
+                 user_type: UserType = UserType.LOCAL):
+        super().__init__(address, AvatarRequestHandler)
+        self.service = service
+        self.max_body = max_body
+        self.user_type = user_type
+
+class AvatarRequestHandler(BaseHTTPRequestHandler):
+    """
+    ``POST /avatar?user_type=local&name=me.png`` with the PNG/JPEG as the request body
+    answers with the .xavatar (``X-Cache: HIT`` when it was served from memory);
+    ``GET /health`` reports the service counters as JSON.
+    """
+    server: AvatarHTTPServer
+    protocol_version = 'HTTP/1.1'
+    server_version = 'pys4_avatar_maker'
+
+    def do_GET(self):
+        if urlsplit(self.path).path != '/health':
+            return self._error(HTTPStatus.NOT_FOUND, "not found")
+        self._send(HTTPStatus.OK, json.dumps(self.server.service.health()).encode(), 'application/json')
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path != '/avatar':
+            return self._error(HTTPStatus.NOT_FOUND, "not found", close=True)
+        query = parse_qs(url.query)
+        try:
+            user_type = UserType(query['user_type'][0]) if 'user_type' in query else self.server.user_type
+        except ValueError:
+            return self._error(HTTPStatus.BAD_REQUEST, f"unknown user_type {query['user_type'][0]!r}", close=True)
+        name = Path(query.get('name', ['avatar.png'])[0]).name or 'avatar.png'
+        try:
+            length = int(self.headers['Content-Length'])
+        except (TypeError, ValueError):
+            return self._error(HTTPStatus.LENGTH_REQUIRED, "Content-Length required", close=True)
+        if length > self.server.max_body:
+            return self._error(HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                               f"image exceeds {self.server.max_body} bytes", close=True)
+        service = self.server.service
+        if not service.try_acquire():
+            return self._error(HTTPStatus.SERVICE_UNAVAILABLE, "too many concurrent requests", close=True,
+                               headers={'Retry-After': '1'})
+        try:
+            source = self.rfile.read(length)
+            if image_format_of(source[:8]) is None:
+                return self._error(HTTPStatus.UNSUPPORTED_MEDIA_TYPE, "expected a PNG or JPEG image")
+            data, hit = service.render(source, user_type, name)
+        except (ImageDecodeError, UnidentifiedImageError, Image.DecompressionBombError) as e:
+            # The image could not be decoded; anything else (e.g. a crashed worker) is our fault
+            return self._error(HTTPStatus.UNPROCESSABLE_ENTITY, str(e))
+        except Exception as e:
+            logger.error(f"Failed to build {name}: {e}", exc_info=True)
+            return self._error(HTTPStatus.INTERNAL_SERVER_ERROR, str(e))
+        finally:
+            service.release()
+        self._send(HTTPStatus.OK, data, 'application/zip', {
+            'Content-Disposition': f'attachment; filename="{Path(name).stem}.xavatar"',
+            'X-Cache': 'HIT' if hit else 'MISS',
+        })
+
+    def _send(self, status: HTTPStatus, body: bytes, content_type: str, headers: Optional[Dict[str, str]] = None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if self.close_connection:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, status: HTTPStatus, message: str, close: bool = False, headers: Optional[Dict[str, str]] = None):
+        # ``close``: the request body was not read, so the connection cannot be reused
+        if close:
+            self.close_connection = True
+        self._send(status, json.dumps({'error': message}).encode(), 'application/json', headers)
+
+    def log_message(self, format: str, *args):
+        logger.info(f"{self.address_string()} {format % args}")
+
+def make_server(service: AvatarService, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT,
+                max_body: int = DEFAULT_MAX_BODY, user_type: UserType = UserType.LOCAL) -> AvatarHTTPServer:
+    """Bind the HTTP front end for ``service``; run it with ``serve_forever()``."""
+    server = AvatarHTTPServer((host, port), service, max_body, user_type)
+    logger.info(f"Serving avatars on http://{server.server_address[0]}:{server.server_address[1]}/avatar")
+    return server
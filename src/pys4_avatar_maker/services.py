@@ -1,88 +1,653 @@
 from pathlib import Path
-from .models import AvatarPackage, UserType, FTPConfig, BatchResult
-from .utils import zip_files, convert_to_dds
-import shutil
+from .models import (AvatarPackage, UserType, DDSFormat, FTPConfig, BatchResult, BatchItemResult, TransferResult, UploadCompare,
+                     HostUploadResult, ZipCodecRules, DEFAULT_ZIP_CODECS, AVATAR_SIZES)
+from .cache import PackageCache
+from .ftp import FTPSession, FTPSessionPool, FanOutUploader, ftp_target_key
+from .manifest import BatchManifest
+from .dedup import Deduplicator
+from .metrics import span, collect_spans, aggregate_spans
+from .memory import MemoryBudget, estimate_decode_bytes, shared_memory_budget
+from .utils import zip_entries, write_atomic, link_or_copy, load_rgba, encode_dds, encode_png
+from .resample import resample_chain
+from PIL import Image, UnidentifiedImageError
+import io
+import os
+from collections import deque
 import json
+import time
 import logging
-from ftplib import FTP
-from typing import List
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from queue import SimpleQueue
+from threading import Event, Lock
+from dataclasses import dataclass, replace
+from typing import Callable, Deque, Dict, Generator, Iterable, Iterator, List, Optional, Sequence, Set, Tuple, Union
 
 logger = logging.getLogger("pys4_avatar_maker.services")
 
-def process_avatar(pkg: AvatarPackage, tmp_dir: Path):
+OFFLINE_ONLINE_JSON = {
+    "avatarUrl": "http://static-resource.np.community.playstation.net/avatar_xl/WWS_E/E0012_XL.png",
+    "firstName": "",
+    "lastName": "",
+    "pictureUrl": "https://image.api.np.km.playstation.net/images/?format=png&w=440&h=440&image=https%3A%2F%2Fkfscdn.api.np.km.playstation.net%2F00000000000008%2F000000000000003.png&sign=blablabla019501",
+    "trophySummary": "{\"level\":1,\"progress\":0,\"earnedTrophies\":{\"platinum\":0,\"gold\":0,\"silver\":0,\"bronze\":0}}",
+    "isOfficiallyVerified": "true"
+}
+
+class ImageDecodeError(ValueError):
+    """The source image is not a supported image, or is truncated or corrupt."""
+
+def process_avatar(pkg: AvatarPackage, debug_dir: Optional[Path] = None, source: Optional[bytes] = None) -> Dict[str, bytes]:
+    """
+    Encode every member of the avatar package in memory and return ``{arcname: data}``.
+    ``source`` may carry the already-read image bytes. If ``debug_dir`` is given, the
+    members plus a PNG sidecar per DDS size are also written there for inspection.
+    """
     try:
-        tmp_dir.mkdir(exist_ok=True)
-        base_img = pkg.image_path
-        png_path = tmp_dir / 'avatar.png'
-        shutil.copy(base_img, png_path)
-        logger.info(f"Copied base image to {png_path}")
-        sizes = [440, 260, 128, 64]
-        dds_paths = []
-        for size in sizes:
-            dds_path = tmp_dir / f'avatar{size}.dds'
-            convert_to_dds(png_path, dds_path, size)
-            dds_paths.append(dds_path)
-        files_to_zip = [png_path] + dds_paths
+        if source is None:
+            source = _read_source(pkg.image_path)
+        entries = {'avatar.png': source}
+        try:
+            with span('decode', len(source)):
+                img = load_rgba(io.BytesIO(source), max(pkg.sizes))
+        except UnidentifiedImageError as e:
+            raise ImageDecodeError(f"{pkg.image_path.name} is not a supported image") from e
+        except (OSError, SyntaxError, ValueError, Image.DecompressionBombError) as e:
+            # Truncated or corrupt data: Pillow reports it as OSError (or SyntaxError for bad chunks)
+            raise ImageDecodeError(f"{pkg.image_path.name} could not be decoded: {e}") from e
+        with span('resize', img.width * img.height * 4):
+            chain = resample_chain(img, pkg.sizes)
+        for size, pixels in chain.items():
+            with span('dds_encode') as encoded:
+                entries[f'avatar{size}.dds'] = encode_dds(pixels, pkg.dds_format)
+                encoded.bytes = len(entries[f'avatar{size}.dds'])
         if pkg.user_type == UserType.OFFLINE_ACTIVATED:
-            online_json = tmp_dir / 'online.json'
-            with open(online_json, 'w', encoding='utf-8') as f:
-                json.dump({
-                    "avatarUrl": "http://static-resource.np.community.playstation.net/avatar_xl/WWS_E/E0012_XL.png",
-                    "firstName": "",
-                    "lastName": "",
-                    "pictureUrl": "https://image.api.np.km.playstation.net/images/?format=png&w=440&h=440&image=https%3A%2F%2Fkfscdn.api.np.km.playstation.net%2F00000000000008%2F000000000000003.png&sign=blablabla019501",
-                    "trophySummary": "{\"level\":1,\"progress\":0,\"earnedTrophies\":{\"platinum\":0,\"gold\":0,\"silver\":0,\"bronze\":0}}",
-                    "isOfficiallyVerified": "true"
-                }, f)
-            files_to_zip.append(online_json)
-            logger.info(f"Created online.json for offline activated user at {online_json}")
-        return files_to_zip
+            entries['online.json'] = json.dumps(OFFLINE_ONLINE_JSON).encode('utf-8')
+            logger.info(f"Added online.json for offline activated user to {pkg.output_path.name}")
+        if debug_dir is not None:
+            debug_dir.mkdir(parents=True, exist_ok=True)
+            for arcname, data in entries.items():
+                (debug_dir / arcname).write_bytes(data)
+            for size, pixels in chain.items():
+                (debug_dir / f'avatar{size}.png').write_bytes(encode_png(Image.fromarray(pixels)))
+            logger.info(f"Wrote debug sidecars to {debug_dir}")
+        return entries
+    except ImageDecodeError as e:
+        logger.error(f"Error processing avatar: {e}")  # bad input, a traceback adds nothing
+        raise
     except Exception as e:
         logger.error(f"Error processing avatar: {e}", exc_info=True)
         raise
 
-def package_avatar(pkg: AvatarPackage, tmp_dir: Path):
+def _read_source(path: Path) -> bytes:
+    with span('read') as read:
+        data = path.read_bytes()
+        read.bytes = len(data)
+    return data
+
+def _zip(entries: Dict[str, bytes], pkg: AvatarPackage) -> bytes:
+    with span('zip') as zipped:
+        data = zip_entries(entries, codecs=pkg.codecs)
+        zipped.bytes = len(data)
+    return data
+
+def build_avatar_package(pkg: AvatarPackage, debug_dir: Optional[Path] = None,
+                         cache: Optional[PackageCache] = None, source: Optional[bytes] = None) -> bytes:
+    """
+    Return the finished .xavatar archive as bytes without touching disk (other than the
+    cache). ``source`` may carry the image bytes, in which case ``pkg.image_path`` only names it.
+    """
+    return _build_package(pkg, debug_dir, cache, source)[0]
+
+def _build_package(pkg: AvatarPackage, debug_dir: Optional[Path], cache: Optional[PackageCache],
+                   source: Optional[bytes] = None) -> Tuple[bytes, bool]:
+    # build_avatar_package plus whether the bytes came from the cache
+    if source is None:
+        source = _read_source(pkg.image_path)
+    key = cache.key(source, pkg) if cache is not None else None
+    if key is not None and debug_dir is None:
+        data = cache.get(key)
+        if data is not None:
+            return data, True
+    data = _zip(process_avatar(pkg, debug_dir, source), pkg)
+    if key is not None:
+        cache.put(key, data)
+    return data, False
+
+def package_avatar(pkg: AvatarPackage, debug_dir: Optional[Path] = None, cache: Optional[PackageCache] = None) -> bool:
+    """
+    Build ``pkg`` and write it to ``pkg.output_path``. With a ``cache`` an identical
+    earlier build is copied (or hardlinked) into place instead. Returns True on a cache hit.
+    """
     try:
-        files = process_avatar(pkg, tmp_dir)
-        zip_files(files, pkg.output_path)
+        source = _read_source(pkg.image_path)
+        key = cache.key(source, pkg) if cache is not None else None
+        if key is not None and debug_dir is None and cache.restore(key, pkg.output_path):
+            logger.info(f"Restored {pkg.output_path} from package cache")
+            return True
+        data = _zip(process_avatar(pkg, debug_dir, source), pkg)
+        with span('write', len(data)):
+            write_atomic(pkg.output_path, data)
+        if key is not None:
+            cache.put(key, data)
         logger.info(f"Packaged avatar to {pkg.output_path}")
-        # Robust cleanup: remove the entire tmp_dir and its contents
-        shutil.rmtree(tmp_dir, ignore_errors=True)
+        return False
     except Exception as e:
         logger.error(f"Error packaging avatar: {e}", exc_info=True)
-        # Try to clean up even on error
-        shutil.rmtree(tmp_dir, ignore_errors=True)
         raise
 
-def upload_via_ftp(ftp_cfg: FTPConfig, file_path: Path):
+def upload_via_ftp(ftp_cfg: FTPConfig, file_path: Path, session: Optional[Union[FTPSession, FTPSessionPool]] = None,
+                   compare: UploadCompare = UploadCompare.NONE, data: Optional[bytes] = None) -> TransferResult:
+    """
+    Upload ``file_path``; pass a ``session`` (or pool) to reuse one login across uploads.
+    With ``compare`` an identical copy already on the server is not sent again.
+    With ``data`` the package is sent from memory and ``file_path`` only names it.
+    """
+    source = file_path if data is None else data
     try:
-        with FTP() as ftp:
-            ftp.connect(ftp_cfg.host, ftp_cfg.port)
-            if ftp_cfg.username and ftp_cfg.password:
-                ftp.login(ftp_cfg.username, ftp_cfg.password)
+        with span('ftp') as sent:
+            if session is not None:
+                transfer = session.upload(file_path.name, source, compare)
             else:
-                ftp.login()
-            ftp.cwd(ftp_cfg.upload_dir)
-            with open(file_path, 'rb') as f:
-                ftp.storbinary(f'STOR {file_path.name}', f)
+                with FTPSession(ftp_cfg) as one_shot:
+                    transfer = one_shot.upload(file_path.name, source, compare)
+            sent.bytes = transfer.sent
+        if not transfer.skipped:
             logger.info(f"Uploaded {file_path} to FTP {ftp_cfg.host}:{ftp_cfg.port}{ftp_cfg.upload_dir}")
+        return transfer
     except Exception as e:
         logger.error(f"FTP upload failed for {file_path}: {e}", exc_info=True)
         raise
 
-def process_batch_avatars(image_paths: List[Path], user_type: UserType, output_dir: Path, ftp_cfg: FTPConfig = None) -> BatchResult:
-    output_files = []
-    ftp_transferred = 0
-    for img_path in image_paths:
-        out_file = output_dir / (img_path.stem + '.xavatar')
-        tmp_dir = output_dir / (img_path.stem + '_tmp')
-        pkg = AvatarPackage(image_path=img_path, user_type=user_type, output_path=out_file)
-        package_avatar(pkg, tmp_dir)
-        output_files.append(out_file)
-        if ftp_cfg:
+def _package_batch_item(img_path: Path, user_type: UserType, out_file: Path, debug_dir: Optional[Path],
+                        cache: Optional[PackageCache], metrics: bool = False,
+                        codecs: ZipCodecRules = DEFAULT_ZIP_CODECS, in_memory: bool = False,
+                        dds_format: DDSFormat = DDSFormat.DXT5, source_path: Optional[Path] = None) -> BatchItemResult:
+    # Runs inside pool workers: never raise, report the failure on the item instead.
+    # Spans recorded here travel back to the parent on the (pickled) result, and so does
+    # the package itself when it is built ``in_memory`` instead of written to out_file,
+    # and what the worker's copy of the cache did. With ``source_path`` the package is
+    # built from that image instead: img_path is a duplicate of it (see _BatchUploads).
+    start = time.perf_counter()
+    with collect_spans(metrics) as spans:
+        try:
+            pkg = AvatarPackage(image_path=source_path or img_path, user_type=user_type, output_path=out_file,
+                                codecs=codecs, dds_format=dds_format)
+            if in_memory:
+                data, hit = _build_package(pkg, None, cache)
+                item = BatchItemResult(image_path=img_path, output_path=out_file, success=True, cache_hit=hit,
+                                       elapsed=time.perf_counter() - start, spans=spans, bytes=len(data),
+                                       duplicate_of=source_path, payload=data)
+            else:
+                hit = package_avatar(pkg, debug_dir, cache)
+                item = BatchItemResult(image_path=img_path, output_path=out_file, success=True, cache_hit=hit,
+                                       elapsed=time.perf_counter() - start, spans=spans)
+        except Exception as e:
+            item = BatchItemResult(image_path=img_path, output_path=out_file, success=False, error=str(e),
+                                   elapsed=time.perf_counter() - start, spans=spans, duplicate_of=source_path)
+    if cache is not None:
+        item.cache_changes = cache.changes()
+    return item
+
+BatchJob = Tuple[Path, UserType, Path, Optional[Path], Optional[PackageCache], bool, ZipCodecRules, bool, DDSFormat,
+                 Optional[Path]]
+
+def _submit_within_budget(pool: ProcessPoolExecutor, task: BatchJob, budget: MemoryBudget) -> Future:
+    # Reserve the image's estimated decode footprint until its worker is done with it
+    charged = budget.acquire(estimate_decode_bytes(task[9] or task[0], max(AVATAR_SIZES)))
+    try:
+        future = pool.submit(_package_batch_item, *task)
+    except BaseException:
+        budget.release(charged)
+        raise
+    future.add_done_callback(lambda _: budget.release(charged))
+    return future
+
+def _run_batch_items(tasks: Iterable[Union[BatchJob, BatchItemResult]], workers: int,
+                     window: int, budget: Optional[MemoryBudget] = None) -> Iterator[BatchItemResult]:
+    """
+    Package every job, yielding results in input order. ``tasks`` is consumed lazily;
+    ready-made results (e.g. skipped items) pass straight through. At most ``window``
+    tasks are in flight, so huge inputs are neither materialised nor queued up front.
+    With a ``budget``, a job is only handed to a worker once its estimated decode memory
+    fits, so a run of very large images is processed a few at a time.
+    """
+    if workers <= 1:
+        for task in tasks:
+            yield task if isinstance(task, BatchItemResult) else _package_batch_item(*task)
+        return
+    pool = ProcessPoolExecutor(max_workers=workers)
+    pending: Deque[Union[Future, BatchItemResult]] = deque()
+    try:
+        for task in tasks:
+            if isinstance(task, BatchItemResult):
+                pending.append(task)
+            elif budget is not None:
+                pending.append(_submit_within_budget(pool, task, budget))
+            else:
+                pending.append(pool.submit(_package_batch_item, *task))
+            while len(pending) >= window:
+                done = pending.popleft()
+                yield done if isinstance(done, BatchItemResult) else done.result()
+        while pending:
+            done = pending.popleft()
+            yield done if isinstance(done, BatchItemResult) else done.result()
+    finally:
+        # Reached early when the caller stops iterating (e.g. cancel): drop queued work
+        pool.shutdown(wait=True, cancel_futures=True)
+
+def _is_placeholder(item: BatchItemResult) -> bool:
+    # A duplicate passed through unbuilt, as opposed to one built from its original's source
+    return item.duplicate_of is not None and not item.success and item.error is None
+
+def _link_duplicate(item: BatchItemResult, original_output: Optional[Path], link: bool, on_disk: bool = True):
+    """Give a duplicate input its package by linking (or copying) the original's."""
+    start = time.perf_counter()
+    if original_output is None:
+        item.error = f"duplicate of {item.duplicate_of.name}, which failed"
+        return
+    try:
+        if on_disk and original_output != item.output_path:
+            link_or_copy(original_output, item.output_path, link)
+        item.success = True
+        logger.info(f"{item.output_path.name} is a duplicate of {item.duplicate_of.name}, reused {original_output.name}")
+    except OSError as e:
+        item.error = f"could not reuse {original_output.name} for duplicate: {e}"
+    item.elapsed = time.perf_counter() - start
+
+def _settle_uploads(item: BatchItemResult, futures: Dict[str, Future], done: Callable[[BatchItemResult], None]):
+    # Calls done(item) from whichever upload finishes last, once its FTP fields are filled in
+    remaining = [len(futures)]
+    lock = Lock()
+
+    def one_done(_):
+        with lock:
+            remaining[0] -= 1
+            if remaining[0]:
+                return
+        for key, future in futures.items():
+            if future.exception() is not None:
+                item.ftp_errors[key] = str(future.exception())
+            else:
+                item.ftp_transfers[key] = future.result()
+        item.ftp_uploaded = not item.ftp_errors
+        done(item)
+
+    for future in futures.values():
+        future.add_done_callback(one_done)
+
+def _map_ahead(fn: Callable[[Path], object], entries: Iterable[Tuple[Path, bool]], pool: ThreadPoolExecutor,
+               ahead: int) -> Iterator[Tuple[Tuple[Path, bool], Optional[Future]]]:
+    # ((path, skip), future of fn(path)) in input order, with at most ``ahead`` entries
+    # computed in advance; entries flagged ``skip`` are passed through without calling fn
+    pending: Deque[Tuple[Tuple[Path, bool], Optional[Future]]] = deque()
+    for entry in entries:
+        pending.append((entry, None if entry[1] else pool.submit(fn, entry[0])))
+        if len(pending) > ahead:
+            yield pending.popleft()
+    while pending:
+        yield pending.popleft()
+
+def _original_of(deduper: Deduplicator, img_path: Path, fingerprint: Optional[Future]) -> Optional[Path]:
+    try:
+        return deduper.original_of(img_path, fingerprint.result() if fingerprint is not None else None)
+    except OSError:
+        return None  # unreadable: let the pipeline report it
+
+def default_worker_count() -> int:
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count() or 1
+    # ProcessPoolExecutor refuses more than 61 workers on Windows
+    return max(1, min(cpus, 61))
+
+def _batch_workers(image_paths: Iterable[Path], workers: Optional[int]) -> int:
+    workers = workers or default_worker_count()
+    return min(workers, len(image_paths)) if hasattr(image_paths, '__len__') and len(image_paths) else workers
+
+@dataclass
+class BatchOptions:
+    """
+    Settings of one batch, shared by iter_batch_avatars and process_batch_avatars (see
+    the latter for what each one does). Pass one as ``options``, or override single
+    fields as keyword arguments of either function.
+    """
+    ftp_targets: Sequence[FTPConfig] = ()
+    debug_sidecars: bool = False
+    workers: Optional[int] = None
+    ftp_sessions: int = 1
+    cache: Optional[PackageCache] = None
+    incremental: bool = False
+    cancel: Optional[Event] = None
+    metrics: bool = False
+    ftp_concurrency: Optional[int] = None
+    ftp_compare: UploadCompare = UploadCompare.NONE
+    zip_codecs: ZipCodecRules = DEFAULT_ZIP_CODECS
+    dds_format: DDSFormat = DDSFormat.DXT5
+    memory_budget: Optional[MemoryBudget] = None
+    ftp_open_sessions: Sequence[FTPSession] = ()
+    dedup: bool = False
+    dedup_threshold: Optional[int] = None
+    dedup_link: bool = True
+    upload_buffer: Optional[int] = None
+    ftp_uploader: Optional[FanOutUploader] = None
+
+def _batch_options(options: Optional[BatchOptions], overrides: Dict[str, object]) -> BatchOptions:
+    return replace(options or BatchOptions(), **overrides)
+
+class _BatchUploads:
+    """
+    Upload side of one batch: sends finished packages through the FanOutUploader and
+    returns them from next_finished() once every transfer has settled. In FTP-only dedup
+    mode a duplicate is held back until its original's upload has settled, then the
+    original's package goes out under the duplicate's name wherever the original got
+    through. The original's package stays in memory until every duplicate claimed for it
+    has been sent; one found after that is rebuilt in the pool like any other job.
+    Only the batch's consumer thread calls it; upload threads just queue results.
+    """
+    def __init__(self, uploader: FanOutUploader, targets: List[FTPConfig], options: BatchOptions,
+                 manifest: Optional[BatchManifest]):
+        self.uploader = uploader
+        self.targets = targets
+        self.options = options
+        self.manifest = manifest
+        self.in_flight = 0
+        self._finished: 'SimpleQueue[BatchItemResult]' = SimpleQueue()
+        # FTP-only dedup: originals still uploading, duplicates waiting for them, how the
+        # uploads of settled originals went (target -> error), duplicates claimed but not yet
+        # sent per original, and the packages kept for them
+        self._uploading: Set[Path] = set()
+        self._waiting: Dict[Path, List[BatchItemResult]] = {}
+        self._original_errors: Dict[Path, Dict[str, str]] = {}
+        self._claims: Dict[Path, int] = {}
+        self._payloads: Dict[Path, bytes] = {}
+
+    def _upload(self, item: BatchItemResult, target: FTPConfig, pool: FTPSessionPool) -> TransferResult:
+        with collect_spans(self.options.metrics) as spans:
             try:
-                upload_via_ftp(ftp_cfg, out_file)
-                ftp_transferred += 1
-            except Exception:
-                pass
-    return BatchResult(total=len(image_paths), ftp_transferred=ftp_transferred, output_files=output_files) 
\ No newline at end of file
+                transfer = upload_via_ftp(target, item.output_path, pool, self.options.ftp_compare, item.payload)
+            finally:
+                item.spans.extend(spans)
+        if self.manifest is not None:
+            self.manifest.mark_uploaded(item.image_path, target)
+        return transfer
+
+    def _submit(self, item: BatchItemResult, targets: Sequence[FTPConfig]):
+        _settle_uploads(item, self.uploader.submit(lambda t, pool: self._upload(item, t, pool), targets),
+                        self._finished.put)
+
+    def send(self, item: BatchItemResult, targets: Sequence[FTPConfig], original: bool = False):
+        """Upload ``item`` to ``targets``; ``original``: duplicates of it may follow (FTP-only dedup)."""
+        self.in_flight += 1
+        if original:
+            self._uploading.add(item.image_path)
+        self._submit(item, targets)
+
+    def claim(self, original: Path) -> bool:
+        """
+        Called as a duplicate of ``original`` is found, ahead of the build: True if it can
+        be sent with the original's in-memory package (which is then kept for it), False
+        if that is already gone and the duplicate has to be built from ``original`` again.
+        """
+        failed = self._original_errors.get(original)
+        if failed is not None and original not in self._payloads:
+            return len(failed) >= len(self.targets)  # nothing to rebuild for if it failed everywhere
+        self._claims[original] = self._claims.get(original, 0) + 1
+        return True
+
+    def _release(self, original: Path):
+        self._claims[original] -= 1
+        if not self._claims[original]:
+            del self._claims[original]
+            self._payloads.pop(original, None)
+
+    def send_duplicate(self, dup: BatchItemResult):
+        """Upload the package of ``dup.duplicate_of`` under ``dup``'s name once the original's upload is known."""
+        self.in_flight += 1
+        original = dup.duplicate_of
+        if dup.payload is not None:
+            # Rebuilt in the pool after the original's package had left memory
+            self._send_duplicate(dup, dup.payload, self._original_errors.get(original, {}))
+        elif original in self._uploading:
+            self._waiting.setdefault(original, []).append(dup)
+        else:
+            payload = self._payloads.get(original)
+            if original in self._claims:
+                self._release(original)
+            self._send_duplicate(dup, payload, self._original_errors.get(original, {}))
+
+    def _send_duplicate(self, dup: BatchItemResult, payload: Optional[bytes], failed: Dict[str, str]):
+        # Upload the original's package under the duplicate's name wherever the original got through
+        for key in failed:
+            dup.ftp_errors[key] = f"upload of {dup.duplicate_of.name} failed"
+        ok = [t for t in self.targets if ftp_target_key(t) not in failed]
+        if payload is None or not ok:
+            dup.ftp_uploaded = False
+            self._finished.put(dup)
+            return
+        dup.payload, dup.bytes = payload, len(payload)
+        self._submit(dup, ok)
+
+    def has_finished(self) -> bool:
+        return not self._finished.empty()
+
+    def next_finished(self) -> BatchItemResult:
+        """The next item whose uploads have all settled (waits for one)."""
+        item = self._finished.get()
+        self.in_flight -= 1
+        original = item.image_path
+        if original in self._uploading:
+            self._uploading.discard(original)
+            self._original_errors[original] = dict(item.ftp_errors)
+            for dup in self._waiting.pop(original, ()):
+                self._send_duplicate(dup, item.payload, item.ftp_errors)
+                self._release(original)
+            if original in self._claims and len(item.ftp_errors) < len(self.targets):
+                self._payloads[original] = item.payload  # claimed by duplicates the batch has not reached yet
+        item.payload = None  # sent everywhere, free the in-memory package
+        return item
+
+def iter_batch_avatars(image_paths: Iterable[Path], user_type: UserType, output_dir: Optional[Path],
+                       ftp_cfg: FTPConfig = None, options: Optional[BatchOptions] = None,
+                       **overrides) -> Generator[BatchItemResult, None, Dict[str, HostUploadResult]]:
+    """
+    Streaming form of process_batch_avatars (same arguments, see there): yields one
+    BatchItemResult per input as soon as it is complete, i.e. packaged and, with FTP
+    targets, uploaded everywhere it needed to go. Items without uploads come out in
+    input order; uploaded ones as their last transfer finishes. ``image_paths`` is consumed
+    lazily and nothing is kept per finished item, so arbitrarily long inputs stream in
+    bounded memory. Setting ``cancel`` (or closing the generator) stops it before the next
+    item; uploads already started are finished and yielded first. The generator's return
+    value is the per-target HostUploadResult dict (empty without FTP).
+    """
+    opts = _batch_options(options, overrides)
+    if opts.ftp_uploader is not None:
+        targets = list(opts.ftp_uploader.targets.values())
+    else:
+        targets = list(opts.ftp_targets or ([ftp_cfg] if ftp_cfg else []))
+    in_memory = output_dir is None
+    if in_memory and (not targets or opts.incremental or opts.debug_sidecars):
+        raise ValueError("a batch without output_dir needs FTP targets and cannot be incremental or write debug sidecars")
+    workers = _batch_workers(image_paths, opts.workers)
+    # In memory mode finished packages wait for their upload in RAM: at most this many at once
+    upload_buffer = opts.upload_buffer or max(2, 2 * opts.ftp_sessions * len(targets))
+    manifest = BatchManifest(output_dir) if opts.incremental else None
+    budget = opts.memory_budget or shared_memory_budget()
+    deduper = Deduplicator(opts.dedup_threshold) if opts.dedup or opts.dedup_threshold is not None else None
+    built_outputs: Dict[Path, Optional[Path]] = {}  # with dedup: input -> its package (None if it failed)
+    # With dedup, inputs are hashed on threads a window ahead of the (ordered) duplicate check
+    hasher = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pys4-dedup") if deduper else None
+
+    def out_file_of(img_path: Path) -> Path:
+        return Path(img_path.stem + '.xavatar') if in_memory else output_dir / (img_path.stem + '.xavatar')
+
+    def checked() -> Iterator[Tuple[Path, bool]]:
+        # (path, whether the manifest says its output is current), so current inputs are not fingerprinted
+        for img_path in image_paths:
+            yield img_path, manifest is not None and manifest.is_current(img_path, out_file_of(img_path), user_type,
+                                                                         opts.zip_codecs, opts.dds_format)
+
+    def tasks() -> Iterator[Union[BatchJob, BatchItemResult]]:
+        entries = _map_ahead(lambda p: deduper.fingerprint(p, budget), checked(), hasher, workers * 2) \
+            if hasher is not None else ((entry, None) for entry in checked())
+        for (img_path, current), fingerprint in entries:
+            out_file = out_file_of(img_path)
+            if current:
+                yield BatchItemResult(image_path=img_path, output_path=out_file, success=True, skipped=True)
+            elif deduper is not None and (original := _original_of(deduper, img_path, fingerprint)) is not None:
+                if uploads is not None and in_memory and not uploads.claim(original):
+                    logger.info(f"Package of {original.name} already left memory, rebuilding it for {img_path.name}")
+                    yield (img_path, user_type, out_file, None, opts.cache, opts.metrics, opts.zip_codecs, in_memory,
+                           opts.dds_format, original)
+                else:
+                    # Placeholder, passed through in order and resolved once the original is built
+                    yield BatchItemResult(image_path=img_path, output_path=out_file, success=False,
+                                          duplicate_of=original)
+            else:
+                yield (img_path, user_type, out_file,
+                       output_dir / (img_path.stem + '_debug') if opts.debug_sidecars else None, opts.cache,
+                       opts.metrics, opts.zip_codecs, in_memory, opts.dds_format, None)
+
+    if opts.ftp_uploader is not None:
+        uploader = opts.ftp_uploader
+        uploader.adopt(opts.ftp_open_sessions)
+    else:
+        uploader = FanOutUploader(targets, per_host=opts.ftp_sessions, max_concurrency=opts.ftp_concurrency,
+                                  adopt=opts.ftp_open_sessions) if targets else None
+        if uploader is None:
+            for sess in opts.ftp_open_sessions:
+                sess.close()
+    uploads = _BatchUploads(uploader, targets, opts, manifest) if uploader else None
+    done = 0
+    built = _run_batch_items(tasks(), workers, window=workers * 2, budget=budget)
+    try:
+        for item in built:
+            if item.cache_changes is not None:
+                opts.cache.merge(*item.cache_changes)
+                item.cache_changes = None
+            if _is_placeholder(item):
+                _link_duplicate(item, built_outputs.get(item.duplicate_of), opts.dedup_link, on_disk=not in_memory)
+            elif deduper is not None and item.duplicate_of is None:
+                built_outputs[item.image_path] = item.output_path if item.success else None
+            pending_targets = []
+            if not item.success:
+                logger.error(f"Failed to package {item.image_path}: {item.error}")
+            else:
+                if not in_memory:
+                    try:
+                        item.bytes = item.output_path.stat().st_size
+                    except OSError:
+                        pass
+                if manifest is not None and not item.skipped:
+                    manifest.record(item.image_path, item.output_path, user_type, opts.zip_codecs, opts.dds_format)
+                pending_targets = [t for t in targets if manifest is None or manifest.needs_upload(item.image_path, t)]
+            if uploads is not None and in_memory and item.duplicate_of is not None and item.success:
+                # Nothing exists under this name yet: it goes out once the original's upload is known
+                uploads.send_duplicate(item)
+            elif uploads is not None and pending_targets:
+                uploads.send(item, pending_targets, original=in_memory and deduper is not None)
+            else:
+                item.payload = None
+                done += 1
+                yield item
+            # Without a local copy, stop encoding while the upload buffer is full
+            while uploads is not None and (uploads.has_finished() or (in_memory and uploads.in_flight >= upload_buffer)):
+                done += 1
+                yield uploads.next_finished()
+            if opts.cancel is not None and opts.cancel.is_set():
+                logger.info(f"Batch cancelled after {done + (uploads.in_flight if uploads else 0)} item(s)")
+                break
+        while uploads is not None and uploads.in_flight:
+            yield uploads.next_finished()
+    finally:
+        built.close()
+        if hasher is not None:
+            hasher.shutdown(wait=True, cancel_futures=True)
+        if uploader and opts.ftp_uploader is None:
+            uploader.close()
+        if manifest is not None:
+            manifest.save(force=True)
+    if opts.ftp_uploader is not None:
+        return opts.ftp_uploader.reset()
+    return uploader.results if uploader else {}
+
+def process_batch_avatars(image_paths: Iterable[Path], user_type: UserType, output_dir: Optional[Path],
+                          ftp_cfg: FTPConfig = None, options: Optional[BatchOptions] = None,
+                          progress: Optional[Callable[[BatchItemResult, int, int], None]] = None,
+                          **overrides) -> BatchResult:
+    """
+    Package every image in ``image_paths`` into ``output_dir``. The settings below are
+    BatchOptions fields, given as ``options`` and/or keyword arguments. Packaging runs on
+    a process pool of ``workers`` processes (default: one per CPU, ``1`` runs inline). ``image_paths`` may be
+    a lazy iterable (e.g. scanner.iter_images); work starts with the first path.
+    A failing image is recorded on its BatchItemResult and does not stop the rest of the batch.
+    With ``ftp_cfg`` each package is uploaded as soon as it is built, over a pool of
+    ``ftp_sessions`` persistent connections that log in once for the whole batch.
+    With ``output_dir=None`` nothing is written locally: packages are built in memory and
+    streamed to the FTP targets, at most ``upload_buffer`` of them waiting at a time
+    (encoding pauses while it is full), and ``output_path`` is only the package name.
+    ``ftp_targets`` fans every package out to several hosts instead (each encoded once):
+    ``ftp_sessions`` then limits connections per host and ``ftp_concurrency`` the
+    transfers across all hosts; ``BatchResult.ftp_hosts`` breaks the outcome down per host.
+    ``ftp_compare`` skips packages already identical on a host; bytes not sent thanks to
+    skips and resumed transfers are reported as ``BatchResult.ftp_bytes_saved``.
+    ``ftp_open_sessions`` are logged-in FTPSessions (e.g. from browsing the console) the
+    upload pools take over instead of logging in again; the batch closes them when done.
+    ``ftp_uploader`` replaces the batch's own FanOutUploader with one the caller keeps
+    open across batches (its targets replace ``ftp_cfg``/``ftp_targets``); it is reset,
+    not closed, at the end.
+    With a ``cache``, images already built with the same settings are restored from it.
+    With ``incremental``, a manifest in ``output_dir`` is used to skip inputs whose
+    output is still current and to finish uploads an interrupted run never completed.
+    With ``dedup``, inputs byte-identical to an earlier one (or, with ``dedup_threshold``,
+    within that many dHash bits of one) are not built again: the first copy's package is
+    hardlinked (copied with ``dedup_link=False``) to their output name and uploaded under
+    that name like any other package; they are reported via ``BatchItemResult.duplicate_of``.
+    Without an ``output_dir`` (FTP only) there is nothing to link, so each duplicate is
+    uploaded under its own name with the original's package once the original's upload
+    has settled, and fails on the hosts where the original's upload failed. With
+    ``incremental``, inputs the manifest skips are not read for dedup at all.
+    ``progress(item, done, total)`` is called as each item completes (``total`` is 0 when
+    the input has no length); setting ``cancel`` stops the batch cleanly before the next
+    item (queued work is dropped).
+    ``zip_codecs`` chooses the compression of each package member, ``dds_format`` the DDS encoding.
+    Large sources are decoded at reduced scale, and ``memory_budget`` (default: the
+    process-wide shared_memory_budget()) limits how many of them are decoded at once.
+    With ``metrics``, every item carries timing spans for its read/decode/resize/dds_encode/
+    zip/write/ftp stages and ``BatchResult.stages`` holds per-stage histograms of them.
+    This collects iter_batch_avatars into one BatchResult; use that generator directly
+    to act on each item as it completes without keeping them all.
+    """
+    start = time.perf_counter()
+    opts = _batch_options(options, overrides)
+    opts.workers = _batch_workers(image_paths, opts.workers)
+    total = len(image_paths) if hasattr(image_paths, '__len__') else 0
+    stream = iter_batch_avatars(image_paths, user_type, output_dir, ftp_cfg, opts)
+    items = []
+    try:
+        while True:
+            item = next(stream)
+            items.append(item)
+            if progress is not None:
+                progress(item, len(items), total)
+    except StopIteration as stop:
+        ftp_hosts = stop.value
+    finally:
+        stream.close()
+    result = BatchResult(
+        total=len(items),
+        ftp_transferred=sum(host.uploaded for host in ftp_hosts.values()),
+        output_files=[item.output_path for item in items if item.success],
+        items=items,
+        elapsed=time.perf_counter() - start,
+        cancelled=opts.cancel is not None and opts.cancel.is_set(),
+        stages=aggregate_spans(s for item in items for s in item.spans),
+        ftp_hosts=ftp_hosts,
+    )
+    logger.info(f"Batch finished: {result.succeeded}/{result.total} packaged ({result.cache_hits} from cache, "
+                f"{result.skipped} unchanged, {result.duplicates} duplicate(s)), "
+                f"{result.failed} failed, {result.ftp_transferred} uploaded in {result.elapsed:.2f}s using {opts.workers} worker(s)")
+    if result.ftp_skipped or result.ftp_bytes_saved:
+        logger.info(f"FTP: {result.ftp_skipped} upload(s) already identical, "
+                    f"{result.ftp_bytes_saved} of {result.ftp_bytes_sent + result.ftp_bytes_saved} bytes not re-sent")
+    offline = [host.target for host in result.ftp_hosts.values() if host.offline]
+    if offline:
+        logger.warning(f"FTP target(s) offline during the batch: {', '.join(offline)}")
+    return result
@@ -1,38 +1,49 @@
 import sys
 from pathlib import Path
+from typing import Optional
 from PyQt6.QtWidgets import (
-    QApplication, QWidget, QLabel, QPushButton, QFileDialog, QVBoxLayout, QHBoxLayout, QRadioButton, QGroupBox, QMessageBox, QLineEdit, QDialog, QScrollArea, QGridLayout, QCheckBox
+    QApplication, QWidget, QLabel, QPushButton, QFileDialog, QVBoxLayout, QHBoxLayout, QRadioButton, QGroupBox, QMessageBox, QLineEdit, QDialog, QCheckBox, QProgressBar, QListView, QListWidget, QComboBox
 )
 from PyQt6.QtGui import QPixmap, QDesktopServices, QPainter
-from PyQt6.QtCore import Qt, QUrl, QSettings
-from .models import UserType, FTPConfig
-from .controllers import create_avatar_package
-from .services import process_batch_avatars
-import tempfile
+from PyQt6.QtCore import (Qt, QUrl, QSettings, QThread, QThreadPool, QTimer, QAbstractListModel, QModelIndex, QSize,
+                          pyqtSignal)
+from .models import UserType, DDSFormat, FTPConfig
+from .cache import PackageCache
+from .ftp import FTPBrowser
+from .ui_workers import ExportWorker, BatchWorker, ThumbnailLoader, ThumbnailSignals, start_worker
 import os
-from ftplib import FTP, error_perm
+import time
+from collections import OrderedDict
+from .scanner import iter_images
 
-def is_image_file(path):
-    return path.suffix.lower() in {'.png', '.jpg', '.jpeg'}
+# Set by compile_dist's startup benchmark: the GUI exits once its window is up
+STARTUP_PROBE_ENV = "PYS4_STARTUP_PROBE"
 
 class FTPDirDialog(QDialog):
+    """
+    Browses the console's directories through an FTPBrowser: listings load in the
+    background (the dialog stays responsive), are cached, and child folders are
+    prefetched. After Select, ``session`` holds the still logged-in connection so the
+    upload can reuse it.
+    """
+    listed = pyqtSignal(str, object)  # path, Future (emitted from the browser thread)
+
     def __init__(self, ftp_cfg, parent=None):
         super().__init__(parent)
         self.setWindowTitle("Browse FTP Directories")
         self.setMinimumSize(400, 400)
         self.ftp_cfg = ftp_cfg
-        self.current_dir = ftp_cfg.upload_dir or "/"
-        self.ftp = FTP()
+        self.current_dir = FTPBrowser.join("/", ftp_cfg.upload_dir or "/")
+        self.session = None
+        self._connected = False
+        self.browser = FTPBrowser(ftp_cfg)
+        self.listed.connect(self.on_listed)
         layout = QVBoxLayout()
         self.path_label = QLabel(self.current_dir)
         layout.addWidget(self.path_label)
-        self.dir_list = QVBoxLayout()
-        self.dir_widget = QWidget()
-        self.dir_widget.setLayout(self.dir_list)
-        self.scroll = QScrollArea()
-        self.scroll.setWidgetResizable(True)
-        self.scroll.setWidget(self.dir_widget)
-        layout.addWidget(self.scroll)
+        self.dir_list = QListWidget()
+        self.dir_list.itemClicked.connect(lambda item: self.enter_dir(item.text()))
+        layout.addWidget(self.dir_list)
         btn_hbox = QHBoxLayout()
         self.btn_select = QPushButton("Select")
         self.btn_select.clicked.connect(self.accept)
@@ -42,54 +53,54 @@ class FTPDirDialog(QDialog):
         btn_hbox.addWidget(self.btn_up)
         layout.addLayout(btn_hbox)
         self.setLayout(layout)
-        self.connect_and_list()
-    def connect_and_list(self):
-        try:
-            self.ftp.connect(self.ftp_cfg.host, self.ftp_cfg.port)
-            if self.ftp_cfg.username and self.ftp_cfg.password:
-                self.ftp.login(self.ftp_cfg.username, self.ftp_cfg.password)
-            else:
-                self.ftp.login()
-            self.ftp.cwd(self.current_dir)
-            self.refresh_list()
-        except Exception as e:
-            QMessageBox.critical(self, "FTP Error", f"Failed to connect or list directory: {e}")
+        self.show_dir(self.current_dir)
+
+    def show_dir(self, path):
+        names = self.browser.cached(path)
+        if names is not None:
+            self._connected = True
+            self.populate(path, names)
+            self.browser.list_dirs(path)  # keeps prefetching below the new folder
+            return
+        self.path_label.setText(f"{path} (loading...)")
+        self.dir_list.setEnabled(False)
+        self.browser.list_dirs(path).add_done_callback(lambda future, p=path: self.listed.emit(p, future))
+
+    def populate(self, path, names):
+        self.current_dir = path
+        self.path_label.setText(path)
+        self.dir_list.clear()
+        self.dir_list.addItems(names)
+        self.dir_list.setEnabled(True)
+
+    def on_listed(self, path, future):
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is None:
+            self._connected = True
+            self.populate(path, future.result())
+        elif not self._connected:
+            QMessageBox.critical(self, "FTP Error", f"Failed to connect or list directory: {error}")
             self.reject()
-    def refresh_list(self):
-        for i in reversed(range(self.dir_list.count())):
-            self.dir_list.itemAt(i).widget().setParent(None)
-        dirs = []
-        try:
-            dirs = [name for name, facts in self.ftp.mlsd() if facts['type'] == 'dir']
-        except Exception:
-            # fallback for servers without MLSD
-            dirs = []
-            self.ftp.retrlines('LIST', lambda line: dirs.append(line.split()[-1]) if line.startswith('d') else None)
-        for d in dirs:
-            btn = QPushButton(d)
-            btn.clicked.connect(lambda _, name=d: self.enter_dir(name))
-            self.dir_list.addWidget(btn)
-        self.path_label.setText(self.current_dir)
+        else:
+            QMessageBox.warning(self, "FTP", f"Cannot enter directory: {path}")
+            self.populate(self.current_dir, self.browser.cached(self.current_dir) or [])
+
     def enter_dir(self, name):
-        try:
-            self.ftp.cwd(name)
-            self.current_dir = self.ftp.pwd()
-            self.refresh_list()
-        except error_perm:
-            QMessageBox.warning(self, "FTP", f"Cannot enter directory: {name}")
+        self.show_dir(FTPBrowser.join(self.current_dir, name))
+
     def go_up(self):
-        try:
-            self.ftp.cwd("..")
-            self.current_dir = self.ftp.pwd()
-            self.refresh_list()
-        except error_perm:
-            pass
+        if self.current_dir != "/":
+            self.show_dir(FTPBrowser.join(self.current_dir, ".."))
+
     def accept(self):
         self.selected_dir = self.current_dir
-        self.ftp.quit()
+        self.session = self.browser.detach()
         super().accept()
+
     def reject(self):
-        self.ftp.quit()
+        self.browser.close()
         super().reject()
 
 class AvatarMakerUI(QWidget):
@@ -103,6 +114,12 @@ class AvatarMakerUI(QWidget):
         self.user_type = UserType.LOCAL
         self.batch_input_dir = None
         self.batch_output_dir = None
+        self.package_cache = PackageCache()
+        self._export_worker = None
+        self._batch_worker = None
+        self._batch_items = []
+        self._batch_started = 0.0
+        self._ftp_session = None
         self.init_ui()
         self.load_settings()
 
@@ -118,6 +135,12 @@ class AvatarMakerUI(QWidget):
         self.rb_local.toggled.connect(self.on_user_type_changed)
         user_hbox.addWidget(self.rb_offline)
         user_hbox.addWidget(self.rb_local)
+        user_hbox.addStretch()
+        user_hbox.addWidget(QLabel("DDS format:"))
+        self.dds_format_combo = QComboBox()
+        for fmt in DDSFormat:
+            self.dds_format_combo.addItem(fmt.value.upper(), fmt)
+        user_hbox.addWidget(self.dds_format_combo)
         self.group_user.setLayout(user_hbox)
         layout.addWidget(self.group_user)
         # Single image section
@@ -198,6 +221,9 @@ class AvatarMakerUI(QWidget):
         input_hbox.addWidget(self.input_dir_edit)
         input_hbox.addWidget(btn_browse_input)
         batch_layout.addLayout(input_hbox)
+        self.batch_recursive = QCheckBox("Include subfolders")
+        self.batch_recursive.setChecked(False)
+        batch_layout.addWidget(self.batch_recursive)
         output_hbox = QHBoxLayout()
         self.output_dir_edit = QLineEdit()
         self.output_dir_edit.setPlaceholderText("Select output directory...")
@@ -214,6 +240,18 @@ class AvatarMakerUI(QWidget):
         self.btn_run_batch.setMinimumHeight(40)
         self.btn_run_batch.clicked.connect(self.run_batch)
         batch_layout.addWidget(self.btn_run_batch)
+        progress_hbox = QHBoxLayout()
+        self.batch_progress = QProgressBar()
+        self.batch_progress.setVisible(False)
+        self.btn_cancel_batch = QPushButton("Cancel")
+        self.btn_cancel_batch.setVisible(False)
+        self.btn_cancel_batch.clicked.connect(self.cancel_batch)
+        progress_hbox.addWidget(self.batch_progress)
+        progress_hbox.addWidget(self.btn_cancel_batch)
+        batch_layout.addLayout(progress_hbox)
+        self.batch_status = QLabel()
+        self.batch_status.setVisible(False)
+        batch_layout.addWidget(self.batch_status)
         # Add Open Batch Preview button
         btn_open_preview = QPushButton("Open Batch Preview")
         btn_open_preview.clicked.connect(self.open_batch_preview)
@@ -227,6 +265,8 @@ class AvatarMakerUI(QWidget):
         for box in config_boxes:
             box.editingFinished.connect(self.on_config_edited)
         self.batch_use_ftp.toggled.connect(self.on_config_edited)
+        self.batch_recursive.toggled.connect(self.on_config_edited)
+        self.dds_format_combo.currentIndexChanged.connect(self.on_config_edited)
 
     def default_avatar_path(self):
         # Use PyInstaller's _MEIPASS if bundled, else normal path
@@ -252,27 +292,39 @@ class AvatarMakerUI(QWidget):
             return
         file, _ = QFileDialog.getSaveFileName(self, "Save Avatar Package", "My Avatar.xavatar", "Avatar (*.xavatar)")
         if file:
-            tmp_dir = Path(tempfile.mkdtemp())
-            try:
-                create_avatar_package(self.image_path, self.user_type, Path(file), tmp_dir)
-                QMessageBox.information(self, "Success", "Avatar ready! Copy it to a USB device and use it with PS4-Xplorer.")
-            except Exception as e:
-                QMessageBox.critical(self, "Error", f"Failed to export avatar: {e}")
-            finally:
-                if tmp_dir.exists():
-                    for f in tmp_dir.iterdir():
-                        f.unlink(missing_ok=True)
-                    tmp_dir.rmdir()
+            self.btn_export.setEnabled(False)
+            self.btn_export.setText("Exporting...")
+            self._export_worker = ExportWorker(self.image_path, self.user_type, Path(file), self.package_cache,
+                                               self.dds_format_combo.currentData())
+            self._export_worker.finished.connect(self.on_export_finished)
+            self._export_worker.failed.connect(self.on_export_failed)
+            start_worker(self._export_worker, self)
+
+    def _reset_export_button(self):
+        self._export_worker = None
+        self.btn_export.setEnabled(True)
+        self.btn_export.setText("Export Avatar")
+
+    def on_export_finished(self, output_path):
+        self._reset_export_button()
+        QMessageBox.information(self, "Success", "Avatar ready! Copy it to a USB device and use it with PS4-Xplorer.")
+
+    def on_export_failed(self, error):
+        self._reset_export_button()
+        QMessageBox.critical(self, "Error", f"Failed to export avatar: {error}")
 
     def select_batch_input_dir(self):
         dir_ = QFileDialog.getExistingDirectory(self, "Select Input Folder")
         if dir_:
             self.batch_input_dir = Path(dir_)
             self.input_dir_edit.setText(str(dir_))
-            images = [p for p in self.batch_input_dir.iterdir() if p.is_file() and is_image_file(p)]
+            images = self.scan_input_dir(self.batch_input_dir)
             if images:
                 self.show_batch_preview(images)
 
+    def scan_input_dir(self, input_dir):
+        return list(iter_images(input_dir, recursive=self.batch_recursive.isChecked(), sort=True))
+
     def select_batch_output_dir(self):
         dir_ = QFileDialog.getExistingDirectory(self, "Select Output Directory")
         if dir_:
@@ -289,10 +341,6 @@ class AvatarMakerUI(QWidget):
         if not input_dir.exists() or not input_dir.is_dir():
             QMessageBox.warning(self, "Missing Folders", "Please select a valid input folder with images.")
             return
-        images = [p for p in input_dir.iterdir() if p.is_file() and is_image_file(p)]
-        if not images:
-            QMessageBox.warning(self, "No Images", "No PNG or JPG images found in the input folder.")
-            return
         # Batch FTP logic: ignore 'Enable FTP Upload' toggle, use FTP config if 'Use FTP as Output' is checked
         ftp_cfg = None
         if self.batch_use_ftp.isChecked():
@@ -310,11 +358,80 @@ class AvatarMakerUI(QWidget):
                 password=self.ftp_pass.text() or None,
                 upload_dir=self.ftp_dir.text() or "/"
             )
-        output_dir = self.batch_output_dir if not self.batch_use_ftp.isChecked() else input_dir  # dummy, not used if FTP only
-        result = process_batch_avatars(images, self.user_type, output_dir, ftp_cfg)
-        msg = f"Batch complete!\nTotal avatars: {result.total}\nTransferred via FTP: {result.ftp_transferred}"
+        # FTP output builds every package in memory and streams it to the console: nothing lands on local disk
+        output_text = self.output_dir_edit.text()
+        output_dir = None if ftp_cfg is not None else Path(output_text) if output_text else None
+        if output_dir is None and ftp_cfg is None:
+            QMessageBox.warning(self, "Missing Folders", "Please select an output folder or use FTP as output.")
+            return
+        self._batch_items = []
+        self._batch_started = time.monotonic()
+        open_sessions = []
+        if ftp_cfg is not None and self._ftp_session is not None:
+            open_sessions, self._ftp_session = [self._ftp_session], None
+        # The folder is scanned lazily on the worker thread as the batch consumes it, so a
+        # large or network folder never blocks the window
+        images = iter_images(input_dir, recursive=self.batch_recursive.isChecked(), sort=True)
+        self._batch_worker = BatchWorker(images, self.user_type, output_dir, ftp_cfg, self.package_cache,
+                                         incremental=output_dir is not None, open_sessions=open_sessions,
+                                         dds_format=self.dds_format_combo.currentData())
+        self._batch_worker.progress.connect(self.on_batch_progress)
+        self._batch_worker.finished.connect(self.on_batch_finished)
+        self._batch_worker.failed.connect(self.on_batch_failed)
+        self.set_batch_running(True)
+        start_worker(self._batch_worker, self)
+
+    def set_batch_running(self, running, total=0):
+        self.btn_run_batch.setEnabled(not running)
+        self.btn_cancel_batch.setEnabled(running)
+        self.btn_cancel_batch.setVisible(running)
+        self.batch_progress.setVisible(running)
+        self.batch_status.setVisible(running)
+        if running:
+            # total 0: not known up front (the input is still being scanned), the bar shows activity
+            self.batch_progress.setRange(0, total)
+            self.batch_progress.setValue(0)
+            self.batch_status.setText(f"Starting batch of {total} image(s)..." if total else "Starting batch...")
+
+    def cancel_batch(self):
+        if self._batch_worker is not None:
+            self._batch_worker.cancel()
+            self.btn_cancel_batch.setEnabled(False)
+            self.batch_status.setText("Cancelling after the current item...")
+
+    def on_batch_progress(self, item, done, total):
+        self._batch_items.append(item)
+        self.batch_progress.setValue(done)
+        elapsed = max(time.monotonic() - self._batch_started, 1e-6)
+        rate = done / elapsed
+        if not total:
+            self.batch_status.setText(f"{done} done  {item.image_path.name}  |  {rate:.1f} avatars/s")
+            return
+        eta = (total - done) / rate if rate > 0 else 0
+        self.batch_status.setText(f"{done}/{total}  {item.image_path.name}  |  {rate:.1f} avatars/s  |  "
+                                  f"ETA {int(eta // 60)}m {int(eta % 60):02d}s")
+
+    def on_batch_finished(self, result):
+        self._batch_worker = None
+        self.set_batch_running(False)
+        items = self._batch_items
+        if not items and not result.cancelled:
+            QMessageBox.warning(self, "No Images", "No PNG or JPG images found in the input folder.")
+            return
+        failures = [item for item in items if not item.success]
+        title = "Batch cancelled" if result.cancelled else "Batch complete"
+        msg = (f"{title} in {result.elapsed:.1f}s!\nProcessed: {len(items)}\n"
+               f"Unchanged (skipped): {sum(1 for item in items if item.skipped)}\nFailed: {len(failures)}\n"
+               f"Transferred via FTP: {result.ftp_transferred}")
+        if failures:
+            msg += "\n\n" + "\n".join(f"{item.image_path.name}: {item.error}" for item in failures[:10])
         QMessageBox.information(self, "Batch Result", msg)
 
+    def on_batch_failed(self, error):
+        self._batch_worker = None
+        self.set_batch_running(False)
+        QMessageBox.critical(self, "Batch Error", f"Batch failed: {error}")
+
     def browse_ftp_dir(self):
         if not self.ftp_host.text():
             QMessageBox.warning(self, "FTP Host Required", "Please enter the FTP host before browsing directories.")
@@ -333,6 +450,14 @@ class AvatarMakerUI(QWidget):
         dlg = FTPDirDialog(ftp_cfg, self)
         if dlg.exec() == QDialog.DialogCode.Accepted:
             self.ftp_dir.setText(dlg.selected_dir)
+            # Keep the browsing login for the next FTP batch
+            self._drop_ftp_session()
+            self._ftp_session = dlg.session
+
+    def _drop_ftp_session(self):
+        if self._ftp_session is not None:
+            self._ftp_session.close()
+            self._ftp_session = None
 
     def on_batch_use_ftp_toggled(self):
         # Disable output dir selection if using FTP as output
@@ -355,9 +480,14 @@ class AvatarMakerUI(QWidget):
         self.settings.setValue("batch/input_dir", self.input_dir_edit.text())
         self.settings.setValue("batch/output_dir", self.output_dir_edit.text())
         self.settings.setValue("batch/use_ftp", self.batch_use_ftp.isChecked())
+        self.settings.setValue("batch/recursive", self.batch_recursive.isChecked())
         self.settings.setValue("user_type", "offline" if self.rb_offline.isChecked() else "local")
+        self.settings.setValue("dds_format", self.dds_format_combo.currentData().value)
 
     def load_settings(self):
+        # Before the fields below: editing them saves every setting, this one included
+        index = self.dds_format_combo.findText(str(self.settings.value("dds_format", DDSFormat.DXT5.value)).upper())
+        self.dds_format_combo.setCurrentIndex(max(index, 0))
         self.ftp_host.setText(self.settings.value("ftp/host", ""))
         self.ftp_port.setText(self.settings.value("ftp/port", ""))
         self.ftp_user.setText(self.settings.value("ftp/user", ""))
@@ -367,6 +497,7 @@ class AvatarMakerUI(QWidget):
         self.input_dir_edit.setText(self.settings.value("batch/input_dir", ""))
         self.output_dir_edit.setText(self.settings.value("batch/output_dir", ""))
         self.batch_use_ftp.setChecked(self.settings.value("batch/use_ftp", False, type=bool))
+        self.batch_recursive.setChecked(self.settings.value("batch/recursive", False, type=bool))
         user_type = self.settings.value("user_type", "local")
         if user_type == "offline":
             self.rb_offline.setChecked(True)
@@ -378,7 +509,7 @@ class AvatarMakerUI(QWidget):
         if not input_dir.exists() or not input_dir.is_dir():
             QMessageBox.warning(self, "No Input Folder", "Please select a valid input folder first.")
             return
-        images = [p for p in input_dir.iterdir() if p.is_file() and is_image_file(p)]
+        images = self.scan_input_dir(input_dir)
         if not images:
             QMessageBox.warning(self, "No Images", "No PNG or JPG images found in the input folder.")
             return
@@ -390,6 +521,16 @@ class AvatarMakerUI(QWidget):
         self._batch_preview.setModal(False)
         self._batch_preview.show()
 
+    def closeEvent(self, event):
+        # Let background workers stop between items instead of killing their threads mid-write
+        if self._batch_worker is not None:
+            self._batch_worker.cancel()
+        for thread in self.findChildren(QThread):
+            thread.quit()
+            thread.wait()
+        self._drop_ftp_session()
+        super().closeEvent(event)
+
     @staticmethod
     def dark_stylesheet():
         return """
@@ -401,32 +542,105 @@ class AvatarMakerUI(QWidget):
         QPushButton:hover { background: #333; }
         QRadioButton { color: #f0f0f0; }
         QLineEdit { background: #222; color: #fff; border: 1px solid #444; border-radius: 4px; padding: 4px; }
+        QProgressBar { background: #222; color: #fff; border: 1px solid #444; border-radius: 4px; text-align: center; }
+        QProgressBar::chunk { background: #3a6ea5; border-radius: 3px; }
         """
 
+class ThumbnailModel(QAbstractListModel):
+    """
+    List model over image paths whose thumbnails are decoded lazily: only rows the view
+    actually paints are requested, decoding runs on a QThreadPool, and finished pixmaps
+    live in a bounded LRU cache so memory stays flat for huge folders.
+    """
+    def __init__(self, image_paths, thumb_size=100, cache_size=512, parent=None):
+        super().__init__(parent)
+        self._paths = list(image_paths)
+        self._rows = {str(p): row for row, p in enumerate(self._paths)}
+        self._thumb_size = thumb_size
+        self._cache_size = cache_size
+        self._cache = OrderedDict()
+        self._pending = set()
+        self._request_seq = 0
+        self._pool = QThreadPool(self)
+        self._signals = ThumbnailSignals()
+        self._signals.loaded.connect(self._on_loaded)
+        self._placeholder = QPixmap(thumb_size, thumb_size)
+        self._placeholder.fill(Qt.GlobalColor.darkGray)
+
+    def rowCount(self, parent: Optional[QModelIndex] = None):
+        return 0 if parent is not None and parent.isValid() else len(self._paths)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        path = self._paths[index.row()]
+        if role == Qt.ItemDataRole.DisplayRole:
+            return path.name
+        if role == Qt.ItemDataRole.ToolTipRole:
+            return str(path)
+        if role == Qt.ItemDataRole.DecorationRole:
+            key = str(path)
+            pixmap = self._cache.get(key)
+            if pixmap is not None:
+                self._cache.move_to_end(key)
+                return pixmap
+            self._request(path)
+            return self._placeholder
+        return None
+
+    def _request(self, path):
+        key = str(path)
+        if key in self._pending:
+            return
+        self._pending.add(key)
+        # Newest requests first, so the rows currently on screen win over ones scrolled past
+        self._request_seq += 1
+        self._pool.start(ThumbnailLoader(path, self._thumb_size, self._signals), self._request_seq)
+
+    def _on_loaded(self, key, qimage):
+        self._pending.discard(key)
+        self._cache[key] = QPixmap.fromImage(qimage) if not qimage.isNull() else self._placeholder
+        while len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+        row = self._rows.get(key)
+        if row is not None:
+            index = self.index(row)
+            self.dataChanged.emit(index, index, [Qt.ItemDataRole.DecorationRole])
+
+    def shutdown(self):
+        self._pool.clear()
+        self._pool.waitForDone()
+
 class ImagePreviewDialog(QDialog):
     def __init__(self, image_paths, parent=None):
         super().__init__(parent)
         self.setWindowTitle("Batch Image Preview")
         self.setMinimumSize(600, 400)
         layout = QVBoxLayout()
-        scroll = QScrollArea()
-        scroll.setWidgetResizable(True)
-        content = QWidget()
-        grid = QGridLayout()
-        for idx, img_path in enumerate(image_paths):
-            label = QLabel()
-            pixmap = QPixmap(str(img_path)).scaled(100, 100, Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation)
-            label.setPixmap(pixmap)
-            label.setFixedSize(110, 110)
-            label.setAlignment(Qt.AlignmentFlag.AlignCenter)
-            grid.addWidget(label, idx // 5, idx % 5)
-        content.setLayout(grid)
-        scroll.setWidget(content)
-        layout.addWidget(scroll)
+        self.model = ThumbnailModel(image_paths, thumb_size=100, parent=self)
+        view = QListView()
+        view.setViewMode(QListView.ViewMode.IconMode)
+        view.setResizeMode(QListView.ResizeMode.Adjust)
+        view.setMovement(QListView.Movement.Static)
+        view.setUniformItemSizes(True)
+        view.setLayoutMode(QListView.LayoutMode.Batched)
+        view.setBatchSize(200)
+        view.setIconSize(QSize(100, 100))
+        view.setGridSize(QSize(116, 130))
+        view.setModel(self.model)
+        layout.addWidget(QLabel(f"{len(image_paths)} image(s)"))
+        layout.addWidget(view)
         self.setLayout(layout)
 
+    def done(self, result):
+        self.model.shutdown()
+        super().done(result)
+
 def main():
     app = QApplication(sys.argv)
     win = AvatarMakerUI()
     win.show()
+    if os.environ.get(STARTUP_PROBE_ENV):
+        # Startup benchmark (compile_dist): quit as soon as the shown window gets its first event loop turn
+        QTimer.singleShot(0, app.quit)
     sys.exit(app.exec()) 
\ No newline at end of file
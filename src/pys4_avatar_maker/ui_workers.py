@@ -0,0 +1,107 @@
+import threading
+from pathlib import Path
+from typing import Iterable, Optional, Sequence
+from PyQt6.QtCore import QObject, QThread, QRunnable, pyqtSignal
+from PyQt6.QtGui import QImage
+from .models import UserType, DDSFormat, FTPConfig
+from .controllers import create_avatar_package
+from .services import process_batch_avatars
+from .cache import PackageCache
+from .ftp import FTPSession
+from .utils import load_thumbnail
+
+class ExportWorker(QObject):
+    """Builds a single avatar package off the UI thread."""
+    finished = pyqtSignal(object)  # output Path
+    failed = pyqtSignal(str)
+
+    def __init__(self, image_path: Path, user_type: UserType, output_path: Path, cache: Optional[PackageCache] = None,
+                 dds_format: DDSFormat = DDSFormat.DXT5):
+        super().__init__()
+        self.image_path = image_path
+        self.user_type = user_type
+        self.output_path = output_path
+        self.cache = cache
+        self.dds_format = dds_format
+
+    def run(self):
+        try:
+            create_avatar_package(self.image_path, self.user_type, self.output_path, cache=self.cache,
+                                  dds_format=self.dds_format)
+        except Exception as e:
+            self.failed.emit(str(e))
+            return
+        self.finished.emit(self.output_path)
+
+class BatchWorker(QObject):
+    """
+    Runs process_batch_avatars off the UI thread, streaming every finished item
+    through ``progress`` so the window can show throughput/ETA and stay responsive.
+    ``images`` may be a lazy iterator (e.g. iter_images): it is consumed on the worker
+    thread, and ``progress`` then reports a total of 0.
+    """
+    progress = pyqtSignal(object, int, int)  # BatchItemResult, done, total
+    finished = pyqtSignal(object)  # BatchResult
+    failed = pyqtSignal(str)
+
+    def __init__(self, images: Iterable[Path], user_type: UserType, output_dir: Optional[Path],
+                 ftp_cfg: Optional[FTPConfig] = None,
+                 cache: Optional[PackageCache] = None, incremental: bool = True,
+                 open_sessions: Sequence[FTPSession] = (), dds_format: DDSFormat = DDSFormat.DXT5):
+        super().__init__()
+        self.images = images
+        self.user_type = user_type
+        self.output_dir = output_dir  # None: FTP only, packages never touch local disk
+        self.ftp_cfg = ftp_cfg
+        self.cache = cache
+        self.incremental = incremental
+        self.open_sessions = open_sessions  # logged-in FTP sessions the upload pool takes over
+        self.dds_format = dds_format
+        self._cancel = threading.Event()
+
+    def cancel(self):
+        # Called from the UI thread; the batch stops before starting its next item
+        self._cancel.set()
+
+    def run(self):
+        try:
+            result = process_batch_avatars(self.images, self.user_type, self.output_dir, self.ftp_cfg,
+                                           cache=self.cache, incremental=self.incremental,
+                                           progress=self.progress.emit, cancel=self._cancel,
+                                           ftp_open_sessions=self.open_sessions, dds_format=self.dds_format)
+        except Exception as e:
+            self.failed.emit(str(e))
+            return
+        self.finished.emit(result)
+
+class ThumbnailSignals(QObject):
+    loaded = pyqtSignal(str, QImage)  # path, thumbnail (null QImage if undecodable)
+
+class ThumbnailLoader(QRunnable):
+    """Decodes one reduced-size thumbnail on a QThreadPool thread (QImage is safe off the UI thread)."""
+    def __init__(self, path: Path, size: int, signals: ThumbnailSignals):
+        super().__init__()
+        self.path = path
+        self.size = size
+        self.signals = signals
+
+    def run(self):
+        try:
+            img = load_thumbnail(self.path, self.size)
+            data = img.tobytes('raw', 'RGBA')
+            qimage = QImage(data, img.width, img.height, img.width * 4, QImage.Format.Format_RGBA8888).copy()
+        except Exception:
+            qimage = QImage()
+        self.signals.loaded.emit(str(self.path), qimage)
+
+def start_worker(worker: QObject, parent: QObject) -> QThread:
+    """Move ``worker`` onto a new QThread, run it, and tear both down when it is done."""
+    thread = QThread(parent)
+    worker.moveToThread(thread)
+    thread.started.connect(worker.run)
+    worker.finished.connect(thread.quit)
+    worker.failed.connect(thread.quit)
+    thread.finished.connect(worker.deleteLater)
+    thread.finished.connect(thread.deleteLater)
+    thread.start()
+    return thread
@@ -1,29 +1,195 @@
-import zipfile
+import io
+import hashlib
 from pathlib import Path
-from typing import List
+from typing import List, Dict, Sequence, Optional, Tuple, Union, BinaryIO
 from PIL import Image
-import imageio
+import numpy as np
 import os
+import shutil
 import logging
+from .models import AVATAR_SIZES, DDSFormat, ZipCodecRules, DEFAULT_ZIP_CODECS
+from . import dds, zipwriter
 
 logger = logging.getLogger("pys4_avatar_maker.utils")
 
-def zip_files(file_paths: List[Path], zip_path: Path):
+# Large sources are pre-shrunk to at least this multiple of the biggest surface before
+# the final resample, the same trade-off Image.thumbnail makes
+REDUCING_GAP = 2.0
+# Modes Image.reduce() averages in place; it premultiplies LA/RGBA through a full-size copy first
+REDUCE_MODES = ('L', 'RGB', 'CMYK', 'YCbCr', 'I', 'F')
+BAND_ROWS = 256
+
+def zip_files(file_paths: List[Path], zip_path: Path, codecs: ZipCodecRules = DEFAULT_ZIP_CODECS):
     try:
-        with zipfile.ZipFile(zip_path, 'w') as zipf:
-            for file_path in file_paths:
-                zipf.write(file_path, arcname=file_path.name)
-        logger.info(f"Created zip archive at {zip_path} with files: {[str(f) for f in file_paths]}")
+        zip_entries({file_path.name: file_path.read_bytes() for file_path in file_paths}, zip_path, codecs)
     except Exception as e:
         logger.error(f"Failed to create zip archive {zip_path}: {e}", exc_info=True)
         raise RuntimeError(f"Error zipping files: {e}") from e
 
-def convert_to_dds(image_path: Path, dds_path: Path, size: int):
+def hash_file(path: Path, chunk_size: int = 1024 * 1024) -> str:
+    """Streaming SHA-256 of a file's contents."""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def link_or_copy(src: Path, dest: Path, link: bool = True):
+    """Materialise ``src`` at ``dest`` via a temp name and rename; hardlink if ``link`` (copying where that fails)."""
+    tmp = dest.with_name(f".{dest.name}.{os.getpid()}.tmp")
+    tmp.unlink(missing_ok=True)
+    try:
+        if link:
+            try:
+                os.link(src, tmp)
+            except OSError:
+                shutil.copyfile(src, tmp)  # other filesystem, or no hardlink support
+        else:
+            shutil.copyfile(src, tmp)
+        os.replace(tmp, dest)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+def write_atomic(path: Path, data: bytes):
+    """Write via a sibling temp file and rename, so readers (and hardlinks to the old file) never see partial data."""
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    try:
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+def zip_entries(entries: Dict[str, bytes], zip_path: Optional[Path] = None,
+                codecs: ZipCodecRules = DEFAULT_ZIP_CODECS) -> bytes:
+    """
+    Build a ZIP archive in memory from ``{arcname: data}``, compressing members per
+    ``codecs``; write it atomically to ``zip_path`` if given. Output is byte-identical
+    for identical input.
+    """
+    try:
+        payload = zipwriter.build_zip(entries, codecs)
+        if zip_path is not None:
+            write_atomic(zip_path, payload)
+            logger.info(f"Created zip archive at {zip_path} with entries: {list(entries)}")
+        return payload
+    except Exception as e:
+        logger.error(f"Failed to create zip archive {zip_path or '<memory>'}: {e}", exc_info=True)
+        raise RuntimeError(f"Error zipping files: {e}") from e
+
+def _reduce(img: Image.Image, factor: Tuple[int, int]) -> Image.Image:
+    """
+    Box-reduce ``img`` by ``factor``. Modes reduce() cannot average meaningfully
+    (palette indices, bilevel, 16-bit) are converted band by band, and alpha modes are
+    reduced band by band, so no full-size copy of the decoded image is ever made.
+    """
+    if img.mode in REDUCE_MODES:
+        return img.reduce(factor)
+    if img.mode in ('LA', 'RGBA'):
+        target = img.mode
+    elif img.mode in ('P', 'PA'):
+        target = 'RGBA' if img.mode == 'PA' or 'transparency' in img.info else 'RGB'
+    else:
+        target = 'L' if img.mode == '1' else 'I' if img.mode.startswith('I;') else 'RGBA'
+    fw, fh = factor
+    out = Image.new(target, (img.width // fw, img.height // fh))
+    step = fh * max(1, BAND_ROWS // fh)
+    for top in range(0, out.height * fh, step):
+        band = img.crop((0, top, out.width * fw, min(top + step, out.height * fh)))
+        out.paste(band.convert(target).reduce(factor), (0, top // fh))
+    return out
+
+def load_rgba(image_path: Union[Path, BinaryIO], max_size: Optional[int] = None,
+              reducing_gap: float = REDUCING_GAP) -> Image.Image:
+    """
+    Decode an image once and return it as a fully loaded RGBA buffer.
+
+    With ``max_size`` (the largest surface that will be built from it) the image is
+    only kept as large as needed: JPEGs are scaled down by libjpeg while decoding
+    (``draft``) and other formats are box-reduced by an integer factor (see _reduce)
+    before the RGBA conversion. Both stop at ``reducing_gap`` times ``max_size`` per
+    axis, leaving the final high-quality resample to build_mip_chain. Pillow decodes
+    PNGs and the like whole, so for those the native buffer (4 bytes per pixel for
+    RGB/RGBA) is still built at full resolution; what is avoided are the full-size
+    RGBA and premultiplied copies. estimate_decode_bytes accounts for this.
+    """
+    with Image.open(image_path) as img:
+        if max_size is None:
+            return img.convert('RGBA')
+        floor = max(1, int(max_size * reducing_gap))
+        img.draft(None, (floor, floor))
+        factor = (max(1, img.width // floor), max(1, img.height // floor))
+        if factor == (1, 1):
+            return img.convert('RGBA')
+        return _reduce(img, factor).convert('RGBA')
+
+def load_thumbnail(image_path: Path, size: int) -> Image.Image:
+    """
+    Decode a small RGBA preview that fits in ``size`` x ``size``. JPEGs are decoded at
+    reduced scale by libjpeg (``draft``) and other formats are shrunk with _reduce
+    before resampling, so full-resolution pixels are never converted.
+    """
+    with Image.open(image_path) as img:
+        img.draft('RGB', (size, size))
+        # One factor for both axes keeps the aspect ratio, as Image.thumbnail's own reducing_gap does
+        factor = max(1, min(img.width, img.height) // (size * 2))
+        if factor > 1:
+            img = _reduce(img, (factor, factor))
+        img.thumbnail((size, size), Image.Resampling.BILINEAR)
+        return img.convert('RGBA')
+
+def build_mip_chain(img: Image.Image, sizes: Sequence[int] = AVATAR_SIZES,
+                    resample: int = Image.Resampling.LANCZOS, cascade: bool = True) -> Dict[int, Image.Image]:
+    """
+    Build square RGBA surfaces for every size in ``sizes`` from one decoded buffer.
+    With ``cascade`` each size is resampled from the next larger one, so only the
+    first step touches the full-resolution source. Pass ``cascade=False`` to resample
+    every size straight from the source instead (slower, no cumulative filtering).
+    """
+    chain = {}
+    src = img
+    for size in sorted(set(sizes), reverse=True):
+        src = src.resize((size, size), resample)
+        chain[size] = src
+        if not cascade:
+            src = img
+    return {size: chain[size] for size in sizes}
+
+def encode_png(img: Image.Image) -> bytes:
+    buf = io.BytesIO()
+    img.save(buf, format='PNG')
+    return buf.getvalue()
+
+def encode_dds(img: Union[Image.Image, np.ndarray], fmt: DDSFormat = DDSFormat.DXT5) -> bytes:
+    try:
+        return dds.encode_dds(img, fmt)
+    except Exception as e:
+        width, height = img.size if isinstance(img, Image.Image) else (img.shape[1], img.shape[0])
+        logger.error(f"Failed to encode {width}x{height} DDS: {e}", exc_info=True)
+        raise RuntimeError(f"Error converting to DDS: {e}") from e
+
+def convert_to_dds_chain(image_path: Path, dds_paths: Dict[int, Path], resample: int = Image.Resampling.LANCZOS,
+                         cascade: bool = True, fmt: DDSFormat = DDSFormat.DXT5) -> Dict[int, Path]:
+    """Decode ``image_path`` once and write one DDS per ``{size: dds_path}`` entry."""
+    try:
+        chain = build_mip_chain(load_rgba(image_path, max(dds_paths)), list(dds_paths), resample, cascade)
+        for size, dds_path in dds_paths.items():
+            img = chain[size]
+            img.save(dds_path.with_suffix('.png'))  # Save PNG for preview/debug
+            dds_path.write_bytes(dds.encode_dds(img, fmt))
+        logger.info(f"Converted {image_path} to DDS sizes {list(dds_paths)}")
+        return dds_paths
+    except Exception as e:
+        logger.error(f"Failed to convert {image_path} to DDS chain: {e}", exc_info=True)
+        raise RuntimeError(f"Error converting to DDS: {e}") from e
+
+def convert_to_dds(image_path: Path, dds_path: Path, size: int, fmt: DDSFormat = DDSFormat.DXT5):
     try:
-        img = Image.open(image_path).convert('RGBA').resize((size, size))
+        img = load_rgba(image_path, size).resize((size, size))
         img.save(dds_path.with_suffix('.png'))  # Save PNG for preview/debug
-        imageio.imwrite(str(dds_path), img, format='DDS')
+        dds_path.write_bytes(dds.encode_dds(img, fmt))
         logger.info(f"Converted {image_path} to DDS {dds_path} at size {size}x{size}")
     except Exception as e:
         logger.error(f"Failed to convert {image_path} to DDS {dds_path}: {e}", exc_info=True)
-        raise RuntimeError(f"Error converting to DDS: {e}") from e 
\ No newline at end of file
+        raise RuntimeError(f"Error converting to DDS: {e}") from e
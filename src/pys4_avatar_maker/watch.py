@@ -0,0 +1,328 @@
+import os
+import sys
+import time
+import queue
+import select
+import struct
+import ctypes
+import ctypes.util
+import logging
+import threading
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Set, Tuple
+from .models import UserType, DDSFormat, FTPConfig, BatchResult, UploadCompare, ZipCodecRules, DEFAULT_ZIP_CODECS
+from .cache import PackageCache
+from .ftp import FanOutUploader
+from .scanner import is_candidate, iter_images, sniff_image_format
+from .services import BatchOptions, process_batch_avatars
+from .memory import MemoryBudget
+
+logger = logging.getLogger("pys4_avatar_maker.watch")
+
+# inotify(7) constants
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+_EVENT = struct.Struct('iIII')
+_WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE_SELF | IN_MOVE_SELF
+
+class InotifyWatcher:
+    """
+    Reports files created, written or moved into ``root`` using Linux inotify (through
+    ctypes, no extra dependency). New subfolders are watched as they appear when
+    ``recursive``; a kernel queue overflow triggers a full rescan.
+    """
+    def __init__(self, root: Path, recursive: bool = False):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_init1 failed: {os.strerror(ctypes.get_errno())}")
+        self.root = Path(root)
+        self.recursive = recursive
+        self._dirs: Dict[int, Path] = {}
+        self._watch_tree(self.root)
+
+    def _watch(self, directory: Path) -> bool:
+        wd = self._add_watch(self.fd, os.fsencode(directory), _WATCH_MASK)
+        if wd < 0:
+            logger.warning(f"Cannot watch {directory}: {os.strerror(ctypes.get_errno())}")
+            return False
+        self._dirs[wd] = directory
+        return True
+
+    def _watch_tree(self, top: Path):
+        if not self._watch(top) or not self.recursive:
+            return
+        for dirpath, dirnames, _ in os.walk(top):
+            dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+            for d in dirnames:
+                self._watch(Path(dirpath) / d)
+
+    def poll(self, timeout: float) -> List[Path]:
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            buf = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        changed, offset = [], 0
+        while offset + _EVENT.size <= len(buf):
+            wd, mask, _, length = _EVENT.unpack_from(buf, offset)
+            raw_name = buf[offset + _EVENT.size:offset + _EVENT.size + length].rstrip(b'\0')
+            offset += _EVENT.size + length
+            if mask & IN_Q_OVERFLOW:
+                logger.warning("inotify queue overflowed, rescanning the watch folder")
+                changed.extend(iter_images(self.root, recursive=self.recursive, sniff=False))
+                continue
+            if mask & IN_IGNORED:
+                self._dirs.pop(wd, None)
+                continue
+            directory = self._dirs.get(wd)
+            if directory is None or not raw_name:
+                continue
+            path = directory / os.fsdecode(raw_name)
+            if mask & IN_ISDIR:
+                if self.recursive and mask & (IN_CREATE | IN_MOVED_TO) and not path.name.startswith('.'):
+                    self._watch_tree(path)
+                    # Files may have landed before the watch existed
+                    changed.extend(iter_images(path, recursive=True, sniff=False))
+                continue
+            changed.append(path)
+        return changed
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+class PollingWatcher:
+    """Portable fallback: compares (size, mtime) snapshots of the folder every ``interval`` seconds."""
+    def __init__(self, root: Path, recursive: bool = False, interval: float = 1.0):
+        self.root = Path(root)
+        self.recursive = recursive
+        self.interval = interval
+        self._snapshot = self._scan()
+        self._next = time.monotonic() + interval
+
+    def _scan(self) -> Dict[Path, Tuple[int, int]]:
+        snapshot = {}
+        for path in iter_images(self.root, recursive=self.recursive, include=('*',), sniff=False):
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            snapshot[path] = (st.st_size, st.st_mtime_ns)
+        return snapshot
+
+    def poll(self, timeout: float) -> List[Path]:
+        wait = self._next - time.monotonic()
+        if wait > timeout:
+            time.sleep(timeout)
+            return []
+        time.sleep(max(wait, 0))
+        self._next = time.monotonic() + self.interval
+        snapshot = self._scan()
+        changed = [path for path, sig in snapshot.items() if self._snapshot.get(path) != sig]
+        self._snapshot = snapshot
+        return changed
+
+    def close(self):
+        pass
+
+def make_watcher(root: Path, recursive: bool = False, poll_interval: float = 1.0, use_inotify: Optional[bool] = None):
+    """InotifyWatcher on Linux unless disabled (or unavailable), otherwise PollingWatcher."""
+    if use_inotify is None:
+        use_inotify = sys.platform.startswith('linux')
+    if use_inotify:
+        try:
+            return InotifyWatcher(root, recursive)
+        except (OSError, AttributeError) as e:
+            logger.warning(f"inotify unavailable ({e}), falling back to polling every {poll_interval}s")
+    return PollingWatcher(root, recursive, poll_interval)
+
+class FolderWatcher:
+    """
+    Long-running watch mode: packages (and optionally uploads) every image that appears
+    or changes in ``input_dir``.
+
+    A path is only queued once its size and mtime have been stable for ``settle``
+    seconds and its header sniffs as PNG/JPEG, so files still being copied are not
+    picked up half-written. Stable paths go through a work queue of at most
+    ``queue_size`` entries; while it is full the watcher stops taking new work and keeps
+    the paths pending. A consumer thread takes up to ``batch_size`` paths at a time and
+    runs them through process_batch_avatars in incremental mode, so unchanged re-saves
+    are skipped and FTP uploads interrupted by a restart are finished. One FTP uploader,
+    and so one login per session, serves every batch until run() returns. ``stop()`` ends
+    watching and, by default, drains the queue before run() returns.
+    """
+    def __init__(self, input_dir: Path, user_type: UserType, output_dir: Optional[Path] = None,
+                 ftp_cfg: Optional[FTPConfig] = None, recursive: bool = False, include: Sequence[str] = (),
+                 exclude: Sequence[str] = (), settle: float = 1.0, poll_interval: float = 1.0,
+                 queue_size: int = 256, batch_size: int = 16, workers: Optional[int] = None,
+                 cache: Optional[PackageCache] = None, use_inotify: Optional[bool] = None,
+                 initial_scan: bool = True, on_result: Optional[Callable[[BatchResult], None]] = None,
+                 ftp_targets: Sequence[FTPConfig] = (), ftp_sessions: int = 1, ftp_concurrency: Optional[int] = None,
+                 ftp_compare: UploadCompare = UploadCompare.NONE, zip_codecs: ZipCodecRules = DEFAULT_ZIP_CODECS,
+                 memory_budget: Optional[MemoryBudget] = None, dds_format: DDSFormat = DDSFormat.DXT5):
+        self.input_dir = Path(input_dir)
+        self.output_dir = Path(output_dir) if output_dir else self.input_dir
+        self.user_type = user_type
+        self.ftp_cfg = ftp_cfg
+        self.ftp_targets = ftp_targets
+        self.ftp_sessions = ftp_sessions
+        self.ftp_concurrency = ftp_concurrency
+        self.ftp_compare = ftp_compare
+        self.zip_codecs = zip_codecs
+        self.dds_format = dds_format
+        self.memory_budget = memory_budget
+        self.recursive = recursive
+        self.include = include
+        self.exclude = exclude
+        self.settle = settle
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.workers = workers
+        self.cache = cache
+        self.use_inotify = use_inotify
+        self.initial_scan = initial_scan
+        self.on_result = on_result
+        self.queue: "queue.Queue[Path]" = queue.Queue(maxsize=queue_size)
+        self.processed = 0
+        self.failed = 0
+        self._pending: Dict[Path, Tuple[Optional[Tuple[int, int]], float]] = {}
+        self._queued: Set[Path] = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._abort = threading.Event()
+        self._watching_done = threading.Event()
+        self._uploader: Optional[FanOutUploader] = None
+
+    def stop(self, drain: bool = True):
+        """Stop watching; with ``drain`` queued images are still packaged, otherwise they are dropped."""
+        if not drain:
+            self._abort.set()
+        self._stop.set()
+
+    def _wanted(self, path: Path) -> bool:
+        try:
+            rel = path.relative_to(self.input_dir).as_posix()
+        except ValueError:
+            return False
+        if not self.recursive and '/' in rel:
+            return False
+        return is_candidate(rel, self.include, self.exclude)
+
+    def _note(self, paths: List[Path]):
+        now = time.monotonic()
+        for path in paths:
+            if self._wanted(path):
+                self._pending[path] = (None, now)
+
+    def _settle_pending(self) -> List[Path]:
+        """Return pending paths whose (size, mtime) has not changed for ``settle`` seconds."""
+        now, ready = time.monotonic(), []
+        for path, (sig, since) in list(self._pending.items()):
+            try:
+                st = path.stat()
+            except OSError:
+                del self._pending[path]  # deleted or renamed away before it settled
+                continue
+            current = (st.st_size, st.st_mtime_ns)
+            if current != sig:
+                self._pending[path] = (current, now)
+            elif now - since >= self.settle:
+                ready.append(path)
+        return ready
+
+    def _enqueue(self, ready: List[Path]):
+        for path in ready:
+            with self._lock:
+                if path in self._queued:
+                    del self._pending[path]
+                    continue
+            if sniff_image_format(path) is None:
+                if self._pending[path][0][0]:
+                    logger.warning(f"Skipping {path}: not a PNG or JPEG")
+                    del self._pending[path]
+                continue  # still empty: keep waiting for content
+            try:
+                self.queue.put(path, timeout=0.05)
+            except queue.Full:
+                logger.debug(f"Work queue full, holding {len(self._pending)} pending image(s)")
+                return  # backpressure: leave the rest pending until the consumer catches up
+            with self._lock:
+                self._queued.add(path)
+            del self._pending[path]
+
+    def _consume(self):
+        options = BatchOptions(workers=self.workers, cache=self.cache, incremental=True, cancel=self._abort,
+                               ftp_compare=self.ftp_compare, zip_codecs=self.zip_codecs, dds_format=self.dds_format,
+                               memory_budget=self.memory_budget, ftp_uploader=self._uploader)
+        while True:
+            try:
+                batch = [self.queue.get(timeout=0.2)]
+            except queue.Empty:
+                if self._watching_done.is_set() or self._abort.is_set():
+                    return
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            with self._lock:
+                self._queued.difference_update(batch)
+            if self._abort.is_set():
+                return
+            try:
+                result = process_batch_avatars(batch, self.user_type, self.output_dir, options=options)
+            except Exception as e:
+                logger.error(f"Watch batch failed: {e}", exc_info=True)
+                self.failed += len(batch)
+                continue
+            self.processed += result.succeeded - result.skipped
+            self.failed += result.failed
+            if self.on_result is not None:
+                self.on_result(result)
+
+    def run(self):
+        """Watch until stop() (or KeyboardInterrupt), then drain the queue and return."""
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        watcher = make_watcher(self.input_dir, self.recursive, self.poll_interval, self.use_inotify)
+        targets = list(self.ftp_targets or ([self.ftp_cfg] if self.ftp_cfg else []))
+        self._uploader = FanOutUploader(targets, per_host=self.ftp_sessions,
+                                        max_concurrency=self.ftp_concurrency) if targets else None
+        consumer = threading.Thread(target=self._consume, name="pys4-watch-consumer", daemon=True)
+        consumer.start()
+        logger.info(f"Watching {self.input_dir} with {type(watcher).__name__} (output: {self.output_dir})")
+        try:
+            if self.initial_scan:
+                self._note(list(iter_images(self.input_dir, recursive=self.recursive, include=self.include,
+                                            exclude=self.exclude, sniff=False)))
+            tick = min(0.25, self.settle / 2) if self.settle else 0.25
+            while not self._stop.is_set():
+                self._note(watcher.poll(tick))
+                if self._pending:
+                    self._enqueue(self._settle_pending())
+        finally:
+            watcher.close()
+            self._watching_done.set()
+            if not self._abort.is_set() and self.queue.qsize():
+                logger.info(f"Draining {self.queue.qsize()} queued image(s) before exiting")
+            consumer.join()
+            if self._uploader is not None:
+                self._uploader.close()
+                self._uploader = None
+            logger.info(f"Watch stopped: {self.processed} packaged, {self.failed} failed"
+                        + (f", {len(self._pending)} still settling were left" if self._pending else ""))
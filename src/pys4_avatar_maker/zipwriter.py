@@ -0,0 +1,99 @@
+import os
+import zlib
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatch
+from typing import Dict, List, Optional, Tuple
+from .models import ZipCodec, ZipCodecRules, DEFAULT_ZIP_CODECS
+
+# Minimal ZIP (PKWARE APPNOTE 6.3) writer: no ZIP64, no data descriptors, so every
+# reader, including the unzip code in PS4-Xplorer, can handle the result.
+_LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')
+_CENTRAL_HEADER = struct.Struct('<IHHHHHHIIIHHHHHII')
+_END_OF_CENTRAL_DIR = struct.Struct('<IHHHHIIH')
+_METHODS = {ZipCodec.STORED: 0, ZipCodec.DEFLATE: 8}
+_VERSION_NEEDED = 20
+_VERSION_MADE_BY = (3 << 8) | 20  # Unix, so the external attributes below are honoured
+_EXTERNAL_ATTR = 0o100644 << 16
+_UTF8_FLAG = 0x0800
+_DOS_DATE = (0 << 9) | (1 << 5) | 1  # 1980-01-01, keeps output byte-identical across builds
+_DOS_TIME = 0
+
+# Below this many bytes of compressible data, thread hand-off costs more than it saves
+PARALLEL_MIN_BYTES = 256 * 1024
+
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+def _compress_pool() -> ThreadPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            workers = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count() or 1
+            _pool = ThreadPoolExecutor(max_workers=min(workers, 8), thread_name_prefix="pys4-zip")
+        return _pool
+
+def _reset_pool():
+    # A forked child (e.g. a batch worker) inherits the pool object but none of its threads
+    global _pool, _pool_lock
+    _pool, _pool_lock = None, threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_pool)
+
+def codec_for(name: str, rules: ZipCodecRules) -> Tuple[ZipCodec, int]:
+    for pattern, codec, level in rules:
+        if fnmatch(name, pattern):
+            return codec, level
+    return ZipCodec.STORED, 0
+
+def format_codec_rules(rules: ZipCodecRules) -> str:
+    """Canonical text form of ``rules``, for keys and records that must change with them."""
+    return '|'.join(f"{pattern}={codec.value}:{level}" for pattern, codec, level in rules)
+
+def _encode_member(data: bytes, codec: ZipCodec, level: int) -> Tuple[int, int, bytes]:
+    """Return (method, crc32, payload); zlib releases the GIL, so members compress in parallel."""
+    crc = zlib.crc32(data)
+    if codec == ZipCodec.DEFLATE:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)  # raw deflate, as ZIP stores it
+        packed = compressor.compress(data) + compressor.flush()
+        if len(packed) < len(data):
+            return _METHODS[ZipCodec.DEFLATE], crc, packed
+    return _METHODS[ZipCodec.STORED], crc, data
+
+def build_zip(entries: Dict[str, bytes], codecs: ZipCodecRules = DEFAULT_ZIP_CODECS, parallel: Optional[bool] = None) -> bytes:
+    """
+    Serialise ``{arcname: data}`` as a ZIP archive, compressing each member with the codec
+    and level of the first matching rule in ``codecs``. Deflated members are compressed
+    concurrently when there is enough data to be worth it (or as ``parallel`` forces).
+    A member that does not shrink is stored instead.
+    """
+    names = list(entries)
+    plans = [codec_for(name, codecs) for name in names]
+    work = sum(len(entries[n]) for n, (codec, _) in zip(names, plans) if codec != ZipCodec.STORED)
+    if parallel is None:
+        parallel = work >= PARALLEL_MIN_BYTES and sum(c != ZipCodec.STORED for c, _ in plans) > 1
+    if parallel:
+        pool = _compress_pool()
+        members = list(pool.map(lambda i: _encode_member(entries[names[i]], *plans[i]), range(len(names))))
+    else:
+        members = [_encode_member(entries[name], *plan) for name, plan in zip(names, plans)]
+
+    out: List[bytes] = []
+    central: List[bytes] = []
+    offset = 0
+    for name, (method, crc, payload) in zip(names, members):
+        raw_name = name.encode('utf-8')
+        flags = _UTF8_FLAG if not name.isascii() else 0
+        size = len(entries[name])
+        header = _LOCAL_HEADER.pack(0x04034b50, _VERSION_NEEDED, flags, method, _DOS_TIME, _DOS_DATE,
+                                    crc, len(payload), size, len(raw_name), 0)
+        central.append(_CENTRAL_HEADER.pack(0x02014b50, _VERSION_MADE_BY, _VERSION_NEEDED, flags, method,
+                                            _DOS_TIME, _DOS_DATE, crc, len(payload), size, len(raw_name),
+                                            0, 0, 0, 0, _EXTERNAL_ATTR, offset) + raw_name)
+        out += [header, raw_name, payload]
+        offset += len(header) + len(raw_name) + len(payload)
+    directory = b''.join(central)
+    out += [directory, _END_OF_CENTRAL_DIR.pack(0x06054b50, 0, 0, len(names), len(names), len(directory), offset, 0)]
+    return b''.join(out)
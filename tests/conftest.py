@@ -0,0 +1,39 @@
+import threading
+import pytest
+from pys4_avatar_maker.models import FTPConfig
+
+@pytest.fixture
+def ftp_server(tmp_path):
+    """Start pyftpdlib servers on demand: ``ftp_server(**handler_attrs)`` returns (FTPConfig, remote root)."""
+    pytest.importorskip('pyftpdlib')
+    from pyftpdlib.authorizers import DummyAuthorizer
+    from pyftpdlib.handlers import FTPHandler
+    from pyftpdlib.servers import ThreadedFTPServer
+    running = []
+
+    def start(**handler_attrs):
+        root = tmp_path / f'remote{len(running) or ""}'
+        root.mkdir()
+        authorizer = DummyAuthorizer()
+        authorizer.add_user('u', 'p', str(root), perm='elradfmwMT')
+        server = ThreadedFTPServer(('127.0.0.1', 0), type('Handler', (FTPHandler,),
+                                                          dict(handler_attrs, authorizer=authorizer)))
+        stop = threading.Event()
+
+        def serve():
+            # Close from the serving thread, as bench does: the loop must not outlive the sockets
+            while not stop.is_set():
+                server.serve_forever(timeout=0.1, blocking=False)
+            server.close_all()
+        thread = threading.Thread(target=serve, daemon=True)
+        thread.start()
+        running.append((stop, thread))
+        return FTPConfig(host='127.0.0.1', port=server.address[1], username='u', password='p', upload_dir='/'), root
+    yield start
+    for stop, thread in running:
+        stop.set()
+        thread.join()
+
+@pytest.fixture
+def ftp(ftp_server):
+    return ftp_server()
@@ -0,0 +1,35 @@
+import pickle
+from PIL import Image
+from pys4_avatar_maker.cache import PackageCache
+from pys4_avatar_maker.models import UserType
+from pys4_avatar_maker.services import process_batch_avatars
+
+def test_worker_copy_never_scans_and_merges_back(tmp_path):
+    cache = PackageCache(tmp_path / 'cache', max_bytes=250)
+    cache.put('aa' * 32, b'x' * 100)
+    worker = pickle.loads(pickle.dumps(cache))
+    assert worker.get('aa' * 32) == b'x' * 100
+    assert worker.get('bb' * 32) is None
+    worker.put('cc' * 32, b'y' * 100)
+    worker.put('dd' * 32, b'z' * 100)
+    assert worker._index is None
+    assert cache.changes() is None
+    cache.merge(*worker.changes())
+    assert (cache.stats.hits, cache.stats.misses, cache.stats.stores, cache.stats.evictions) == (1, 1, 3, 1)
+    # Least recently stored goes first
+    assert cache.get('aa' * 32) is None
+    assert cache.get('dd' * 32) == b'z' * 100
+
+def test_batch_workers_report_to_the_parent_cache(tmp_path):
+    images = []
+    for i in range(3):
+        images.append(tmp_path / f'in{i}.png')
+        Image.new('RGBA', (64, 64), (i * 40, 20, 30, 255)).save(images[-1])
+    cache = PackageCache(tmp_path / 'cache')
+    for run in range(2):
+        out = tmp_path / f'out{run}'
+        out.mkdir()
+        result = process_batch_avatars(images, UserType.LOCAL, out, workers=2, cache=cache)
+        assert result.succeeded == 3
+    assert (cache.stats.hits, cache.stats.misses, cache.stats.stores) == (3, 3, 3)
+    assert len(cache._load_index()) == 3
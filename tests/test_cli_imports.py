@@ -0,0 +1,48 @@
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+from PIL import Image
+
+SRC = Path(__file__).resolve().parent.parent / 'src'
+ENV = dict(os.environ, PYTHONPATH=str(SRC))
+# Seconds `batch --help` may take on top of a bare interpreter start; importing
+# PyQt6, numpy and Pillow alone costs several times this
+COLD_START_BUDGET = 0.5
+
+def _imported(stderr: str):
+    # -X importtime lines: "import time: self | cumulative | package"
+    return {line.rsplit('|', 1)[1].strip() for line in stderr.splitlines() if line.startswith('import time:')}
+
+def test_batch_help_does_not_import_qt():
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-m', 'pys4_avatar_maker', 'batch', '--help'],
+                          env=ENV, capture_output=True, text=True, check=True, timeout=60)
+    modules = _imported(proc.stderr)
+    assert 'pys4_avatar_maker.cli' in modules
+    assert not {m for m in modules if m.split('.')[0] == 'PyQt6'}
+
+def _fastest_run(args, runs: int = 3) -> float:
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, *args], env=ENV, stdout=subprocess.DEVNULL, check=True, timeout=60)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def test_batch_help_cold_start_time():
+    bare = _fastest_run(['-c', 'pass'])
+    cli = _fastest_run(['-m', 'pys4_avatar_maker', 'batch', '--help'])
+    assert cli - bare < COLD_START_BUDGET, f"batch --help took {cli:.3f}s, a bare interpreter {bare:.3f}s"
+
+def test_batch_run_does_not_import_qt(tmp_path):
+    (tmp_path / 'in').mkdir()
+    (tmp_path / 'out').mkdir()
+    Image.new('RGBA', (64, 64), (10, 20, 30, 255)).save(tmp_path / 'in' / 'a.png')
+    script = ("import sys\nfrom pys4_avatar_maker.cli import main\n"
+              "code = main(['batch', sys.argv[1], '--output', sys.argv[2], '-j', '1'])\n"
+              "assert code == 0, code\n"
+              "assert not [m for m in sys.modules if m.split('.')[0] == 'PyQt6']\n")
+    subprocess.run([sys.executable, '-c', script, str(tmp_path / 'in'), str(tmp_path / 'out')],
+                   env=ENV, check=True, timeout=120)
+    assert (tmp_path / 'out' / 'a.xavatar').exists()
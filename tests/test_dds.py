@@ -0,0 +1,38 @@
+import io
+import numpy as np
+import pytest
+from PIL import Image
+from pys4_avatar_maker.dds import encode_dds, decode_dds
+from pys4_avatar_maker.models import DDSFormat
+
+def _rgba(width: int, height: int) -> np.ndarray:
+    rng = np.random.default_rng(width * 1000 + height)
+    pixels = rng.integers(0, 256, (height, width, 4), dtype=np.uint8)
+    pixels[: height // 4, :, 3] = 255  # opaque rows
+    pixels[height // 4: height // 2, :, 3] = 0  # transparent rows (BC1 punch-through)
+    return pixels
+
+@pytest.mark.parametrize('fmt', list(DDSFormat))
+@pytest.mark.parametrize('size', [(64, 64), (440, 440), (6, 10)])
+def test_round_trip_matches_pillow(fmt, size):
+    data = encode_dds(_rgba(*size), fmt)
+    with Image.open(io.BytesIO(data)) as img:
+        assert img.size == size
+        reference = np.asarray(img.convert('RGBA'))
+    assert np.array_equal(decode_dds(data), reference)
+
+def test_rgba8_is_lossless():
+    pixels = _rgba(32, 16)
+    assert np.array_equal(decode_dds(encode_dds(pixels, DDSFormat.RGBA8)), pixels)
+
+def test_dds_format_reaches_the_package(tmp_path):
+    import zipfile
+    from pys4_avatar_maker.controllers import create_avatar_package
+    from pys4_avatar_maker.models import UserType
+    source = tmp_path / 'in.png'
+    Image.fromarray(_rgba(64, 64)).save(source)
+    out = tmp_path / 'out.xavatar'
+    create_avatar_package(source, UserType.LOCAL, out, dds_format=DDSFormat.RGBA8)
+    with zipfile.ZipFile(out) as zf:
+        data = zf.read('avatar64.dds')
+    assert len(data) == 128 + 64 * 64 * 4
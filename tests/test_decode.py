@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+from PIL import Image
+from pys4_avatar_maker.memory import estimate_decode_bytes
+from pys4_avatar_maker.utils import _reduce, load_rgba
+
+def _noise(mode, size=(2000, 1800)):
+    pixels = np.random.default_rng(0).integers(0, 255, (size[1], size[0], 4), dtype=np.uint8)
+    img = Image.fromarray(pixels, 'RGBA')
+    return img.quantize(64) if mode == 'P' else img.convert(mode)
+
+@pytest.mark.parametrize('mode', ['RGB', 'RGBA', 'LA', 'L', 'P'])
+def test_load_rgba_reduces_to_the_gap(tmp_path, mode):
+    path = tmp_path / 'big.png'
+    _noise(mode).save(path, compress_level=1)
+    img = load_rgba(path, 440)
+    assert img.mode == 'RGBA'
+    # Box-reduced by an integer factor, but never below reducing_gap (2x) the largest surface
+    assert img.size == (1000, 900)
+    with Image.open(path) as full:
+        expected = np.asarray(full.convert('RGBA').reduce(2))
+    assert np.abs(np.asarray(img).astype(int) - expected).max() <= 1
+
+@pytest.mark.parametrize('mode', ['RGBA', 'LA'])
+def test_alpha_modes_are_reduced_band_by_band(mode):
+    img = _noise(mode, (700, 1100))
+    expected = np.asarray(img.reduce(3))
+    reduced = np.asarray(_reduce(img, (3, 3)))
+    assert reduced.shape[:2] == (1100 // 3, 700 // 3)
+    assert (reduced == expected[:reduced.shape[0], :reduced.shape[1]]).all()
+
+def test_estimate_counts_the_full_size_png_decode(tmp_path):
+    _noise('RGBA').save(tmp_path / 'big.png', compress_level=1)
+    _noise('RGB').save(tmp_path / 'big.jpg', quality=80)
+    # Pillow decodes the PNG whole: 4 bytes per source pixel before any reduction
+    assert estimate_decode_bytes(tmp_path / 'big.png', 440) >= 2000 * 1800 * 4
+    # The JPEG is draft-decoded at half scale
+    assert estimate_decode_bytes(tmp_path / 'big.jpg', 440) < 2000 * 1800 * 4
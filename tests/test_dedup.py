@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+from PIL import Image
+from pys4_avatar_maker.dedup import Deduplicator, dhash
+from pys4_avatar_maker.models import UserType
+from pys4_avatar_maker.services import BatchOptions, process_batch_avatars
+
+def _photo(seed: int, size: int = 600) -> Image.Image:
+    y, x = np.mgrid[0:size, 0:size] / size
+    rng = np.random.default_rng(seed)
+    rgb = np.stack([np.sin(x * rng.uniform(3, 9) + y * rng.uniform(1, 5)), x * y, np.cos(y * rng.uniform(2, 7))], -1)
+    return Image.fromarray(((rgb + 1) * 100).astype(np.uint8), 'RGB')
+
+def _inputs(tmp_path):
+    (tmp_path / 'in').mkdir()
+    a = _photo(1)
+    a.save(tmp_path / 'in' / 'a.png')
+    (tmp_path / 'in' / 'a_copy.png').write_bytes((tmp_path / 'in' / 'a.png').read_bytes())
+    a.resize((300, 300)).save(tmp_path / 'in' / 'a_small.jpg', quality=80)
+    _photo(2).save(tmp_path / 'in' / 'b.png')
+    return [tmp_path / 'in' / name for name in ('a.png', 'a_copy.png', 'a_small.jpg', 'b.png')]
+
+def test_dhash_survives_reencoding(tmp_path):
+    paths = _inputs(tmp_path)
+    a, _, a_small, b = (dhash(p) for p in paths)
+    assert bin(a ^ a_small).count('1') <= 4
+    assert bin(a ^ b).count('1') > 16
+
+def test_fingerprint_matches_original_of(tmp_path):
+    paths = _inputs(tmp_path)
+    deduper = Deduplicator(threshold=4)
+    found = [deduper.original_of(p, deduper.fingerprint(p)) for p in paths]
+    assert found == [None, paths[0], paths[0], None]
+
+def test_batch_links_duplicates(tmp_path):
+    paths = _inputs(tmp_path)
+    (tmp_path / 'out').mkdir()
+    result = process_batch_avatars(paths, UserType.LOCAL, tmp_path / 'out', workers=2, dedup_threshold=4)
+    assert result.succeeded == 4 and result.duplicates == 2
+    assert [item.duplicate_of for item in result.items] == [None, paths[0], paths[0], None]
+    assert (tmp_path / 'out' / 'a_small.xavatar').read_bytes() == (tmp_path / 'out' / 'a.xavatar').read_bytes()
+
+def test_batch_options_with_overrides(tmp_path):
+    paths = _inputs(tmp_path)[:2]
+    (tmp_path / 'out').mkdir()
+    options = BatchOptions(workers=1, dedup=True)
+    result = process_batch_avatars(paths, UserType.LOCAL, tmp_path / 'out', options=options, dedup_link=False)
+    assert result.duplicates == 1 and options.dedup_link
+    copy, original = (tmp_path / 'out' / 'a_copy.xavatar').stat(), (tmp_path / 'out' / 'a.xavatar').stat()
+    assert copy.st_ino != original.st_ino
+    with pytest.raises(TypeError):
+        process_batch_avatars(paths, UserType.LOCAL, tmp_path / 'out', dedup_copy=True)
+
+def test_linked_duplicates_are_uploaded_under_their_own_name(tmp_path, ftp):
+    cfg, remote = ftp
+    paths = _inputs(tmp_path)
+    (tmp_path / 'out').mkdir()
+    result = process_batch_avatars(paths, UserType.LOCAL, tmp_path / 'out', cfg, workers=1, dedup_threshold=4)
+    assert result.duplicates == 2 and result.ftp_transferred == 4
+    assert all(item.ftp_uploaded for item in result.items)
+    assert (remote / 'a_small.xavatar').read_bytes() == (tmp_path / 'out' / 'a.xavatar').read_bytes()
+
+def test_incremental_skips_are_not_fingerprinted(tmp_path, monkeypatch):
+    paths = _inputs(tmp_path)
+    (tmp_path / 'out').mkdir()
+    fingerprinted = []
+    real = Deduplicator.fingerprint
+
+    def counting(self, path, budget=None):
+        fingerprinted.append(path)
+        return real(self, path, budget)
+    monkeypatch.setattr(Deduplicator, 'fingerprint', counting)
+    options = BatchOptions(workers=1, dedup=True, incremental=True)
+    assert process_batch_avatars(paths, UserType.LOCAL, tmp_path / 'out', options=options).skipped == 0
+    assert len(fingerprinted) == 4
+    fingerprinted.clear()
+    assert process_batch_avatars(paths, UserType.LOCAL, tmp_path / 'out', options=options).skipped == 4
+    assert fingerprinted == []
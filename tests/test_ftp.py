@@ -0,0 +1,192 @@
+import hashlib
+import ftplib
+import socket
+import threading
+import time
+from dataclasses import replace
+import pytest
+from pys4_avatar_maker.ftp import FanOutUploader, FTPSession, FTPSessionPool, ftp_target_key
+from pys4_avatar_maker.models import FTPConfig, UploadCompare
+
+DATA = bytes(range(256)) * 400
+
+@pytest.fixture
+def commands(monkeypatch):
+    # Every FTP command sent, verb and argument, in order
+    sent = []
+    real = ftplib.FTP.putcmd
+
+    def putcmd(self, line):
+        sent.append(line)
+        return real(self, line)
+    monkeypatch.setattr(ftplib.FTP, 'putcmd', putcmd)
+    return sent
+
+def _verbs(commands, *verbs):
+    return [line for line in commands if line.split(' ', 1)[0] in verbs]
+
+def _part_name(name: str, data: bytes) -> str:
+    return f".{name}.{hashlib.sha256(data).hexdigest()[:16]}.part"
+
+def test_plain_upload_costs_store_and_rename(ftp, commands):
+    cfg, remote = ftp
+    with FTPSession(cfg) as sess:
+        for i in range(3):
+            sess.upload(f'{i}.xavatar', DATA)
+    assert all((remote / f'{i}.xavatar').read_bytes() == DATA for i in range(3))
+    assert not _verbs(commands, 'SIZE', 'DELE', 'REST')
+    assert len(_verbs(commands, 'NLST')) == 1
+    assert len(_verbs(commands, 'STOR')) == 3
+
+def test_publishes_by_rename(ftp, commands):
+    cfg, remote = ftp
+    with FTPSession(cfg) as sess:
+        transfer = sess.upload('a.xavatar', DATA)
+    part = _part_name('a.xavatar', DATA)
+    assert _verbs(commands, 'STOR') == [f'STOR {part}']
+    assert _verbs(commands, 'RNFR', 'RNTO') == [f'RNFR {part}', 'RNTO a.xavatar']
+    assert [p.name for p in remote.iterdir()] == ['a.xavatar']
+    assert (transfer.sent, transfer.skipped, transfer.resumed_from) == (len(DATA), False, 0)
+
+def test_resumes_a_partial_upload_with_rest(ftp, commands):
+    cfg, remote = ftp
+    (remote / _part_name('a.xavatar', DATA)).write_bytes(DATA[:10000])
+    with FTPSession(cfg) as sess:
+        transfer = sess.upload('a.xavatar', DATA)
+    assert transfer.resumed_from == 10000 and transfer.sent == len(DATA) - 10000 and transfer.saved == 10000
+    assert 'REST 10000' in commands
+    assert (remote / 'a.xavatar').read_bytes() == DATA
+    assert [p.name for p in remote.iterdir()] == ['a.xavatar']
+
+def test_size_compare_skips_same_size(ftp):
+    cfg, remote = ftp
+    with FTPSession(cfg) as sess:
+        assert not sess.upload('a.xavatar', DATA, UploadCompare.SIZE).skipped
+        assert sess.upload('a.xavatar', DATA, UploadCompare.SIZE).skipped
+        assert not sess.upload('a.xavatar', DATA[:-1], UploadCompare.SIZE).skipped
+    assert (remote / 'a.xavatar').read_bytes() == DATA[:-1]
+
+def test_checksum_compare_needs_matching_content(ftp):
+    cfg, remote = ftp
+    changed = DATA[::-1]  # same size, different content
+    with FTPSession(cfg) as sess:
+        assert not sess.upload('a.xavatar', DATA, UploadCompare.CHECKSUM).skipped
+        assert (remote / '.a.xavatar.sha256').read_text().strip() == hashlib.sha256(DATA).hexdigest()
+        assert sess.upload('a.xavatar', DATA, UploadCompare.CHECKSUM).skipped
+        assert not sess.upload('a.xavatar', changed, UploadCompare.CHECKSUM).skipped
+    assert (remote / 'a.xavatar').read_bytes() == changed
+
+def test_plain_upload_removes_a_stale_sidecar(ftp):
+    cfg, remote = ftp
+    with FTPSession(cfg) as sess:
+        sess.upload('a.xavatar', DATA, UploadCompare.CHECKSUM)
+    with FTPSession(cfg) as sess:
+        sess.upload('a.xavatar', DATA[::-1])
+        assert not (remote / '.a.xavatar.sha256').exists()
+        # The sidecar no longer vouches for DATA, so it is sent again
+        assert not sess.upload('a.xavatar', DATA, UploadCompare.CHECKSUM).skipped
+    assert (remote / 'a.xavatar').read_bytes() == DATA
+
+def test_size_compare_after_browsing(ftp):
+    cfg, remote = ftp
+    (remote / 'sub').mkdir()
+    with FTPSession(cfg) as sess:
+        assert sess.list_dirs('/') == ['sub']  # leaves the connection in ASCII mode
+        sess.upload('a.xavatar', DATA)
+        assert sess.upload('a.xavatar', DATA, UploadCompare.SIZE).skipped
+
+def _closed_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def _send(name: str):
+    return lambda cfg, pool: pool.upload(name, DATA)
+
+def test_fan_out_lanes_run_concurrently(ftp):
+    cfg, remote = ftp
+    (remote / 'b').mkdir()
+    targets = [cfg, replace(cfg, upload_dir='/b')]
+    both = threading.Barrier(2, timeout=10)
+
+    def job(target, pool):
+        both.wait()  # only passes if both lanes are transferring at once
+        return pool.upload('a.xavatar', DATA)
+    with FanOutUploader(targets) as uploader:
+        futures = uploader.submit(job)
+        assert [f.result().sent for f in futures.values()] == [len(DATA), len(DATA)]
+    assert (remote / 'a.xavatar').read_bytes() == (remote / 'b' / 'a.xavatar').read_bytes() == DATA
+
+def test_fan_out_respects_max_concurrency(ftp):
+    cfg, remote = ftp
+    (remote / 'b').mkdir()
+    active, peak, lock = [0], [0], threading.Lock()
+
+    def job(target, pool):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        time.sleep(0.05)
+        with lock:
+            active[0] -= 1
+        return pool.upload('a.xavatar', DATA)
+    with FanOutUploader([cfg, replace(cfg, upload_dir='/b')], per_host=2, max_concurrency=1) as uploader:
+        futures = [f for _ in range(3) for f in uploader.submit(job).values()]
+        assert all(f.result().sent == len(DATA) for f in futures)
+    assert peak[0] == 1
+
+def test_unreachable_target_goes_offline_without_stalling_the_others(ftp):
+    cfg, remote = ftp
+    down = FTPConfig(host='127.0.0.1', port=_closed_port(), username='u', password='p', timeout=2)
+    with FanOutUploader([cfg, down]) as uploader:
+        errors = []
+        for i in range(4):
+            futures = uploader.submit(_send(f'{i}.xavatar'))
+            assert futures[ftp_target_key(cfg)].result().sent == len(DATA)
+            errors.append(futures[ftp_target_key(down)].exception())
+        up, off = uploader.results[ftp_target_key(cfg)], uploader.results[ftp_target_key(down)]
+        assert (up.uploaded, up.failed, up.offline) == (4, 0, False)
+        assert (off.uploaded, off.failed, off.offline) == (0, 4, True)
+        # Two connection failures, then the target is skipped without trying
+        assert all(isinstance(e, ConnectionRefusedError) for e in errors[:2])
+        assert all('offline' in str(e) for e in errors[2:])
+
+        previous = uploader.reset()
+        assert previous[ftp_target_key(down)].offline
+        assert not any(r.offline or r.uploaded for r in uploader.results.values())
+        # After a reset the offline target gets another chance
+        futures = uploader.submit(_send('again.xavatar'))
+        assert isinstance(futures[ftp_target_key(down)].exception(), ConnectionRefusedError)
+        assert futures[ftp_target_key(cfg)].result().sent == len(DATA)
+        assert uploader.results[ftp_target_key(cfg)].uploaded == 1
+    assert sorted(p.name for p in remote.iterdir()) == ['0.xavatar', '1.xavatar', '2.xavatar', '3.xavatar',
+                                                         'again.xavatar']
+
+def test_pool_logs_in_once_per_session(ftp, commands):
+    cfg, remote = ftp
+    with FTPSessionPool(cfg, size=2) as pool:
+        for i in range(4):
+            pool.upload(f'{i}.xavatar', DATA)
+    assert len(_verbs(commands, 'USER')) == 1
+    assert len(list(remote.iterdir())) == 4
+
+def test_idle_session_is_probed_with_noop(ftp, commands):
+    cfg, _ = ftp
+    with FTPSession(cfg, keepalive=0) as sess:
+        sess.upload('a.xavatar', DATA)
+        sess.upload('b.xavatar', DATA)
+    assert len(_verbs(commands, 'NOOP')) == 1  # before the second upload; the first one connected
+    assert len(_verbs(commands, 'USER')) == 1
+
+@pytest.mark.parametrize('keepalive', [0, 30])
+def test_reconnects_after_the_server_drops_the_connection(ftp_server, commands, keepalive):
+    # The server closes idle control connections after half a second
+    cfg, remote = ftp_server(timeout=0.5)
+    with FTPSession(cfg, keepalive=keepalive) as sess:
+        sess.upload('a.xavatar', DATA)
+        time.sleep(1.5)
+        # Found stale by NOOP (keepalive=0), or by the upload itself, which then retries
+        transfer = sess.upload('b.xavatar', DATA)
+    assert transfer.sent == len(DATA)
+    assert len(_verbs(commands, 'USER')) == 2
+    assert (remote / 'b.xavatar').read_bytes() == DATA
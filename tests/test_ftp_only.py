@@ -0,0 +1,67 @@
+import logging
+import os
+import pytest
+from PIL import Image
+from pys4_avatar_maker import services
+from pys4_avatar_maker.models import UserType
+from pys4_avatar_maker.services import iter_batch_avatars
+
+def _inputs(tmp_path):
+    (tmp_path / 'in').mkdir()
+    names = ['a.png', 'b.png', 'a_copy.png', 'c.png', 'a_again.png']
+    for i, name in enumerate(names):
+        Image.new('RGBA', (64, 64), (0 if name.startswith('a') else 50 * i, 10, 20, 255)).save(tmp_path / 'in' / name)
+    return [tmp_path / 'in' / name for name in names]
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_duplicates_are_uploaded_under_their_own_name(tmp_path, ftp, workers):
+    cfg, remote = ftp
+    paths = _inputs(tmp_path)
+    # upload_buffer=1: the last duplicate arrives after its original's package has left memory
+    items = list(iter_batch_avatars(paths, UserType.LOCAL, None, cfg, workers=workers, dedup=True, upload_buffer=1))
+    assert sorted(item.image_path.name for item in items) == sorted(p.name for p in paths)
+    assert all(item.success and item.ftp_uploaded for item in items)
+    assert {p.name for p in remote.iterdir()} == {p.stem + '.xavatar' for p in paths}
+    original = (remote / 'a.xavatar').read_bytes()
+    assert (remote / 'a_copy.xavatar').read_bytes() == original
+    assert (remote / 'a_again.xavatar').read_bytes() == original
+
+def test_duplicate_fails_with_its_original(tmp_path, ftp, monkeypatch):
+    cfg, remote = ftp
+    paths = _inputs(tmp_path)
+    real = services.upload_via_ftp
+
+    def flaky(ftp_cfg, file_path, *args, **kwargs):
+        if file_path.name == 'a.xavatar':
+            raise PermissionError("550 no")
+        return real(ftp_cfg, file_path, *args, **kwargs)
+    monkeypatch.setattr(services, 'upload_via_ftp', flaky)
+    items = list(iter_batch_avatars(paths[:3], UserType.LOCAL, None, cfg, workers=1, dedup=True))
+    order = [item.image_path.name for item in items]
+    assert order.index('a_copy.png') > order.index('a.png')
+    by_name = dict(zip(order, items))
+    assert not by_name['a.png'].ftp_uploaded and not by_name['a_copy.png'].ftp_uploaded
+    assert by_name['a_copy.png'].ftp_errors
+    assert by_name['b.png'].ftp_uploaded
+    assert not (remote / 'a_copy.xavatar').exists()
+
+def test_late_duplicate_is_rebuilt_in_the_pool(tmp_path, ftp, monkeypatch, caplog):
+    cfg, remote = ftp
+    (tmp_path / 'in').mkdir()
+    paths = [tmp_path / 'in' / f'{i:02d}.png' for i in range(12)] + [tmp_path / 'in' / 'late.png']
+    for i, path in enumerate(paths[:-1]):
+        Image.new('RGBA', (64, 64), (i * 20, 10, 20, 255)).save(path)
+    paths[-1].write_bytes(paths[0].read_bytes())
+    parent, real = os.getpid(), services._build_package
+
+    def pool_only(*args, **kwargs):
+        assert os.getpid() != parent, "package built on the batch's consumer thread"
+        return real(*args, **kwargs)
+    monkeypatch.setattr(services, '_build_package', pool_only)
+    with caplog.at_level(logging.INFO, logger='pys4_avatar_maker.services'):
+        items = list(iter_batch_avatars(paths, UserType.LOCAL, None, cfg, workers=2, dedup=True, upload_buffer=1))
+    assert all(item.success and item.ftp_uploaded for item in items)
+    late = next(item for item in items if item.image_path.name == 'late.png')
+    assert late.duplicate_of == paths[0]
+    assert 'rebuilding it for late.png' in caplog.text
+    assert (remote / 'late.xavatar').read_bytes() == (remote / '00.xavatar').read_bytes()
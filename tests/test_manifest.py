@@ -0,0 +1,38 @@
+from PIL import Image
+from pys4_avatar_maker.manifest import BatchManifest
+from pys4_avatar_maker.models import UserType, DDSFormat, ZipCodec, DEFAULT_ZIP_CODECS
+from pys4_avatar_maker.services import process_batch_avatars
+
+STORED = (('*', ZipCodec.STORED, 0),)
+
+def _batch(tmp_path, **kwargs):
+    out = tmp_path / 'out'
+    out.mkdir(exist_ok=True)
+    return process_batch_avatars([tmp_path / 'in.png'], UserType.LOCAL, out, workers=1, incremental=True, **kwargs)
+
+def test_settings_change_rebuilds(tmp_path):
+    Image.new('RGBA', (64, 64), (10, 20, 30, 255)).save(tmp_path / 'in.png')
+    assert _batch(tmp_path).skipped == 0
+    assert _batch(tmp_path).skipped == 1
+    assert _batch(tmp_path, zip_codecs=STORED).skipped == 0
+    assert _batch(tmp_path, zip_codecs=STORED).skipped == 1
+    assert _batch(tmp_path, zip_codecs=STORED, dds_format=DDSFormat.RGBA8).skipped == 0
+
+def test_is_current_compares_settings(tmp_path):
+    img, out = tmp_path / 'in.png', tmp_path / 'in.xavatar'
+    Image.new('RGBA', (8, 8)).save(img)
+    out.write_bytes(b'package')
+    manifest = BatchManifest(tmp_path)
+    manifest.record(img, out, UserType.LOCAL, DEFAULT_ZIP_CODECS, DDSFormat.DXT1)
+    assert manifest.is_current(img, out, UserType.LOCAL, DEFAULT_ZIP_CODECS, DDSFormat.DXT1)
+    assert not manifest.is_current(img, out, UserType.LOCAL, DEFAULT_ZIP_CODECS, DDSFormat.DXT5)
+    assert not manifest.is_current(img, out, UserType.LOCAL, STORED, DDSFormat.DXT1)
+    assert not manifest.is_current(img, out, UserType.OFFLINE_ACTIVATED, DEFAULT_ZIP_CODECS, DDSFormat.DXT1)
+
+def test_resampler_change_rebuilds(tmp_path, monkeypatch):
+    from pys4_avatar_maker import manifest
+    Image.new('RGBA', (64, 64), (10, 20, 30, 255)).save(tmp_path / 'in.png')
+    assert _batch(tmp_path).skipped == 0
+    monkeypatch.setattr(manifest, 'RESAMPLER_VERSION', manifest.RESAMPLER_VERSION + 1)
+    assert _batch(tmp_path).skipped == 0
+    assert _batch(tmp_path).skipped == 1
@@ -0,0 +1,117 @@
+import json
+import re
+import threading
+import pytest
+from PIL import Image
+from pys4_avatar_maker.metrics import (aggregate_spans, collect_spans, format_prometheus, span,
+                                       write_trace_jsonl)
+from pys4_avatar_maker.models import AVATAR_SIZES, STAGE_BUCKETS, Span, StageHistogram, UserType
+from pys4_avatar_maker.services import process_batch_avatars
+
+@pytest.mark.parametrize('duration, bucket', [
+    (0.0, 0),
+    (STAGE_BUCKETS[0], 0),  # bounds are inclusive, as Prometheus' le
+    (STAGE_BUCKETS[0] * 1.0001, 1),
+    (STAGE_BUCKETS[5], 5),
+    (STAGE_BUCKETS[-1], len(STAGE_BUCKETS) - 1),
+    (STAGE_BUCKETS[-1] + 1, len(STAGE_BUCKETS)),  # overflow bucket, +Inf
+])
+def test_observe_bucket_edges(duration, bucket):
+    hist = StageHistogram()
+    hist.observe(duration, 10)
+    assert hist.counts.index(1) == bucket and sum(hist.counts) == 1
+    assert (hist.count, hist.total, hist.bytes) == (1, duration, 10)
+
+def test_observe_accumulates():
+    hist = StageHistogram()
+    for duration in (0.0005, 0.0005, 0.3, 60.0):
+        hist.observe(duration, 1)
+    assert hist.counts[0] == 2 and hist.counts[STAGE_BUCKETS.index(0.5)] == 1 and hist.counts[-1] == 1
+    assert (hist.count, hist.bytes) == (4, 4)
+    assert hist.total == pytest.approx(60.301)
+
+def test_spans_are_only_recorded_inside_a_collector():
+    with span('read', 5):
+        pass
+    with collect_spans(False) as off:
+        with span('read', 5):
+            pass
+    with collect_spans() as spans:
+        with span('zip') as zipped:
+            zipped.bytes = 7
+    assert off == [] and [(s.stage, s.bytes) for s in spans] == [('zip', 7)]
+
+def test_collectors_are_per_thread():
+    with collect_spans() as outer:
+        def other():
+            with collect_spans() as inner:
+                with span('ftp'):
+                    pass
+            seen.append(inner)
+        seen = []
+        thread = threading.Thread(target=other)
+        thread.start()
+        thread.join()
+        with span('write'):
+            pass
+    assert [s.stage for s in outer] == ['write']
+    assert [s.stage for s in seen[0]] == ['ftp']
+
+@pytest.fixture
+def batch(tmp_path, ftp):
+    cfg, remote = ftp
+    (tmp_path / 'in').mkdir()
+    (tmp_path / 'out').mkdir()
+    paths = []
+    for i in range(3):
+        paths.append(tmp_path / 'in' / f'{i}.png')
+        Image.new('RGBA', (300, 300), (80 * i, 10, 20, 255)).save(paths[-1])
+    # Two workers: items are built in worker processes and uploaded on the uploader's threads
+    return process_batch_avatars(paths, UserType.LOCAL, tmp_path / 'out', cfg, workers=2, metrics=True)
+
+def test_batch_has_spans_for_every_stage(batch):
+    assert batch.total == 3 and batch.failed == 0 and batch.ftp_transferred == 3
+    for item in batch.items:
+        stages = [s.stage for s in item.spans]
+        assert sorted(set(stages)) == sorted(['read', 'decode', 'resize', 'dds_encode', 'zip', 'write', 'ftp'])
+        assert stages.count('dds_encode') == len(AVATAR_SIZES)
+        assert stages.count('ftp') == 1
+        by_stage = {s.stage: s for s in item.spans}
+        assert by_stage['read'].bytes == item.image_path.stat().st_size
+        assert by_stage['write'].bytes == by_stage['zip'].bytes == by_stage['ftp'].bytes == item.bytes
+        # Wall-clock starts: the upload (uploader thread) follows the write (worker process)
+        assert by_stage['ftp'].start >= by_stage['write'].start
+    assert batch.stages['dds_encode'].count == 3 * len(AVATAR_SIZES)
+    assert all(batch.stages[stage].count == 3 for stage in ('read', 'decode', 'resize', 'zip', 'write', 'ftp'))
+
+def test_spans_are_off_by_default(tmp_path):
+    Image.new('RGBA', (64, 64)).save(tmp_path / 'a.png')
+    (tmp_path / 'out').mkdir()
+    result = process_batch_avatars([tmp_path / 'a.png'], UserType.LOCAL, tmp_path / 'out')
+    assert result.items[0].spans == [] and result.stages == {}
+
+def test_trace_jsonl(batch, tmp_path):
+    write_trace_jsonl(batch, tmp_path / 'trace.jsonl')
+    rows = [json.loads(line) for line in (tmp_path / 'trace.jsonl').read_text().splitlines()]
+    assert len(rows) == sum(len(item.spans) for item in batch.items)
+    assert set(rows[0]) == {'image', 'stage', 'start', 'duration', 'bytes'}
+    assert {row['image'] for row in rows} == {str(item.image_path) for item in batch.items}
+
+def test_prometheus_format(batch):
+    batch.stages = aggregate_spans([Span('zip', 0.0, 0.003, 100), Span('zip', 0.0, 20.0, 50)])
+    lines = format_prometheus(batch, prefix='t').splitlines()
+    # Buckets are cumulative and end with +Inf == count
+    assert 't_stage_duration_seconds_bucket{stage="zip",le="0.0025"} 0' in lines
+    assert 't_stage_duration_seconds_bucket{stage="zip",le="0.005"} 1' in lines
+    assert 't_stage_duration_seconds_bucket{stage="zip",le="10.0"} 1' in lines
+    assert 't_stage_duration_seconds_bucket{stage="zip",le="+Inf"} 2' in lines
+    assert 't_stage_duration_seconds_sum{stage="zip"} 20.003' in lines
+    assert 't_stage_duration_seconds_count{stage="zip"} 2' in lines
+    assert 't_stage_bytes{stage="zip"} 150' in lines
+    assert 't_batch_items 3' in lines and 't_batch_uploaded 3' in lines
+    assert '# TYPE t_stage_duration_seconds histogram' in lines
+    # Every sample belongs to a metric declared with a TYPE line
+    declared = {line.split(' ')[2] for line in lines if line.startswith('# TYPE ')}
+    for line in lines:
+        if not line.startswith('#'):
+            assert re.sub(r'_(bucket|sum|count)$', '', re.split(r'[{ ]', line)[0]) in declared
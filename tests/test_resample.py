@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+from PIL import Image
+from pys4_avatar_maker.models import AVATAR_SIZES
+from pys4_avatar_maker.resample import resample_chain, resample_chains, resample_stack
+
+def test_chain_sizes_and_solid_colour():
+    chain = resample_chain(Image.new('RGBA', (700, 500), (200, 30, 90, 255)))
+    assert list(chain) == list(AVATAR_SIZES)
+    for size, pixels in chain.items():
+        assert pixels.shape == (size, size, 4) and pixels.dtype == np.uint8
+        assert (np.abs(pixels.astype(int) - (200, 30, 90, 255)) <= 1).all()
+
+def test_transparent_pixels_do_not_bleed():
+    pixels = np.zeros((128, 128, 4), dtype=np.uint8)
+    pixels[:, :64] = (0, 255, 0, 0)  # invisible green
+    pixels[:, 64:] = (255, 0, 0, 255)
+    chain = resample_chain(pixels, (64,))
+    opaque = chain[64][:, 33:]
+    assert (opaque[..., 1] == 0).all()
+
+def test_gamma_correct_average():
+    # A fine black/white checkerboard averages to mid grey in linear light (sRGB 188, not 128)
+    pixels = np.full((256, 256, 4), 255, dtype=np.uint8)
+    pixels[(np.indices((256, 256)).sum(axis=0) % 2 == 0)] = (0, 0, 0, 255)
+    grey = resample_chain(pixels, (64,))[64][16:48, 16:48, :3]
+    assert np.abs(grey.astype(int) - 188).max() <= 2
+
+def test_rejects_non_rgba():
+    with pytest.raises(ValueError):
+        resample_chain(np.zeros((8, 8, 3), dtype=np.uint8))
+
+def _photo(seed, size=(300, 220), alpha=False):
+    pixels = np.random.default_rng(seed).integers(0, 256, (size[1], size[0], 4), dtype=np.uint8)
+    if not alpha:
+        pixels[..., 3] = 255
+    return Image.fromarray(pixels, 'RGBA')
+
+def test_stack_matches_single_images():
+    # Opaque and translucent images share one stack; each comes out as if resized alone
+    images = [_photo(0), _photo(1, alpha=True), _photo(2)]
+    for stacked, img in zip(resample_stack(images), images):
+        single = resample_chain(img)
+        assert all(np.array_equal(stacked[size], single[size]) for size in AVATAR_SIZES)
+    assert (resample_stack(images)[0][64][..., 3] == 255).all()
+
+def test_chains_group_sizes_and_keep_order():
+    images = [_photo(0), _photo(1, (200, 200)), _photo(2), _photo(3, (200, 200), alpha=True)]
+    chains = resample_chains(images, (64,))
+    assert all(np.array_equal(chain[64], resample_chain(img, (64,))[64]) for chain, img in zip(chains, images))
+
+def test_stack_needs_one_size():
+    with pytest.raises(ValueError):
+        resample_stack([_photo(0), _photo(1, (200, 200))])
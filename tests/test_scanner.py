@@ -0,0 +1,58 @@
+import logging
+from PIL import Image
+from pys4_avatar_maker.scanner import iter_images, sniff_image_format
+
+def _png(path, fmt='PNG'):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    Image.new('RGB', (4, 4)).save(path, fmt)
+    return path
+
+def _names(root, **kwargs):
+    return [p.relative_to(root).as_posix() for p in iter_images(root, sort=True, **kwargs)]
+
+def test_recursion_is_opt_in(tmp_path):
+    _png(tmp_path / 'a.png')
+    _png(tmp_path / 'sub' / 'b.png')
+    _png(tmp_path / 'sub' / 'deeper' / 'c.png')
+    assert _names(tmp_path) == ['a.png']
+    assert _names(tmp_path, recursive=True) == ['a.png', 'sub/b.png', 'sub/deeper/c.png']
+
+def test_hidden_entries_and_other_suffixes_are_ignored(tmp_path):
+    _png(tmp_path / 'a.png')
+    _png(tmp_path / '.hidden.png')
+    _png(tmp_path / '.cache' / 'b.png')
+    (tmp_path / 'notes.txt').write_text('hi')
+    assert _names(tmp_path, recursive=True) == ['a.png']
+
+def test_include_and_exclude_globs(tmp_path):
+    _png(tmp_path / 'a.png')
+    _png(tmp_path / 'raw' / 'b.png')
+    _png(tmp_path / 'keep' / 'c.png')
+    _png(tmp_path / 'keep' / 'd.image')
+    assert _names(tmp_path, recursive=True, exclude=['raw']) == ['a.png', 'keep/c.png']
+    assert _names(tmp_path, recursive=True, include=['keep/*']) == ['keep/c.png', 'keep/d.image']
+
+def test_sniffing_drops_impostors_and_keeps_misnamed_images(tmp_path, caplog):
+    _png(tmp_path / 'jpeg_really.png', 'JPEG')
+    _png(tmp_path / 'png_really.jpg')
+    (tmp_path / 'text.png').write_text('not an image')
+    (tmp_path / 'empty.jpeg').write_bytes(b'')
+    with caplog.at_level(logging.INFO, logger='pys4_avatar_maker.scanner'):
+        assert _names(tmp_path) == ['jpeg_really.png', 'png_really.jpg']
+    assert sniff_image_format(tmp_path / 'jpeg_really.png') == 'jpeg'
+    assert sniff_image_format(tmp_path / 'png_really.jpg') == 'png'
+    assert sum('Skipping' in r.message for r in caplog.records) == 2
+    # Without sniffing the name is all that counts
+    assert _names(tmp_path, sniff=False) == ['empty.jpeg', 'jpeg_really.png', 'png_really.jpg', 'text.png']
+
+def test_streams_depth_first_without_scanning_ahead(tmp_path):
+    _png(tmp_path / 'a' / '1.png')
+    (tmp_path / 'b').mkdir()
+    _png(tmp_path / 'c.png')
+    it = iter_images(tmp_path, recursive=True, sort=True)
+    # Files of the root come before its subfolders, which are visited in name order
+    assert next(it) == tmp_path / 'c.png'
+    assert next(it) == tmp_path / 'a' / '1.png'
+    # 'b' has not been listed yet, so a file added now still turns up
+    _png(tmp_path / 'b' / '2.png')
+    assert list(it) == [tmp_path / 'b' / '2.png']
@@ -0,0 +1,65 @@
+import io
+import json
+import threading
+import urllib.error
+import urllib.request
+import numpy as np
+import pytest
+from PIL import Image
+from pys4_avatar_maker.server import AvatarService, make_server
+
+@pytest.fixture(scope='module')
+def server():
+    service = AvatarService(workers=1)
+    httpd = make_server(service, port=0)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+    service.close()
+
+def _post(httpd, body: bytes):
+    url = f"http://127.0.0.1:{httpd.server_address[1]}/avatar"
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, data=body, method='POST'), timeout=60) as resp:
+            return resp.status, resp.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+
+def _encoded(fmt: str) -> bytes:
+    buf = io.BytesIO()
+    Image.fromarray(np.random.default_rng(0).integers(0, 256, (300, 300, 3), dtype=np.uint8)).save(buf, fmt)
+    return buf.getvalue()
+
+def test_valid_image(server):
+    status, body = _post(server, _encoded('PNG'))
+    assert status == 200 and body[:2] == b'PK'
+
+@pytest.mark.parametrize('body', [
+    _encoded('JPEG')[:2000],  # truncated
+    _encoded('PNG')[:3000],
+    _encoded('PNG')[:8] + b'garbage' * 10,  # broken header
+    _encoded('PNG')[:40] + bytes(100) + _encoded('PNG')[140:],  # corrupt chunk
+])
+def test_bad_image_is_a_client_error(server, body):
+    status, payload = _post(server, body)
+    assert status == 422
+    assert 'decoded' in json.loads(payload)['error'] or 'supported' in json.loads(payload)['error']
+
+def test_server_fault_is_500(server, monkeypatch):
+    def broken(*args, **kwargs):
+        raise OSError("disk on fire")
+    monkeypatch.setattr(server.service, 'render', broken)
+    status, _ = _post(server, _encoded('PNG'))
+    assert status == 500
+
+def test_worker_crash_is_500(server, monkeypatch):
+    from concurrent.futures.process import BrokenProcessPool
+
+    class Crashed:
+        def submit(self, *args):
+            raise BrokenProcessPool("worker killed")
+    monkeypatch.setattr(server.service, '_pool', Crashed())
+    status, payload = _post(server, _encoded('PNG') + b'\0')  # miss the response cache
+    assert status == 500
+    assert 'crashed' in json.loads(payload)['error']
@@ -0,0 +1,59 @@
+import os
+import time
+import pytest
+from PIL import Image
+
+pytest.importorskip('PyQt6.QtWidgets')
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+from PyQt6.QtCore import QModelIndex, Qt  # noqa: E402
+from PyQt6.QtWidgets import QApplication  # noqa: E402
+from pys4_avatar_maker.ui_main import ThumbnailModel  # noqa: E402
+
+DECORATION = Qt.ItemDataRole.DecorationRole
+
+@pytest.fixture(scope='module')
+def app():
+    return QApplication.instance() or QApplication([])
+
+@pytest.fixture
+def images(tmp_path):
+    paths = []
+    for i in range(4):
+        paths.append(tmp_path / f'{i}.png')
+        Image.new('RGBA', (300, 200), (i * 60, 0, 0, 255)).save(paths[-1])
+    return paths
+
+def _load(app, model, row):
+    # Request the row's thumbnail and wait until the pool delivered it
+    model.data(model.index(row), DECORATION)
+    deadline = time.monotonic() + 30
+    while str(model._paths[row]) not in model._cache:
+        assert time.monotonic() < deadline, "thumbnail never loaded"
+        app.processEvents()
+        time.sleep(0.01)
+
+def test_row_count(app, images):
+    model = ThumbnailModel(images)
+    assert model.rowCount() == model.rowCount(QModelIndex()) == 4
+    assert model.rowCount(model.index(0)) == 0
+    model.shutdown()
+
+def test_thumbnails_load_off_thread_and_fit(app, images):
+    model = ThumbnailModel(images, thumb_size=50)
+    assert model.data(model.index(0), DECORATION) is model._placeholder
+    _load(app, model, 0)
+    pixmap = model.data(model.index(0), DECORATION)
+    assert (pixmap.width(), pixmap.height()) == (50, 33)
+    model.shutdown()
+
+def test_cache_evicts_least_recently_used(app, images):
+    model = ThumbnailModel(images, cache_size=2)
+    _load(app, model, 0)
+    _load(app, model, 1)
+    model.data(model.index(0), DECORATION)  # touch 0: 1 is now the oldest
+    _load(app, model, 2)
+    assert list(model._cache) == [str(images[0]), str(images[2])]
+    assert model.data(model.index(1), DECORATION) is model._placeholder  # evicted, requested again
+    _load(app, model, 1)
+    assert list(model._cache) == [str(images[2]), str(images[1])]
+    model.shutdown()
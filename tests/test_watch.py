@@ -0,0 +1,57 @@
+import threading
+import time
+import pytest
+from PIL import Image
+from pys4_avatar_maker.models import FTPConfig, UserType
+from pys4_avatar_maker.watch import FolderWatcher
+
+def _ftp_server(root):
+    pytest.importorskip('pyftpdlib')
+    from pyftpdlib.authorizers import DummyAuthorizer
+    from pyftpdlib.handlers import FTPHandler
+    from pyftpdlib.servers import ThreadedFTPServer
+    authorizer = DummyAuthorizer()
+    authorizer.add_user('u', 'p', str(root), perm='elradfmwMT')
+    logins = []
+    handler = type('Handler', (FTPHandler,), {'authorizer': authorizer, 'on_login': lambda self, user: logins.append(user)})
+    server = ThreadedFTPServer(('127.0.0.1', 0), handler)
+    stop = threading.Event()
+
+    def serve():
+        while not stop.is_set():
+            server.serve_forever(timeout=0.1, blocking=False)
+        server.close_all()
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    return server, logins, stop, thread
+
+def _wait_for(condition, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.05)
+
+def test_watch_logs_in_once_across_batches(tmp_path):
+    remote = tmp_path / 'remote'
+    remote.mkdir()
+    server, logins, stop, serving = _ftp_server(remote)
+    in_dir = tmp_path / 'in'
+    in_dir.mkdir()
+    results = []
+    cfg = FTPConfig(host='127.0.0.1', port=server.address[1], username='u', password='p', upload_dir='/')
+    watcher = FolderWatcher(in_dir, UserType.LOCAL, tmp_path / 'out', cfg, settle=0.1, poll_interval=0.05,
+                            workers=1, use_inotify=False, on_result=results.append)
+    thread = threading.Thread(target=watcher.run)
+    thread.start()
+    try:
+        for i in range(3):
+            Image.new('RGBA', (64, 64), (i * 60, 0, 0, 255)).save(in_dir / f'{i}.png')
+            _wait_for(lambda i=i: (remote / f'{i}.xavatar').exists() and len(results) > i)
+    finally:
+        watcher.stop()
+        thread.join(timeout=30)
+        stop.set()
+        serving.join()
+    assert len(results) == 3
+    assert [sum(host.uploaded for host in r.ftp_hosts.values()) for r in results] == [1, 1, 1]
+    assert logins == ['u']
@@ -0,0 +1,47 @@
+import io
+import os
+import subprocess
+import sys
+import zipfile
+from pathlib import Path
+import pytest
+from pys4_avatar_maker.models import DEFAULT_ZIP_CODECS, ZipCodec
+from pys4_avatar_maker.zipwriter import build_zip
+
+SRC = Path(__file__).resolve().parent.parent / 'src'
+
+@pytest.mark.parametrize('parallel', [False, True])
+def test_build_zip_round_trips(parallel):
+    entries = {'a.dds': bytes(range(256)) * 2048, 'b.txt': b'hello' * 1000, 'c.bin': b''}
+    rules = (('*.txt', ZipCodec.STORED, 0),) + DEFAULT_ZIP_CODECS
+    with zipfile.ZipFile(io.BytesIO(build_zip(entries, rules, parallel))) as zf:
+        assert zf.testzip() is None
+        assert {name: zf.read(name) for name in zf.namelist()} == entries
+        assert zf.getinfo('b.txt').compress_type == zipfile.ZIP_STORED
+
+EXPORT_THEN_BATCH = '''
+import sys
+from pathlib import Path
+import numpy as np
+from PIL import Image
+from pys4_avatar_maker.controllers import create_avatar_package
+from pys4_avatar_maker.models import UserType
+from pys4_avatar_maker.services import process_batch_avatars
+from pys4_avatar_maker.zipwriter import build_zip
+root = Path(sys.argv[1])
+(root / 'out').mkdir()
+rng = np.random.default_rng(0)
+images = []
+for i in range(3):
+    images.append(root / f'in{i}.png')
+    Image.fromarray(rng.integers(0, 256, (512, 512, 4), dtype=np.uint8)).save(images[-1])
+build_zip({'a': bytes(300000), 'b': bytes(300000)}, parallel=True)  # start the compression threads here
+create_avatar_package(images[0], UserType.LOCAL, root / 'single.xavatar')
+result = process_batch_avatars(images, UserType.LOCAL, root / 'out', workers=2)
+assert result.succeeded == 3, result
+'''
+
+def test_batch_after_in_process_export_does_not_hang(tmp_path):
+    # Batch workers are forked from a parent whose compression pool already has threads
+    subprocess.run([sys.executable, '-c', EXPORT_THEN_BATCH, str(tmp_path)], check=True, timeout=120,
+                   env=dict(os.environ, PYTHONPATH=str(SRC)))